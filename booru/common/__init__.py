@@ -0,0 +1,6 @@
+"""
+Shared helpers for the booru scrapers
+
+Each site scraper is a standalone script; they put the booru folder on
+sys.path and import from this package.
+"""
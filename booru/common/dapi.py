@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Gelbooru-style DAPI (index.php?page=dapi) listing with image URLs and tags
+"""
+
+import logging
+import xml.etree.ElementTree as ET
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import quote_plus, urljoin, urlparse
+
+import requests
+
+from common.shards import iter_shards, plan_shards
+from common.tagtypes import TagTypeCache
+
+logger = logging.getLogger(__name__)
+
+# Posts asked for per DAPI page, the most Gelbooru 0.2 sites serve
+DAPI_PAGE_LIMIT = 1000
+
+# DAPI tag type ids; deprecated tags are counted as general
+DAPI_TAG_TYPES = {0: 'general', 1: 'artist', 3: 'copyright', 4: 'character', 5: 'meta', 6: 'general'}
+
+
+class DapiClient:
+    """
+    Lists posts through a Gelbooru-family DAPI
+    
+    Post listings come with image URLs and MD5s, but tags only as one flat
+    string. Their categories are kept in a TagTypeCache, so each tag is
+    categorized once. With `tag_batch`, how many tags one lookup may
+    name, they are looked up with the tag DAPI while listing. Gelbooru
+    0.2 sites take a single name per lookup, which would cost more
+    requests than reading post pages, so they pass 0: entries keep their
+    raw tag_names and categories are learned from the post pages of posts
+    with unknown tags (see post_tags). `limit` is the page size asked for; a server that
+    caps it lower is noticed on the first page and paged by what it
+    serves. Listing pages go through `fetch_listing` and tag lookups
+    through `request`, so both use the scraper's throttle, retries and
+    caches.
+    """
+    
+    def __init__(self, base_url: str,
+                 fetch_listing: Callable[[str, Callable[[str], Dict]], Dict],
+                 request: Callable[[str], requests.Response],
+                 tag_types: TagTypeCache,
+                 category_names: Dict[str, str],
+                 api_key: Optional[str] = None,
+                 user_id: Optional[str] = None,
+                 tag_batch: int = 1,
+                 limit: int = DAPI_PAGE_LIMIT):
+        self.base_url = base_url
+        self.fetch_listing = fetch_listing
+        self.request = request
+        self.tag_types = tag_types
+        self.category_names = category_names
+        self.api_key = api_key
+        self.user_id = user_id
+        self.tag_batch = max(0, tag_batch)
+        self.limit = limit
+        # Posts per page the server serves; pid counts pages of this size
+        self.page_size = limit
+    
+    def _url(self, query: str) -> str:
+        url = f"{self.base_url}/index.php?page=dapi&{query}"
+        if self.api_key and self.user_id:
+            url += f"&api_key={quote_plus(self.api_key)}&user_id={quote_plus(str(self.user_id))}"
+        return url
+    
+    def posts_url(self, tags: str, pid: int, limit: Optional[int] = None) -> str:
+        """URL of DAPI page `pid` (0-based) for search tags"""
+        encoded_tags = '+'.join(quote_plus(tag) for tag in tags.split())
+        return self._url(f"s=post&q=index&limit={limit or self.limit}&pid={pid}&tags={encoded_tags}")
+    
+    def tags_url(self, names: List[str]) -> str:
+        """URL looking up the type of some tags"""
+        if len(names) == 1:
+            return self._url(f"s=tag&q=index&name={quote_plus(names[0])}")
+        encoded_names = '+'.join(quote_plus(name) for name in names)
+        return self._url(f"s=tag&q=index&limit={len(names)}&names={encoded_names}")
+    
+    @staticmethod
+    def _parse_xml(text: str, root_tag: str) -> ET.Element:
+        """Parse a DAPI response, raising ValueError for error replies"""
+        try:
+            root = ET.fromstring(text)
+        except ET.ParseError as e:
+            raise ValueError(f"Unexpected DAPI response: {e}")
+        if root.tag != root_tag:
+            # e.g. <response success="false" reason="..."/> for a missing or bad API key
+            raise ValueError(f"Unexpected DAPI response: {root.get('reason') or root.text or root.tag}")
+        return root
+    
+    @staticmethod
+    def _field(element: ET.Element, name: str) -> Optional[str]:
+        # Gelbooru 0.2 sites use attributes, gelbooru.com child elements
+        value = element.get(name)
+        if value is None:
+            value = element.findtext(name)
+        return value
+    
+    def parse_posts(self, text: str) -> Dict:
+        """Parse a post DAPI page into post_list fields plus the raw tag names"""
+        root = self._parse_xml(text, 'posts')
+        count = self._field(root, 'count')
+        
+        posts = []
+        for element in root.findall('post'):
+            image_url = self._field(element, 'file_url')
+            if image_url:
+                # Some sites answer with protocol-relative or site-relative URLs
+                image_url = urljoin(self.base_url + '/', image_url)
+            posts.append({
+                'post_id': int(self._field(element, 'id')),
+                'image_url': image_url or None,
+                'file_extension': (urlparse(image_url).path.rpartition('.')[2].lower() or None
+                                   if image_url else None),
+                'md5': self._field(element, 'md5'),
+                'tag_names': (self._field(element, 'tags') or '').split()
+            })
+        return {'posts': posts, 'count': int(count) if count else None}
+    
+    def parse_tag_types(self, text: str) -> Dict[str, str]:
+        """Parse a tag DAPI reply into tag name -> category"""
+        types = {}
+        for element in self._parse_xml(text, 'tags').findall('tag'):
+            name = self._field(element, 'name')
+            if name is None:
+                continue
+            try:
+                types[name] = DAPI_TAG_TYPES.get(int(self._field(element, 'type')), 'general')
+            except (TypeError, ValueError):
+                types[name] = 'general'
+        return types
+    
+    def lookup_tag_types(self, names: List[str]) -> Dict[str, str]:
+        """Look up the categories of some tags with the tag DAPI"""
+        return self.parse_tag_types(self.request(self.tags_url(names)).text)
+    
+    def get_page(self, tags: str, pid: int) -> Dict:
+        """Get one DAPI page of posts, still with raw tag names"""
+        return self.fetch_listing(self.posts_url(tags, pid), self.parse_posts)
+    
+    def count_posts(self, tags: str) -> Optional[int]:
+        """Number of posts matching search tags, from the count attribute of a one-post page"""
+        return self.fetch_listing(self.posts_url(tags, 0, limit=1), self.parse_posts)['count']
+    
+    def _observe_page_size(self, page: Dict, pid: int):
+        """Lower page_size when page `pid` is short but the count says more posts follow it"""
+        served = len(page['posts'])
+        if (0 < served < self.page_size and page['count'] is not None
+                and page['count'] > pid * self.page_size + served):
+            logger.info(f"Server serves {served} posts per DAPI page (asked for {self.limit})")
+            self.page_size = served
+    
+    def _iter_raw_pages(self, tags: str, pid: int = 0) -> Iterator[Tuple[List[Dict], int]]:
+        """Yield the parsed posts for search tags page by page from page `pid`, still with raw tag names"""
+        while True:
+            logger.info(f"Fetching API page {pid + 1}...")
+            page = self.get_page(tags, pid)
+            if not page['posts']:
+                break
+            self._observe_page_size(page, pid)
+            logger.info(f"Found {len(page['posts'])} posts on API page {pid + 1}")
+            yield page['posts'], pid + 1
+            
+            # Servers cap pages below the limit asked for, so a short page
+            # does not mark the end; the count or an empty page does
+            if page['count'] is not None and pid * self.page_size + len(page['posts']) >= page['count']:
+                break
+            pid += 1
+    
+    def _resolve(self, posts: List[Dict]):
+        """Look up the categories of the posts' new tags, if this site batches lookups"""
+        if self.tag_batch:
+            self.tag_types.resolve([name for post in posts for name in post['tag_names']],
+                                   self.lookup_tag_types, self.tag_batch)
+    
+    def iter_pages(self, tags: str, pid: int = 0) -> Iterator[Tuple[List[Dict], int]]:
+        """
+        Yield the posts for search tags page by page, with image URL and categorized tags
+        
+        Each page comes with the pid of the next one, where an interrupted
+        listing continues. New tags are looked up after every page, so
+        batches can be smaller than with get_all_posts.
+        """
+        for posts, next_pid in self._iter_raw_pages(tags, pid):
+            self._resolve(posts)
+            yield [self.categorize(post) for post in posts], next_pid
+    
+    def iter_shards(self, tags: str, shard_pages: int, workers: int = 1,
+                    below: Optional[int] = None) -> Iterator[Tuple[List[Dict], int]]:
+        """
+        Yield the posts for search tags one ID-range shard at a time, newest first
+        
+        The search is split into id:>A id:<B ranges of about `shard_pages`
+        pages each (see common.shards), sized with count probes, and
+        `workers` shards are listed at a time, so deep searches are not
+        paged through one pid after the other. Each shard comes with its
+        lowest post ID; pass it as `below` to continue an interrupted
+        listing with the posts below it.
+        """
+        if below is not None:
+            tags = f"{tags} id:<{below}"
+        # The first page bounds the ID ranges with its newest post, counts the
+        # whole search and shows how many posts the server serves per page
+        first = self.get_page(tags, 0)
+        if not first['posts']:
+            return
+        self._observe_page_size(first, 0)
+        
+        def range_tags(low, high):
+            return f"{tags} id:>{low - 1} id:<{high + 1}"
+        
+        shards = plan_shards(lambda low, high: self.count_posts(range_tags(low, high)),
+                             1, first['posts'][0]['post_id'], shard_pages * self.page_size, first['count'])
+        
+        def list_shard(shard):
+            low, high = shard
+            logger.info(f"Listing posts {low}..{high}...")
+            return [post for posts, _ in self._iter_raw_pages(range_tags(low, high)) for post in posts]
+        
+        for posts, low in iter_shards(list_shard, shards, workers):
+            self._resolve(posts)
+            yield [self.categorize(post) for post in posts], low
+    
+    def get_all_posts(self, tags: str) -> List[Dict]:
+        """Get every post for search tags with image URL and categorized tags"""
+        all_posts = [post for posts, _ in self._iter_raw_pages(tags) for post in posts]
+        logger.info(f"Total posts found: {len(all_posts)}")
+        self._resolve(all_posts)
+        return [self.categorize(post) for post in all_posts]
+    
+    def categorize(self, post: Dict) -> Dict:
+        """Turn a parsed post's raw tag names into the site's tag categories, if looked up"""
+        post = dict(post)
+        if self.tag_batch:
+            post['tags'] = self.tag_types.categorize(post.pop('tag_names'), self.category_names)
+        return post
+    
+    def post_tags(self, post: Dict) -> Optional[Dict[str, List[str]]]:
+        """
+        Get a listed post's categorized tags, or None if its post page is needed
+        
+        Entries listed without tag lookups have them once every one of
+        their tag_names has a known category.
+        """
+        if 'tags' in post:
+            return post['tags']
+        names = post.get('tag_names')
+        if names is None or self.tag_types.missing(names):
+            return None
+        return self.tag_types.categorize(names, self.category_names)
+    
+    def learn_tag_types(self, tags: Dict[str, List[str]]):
+        """Record the categories of tags read from a post page, keyed like the site's tags files"""
+        categories = {key: category for category, key in self.category_names.items()}
+        # Post pages may show tag names with spaces, the DAPI never does
+        types = {name.replace(' ', '_'): categories[key]
+                 for key, names in tags.items() if key in categories for name in names}
+        new = self.tag_types.missing(types)
+        if new:
+            self.tag_types.update({name: types[name] for name in new})
+            self.tag_types.save()
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Page drift: posts moving across page boundaries while a tag is listed
+"""
+
+import logging
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+
+def sorted_by_id(tags: str) -> bool:
+    """Whether a search lists newest post ID first, i.e. has no sort: or order: metatag"""
+    return not any(tag.lower().startswith(('sort:', 'order:')) for tag in tags.split())
+
+
+def _descending(post_ids: List[int]) -> bool:
+    return all(higher > lower for higher, lower in zip(post_ids, post_ids[1:]))
+
+
+class PageCollector:
+    """
+    Ordered set of the post IDs a listing found, counting page drift
+    
+    Uploads during a listing push every post further down, so a page can
+    start with posts the page before it ended with. add() keeps each post
+    once, in listing order, and counts the posts seen again and the pages
+    they were on; any such overlap means the listing is drifting.
+    """
+    
+    def __init__(self):
+        self.post_ids: Dict[int, None] = {}
+        self.duplicates = 0
+        self.drifted_pages = 0
+        self.recovered = 0
+    
+    @property
+    def drifting(self) -> bool:
+        return self.drifted_pages > 0
+    
+    def add(self, post_ids: Iterable[int]) -> List[int]:
+        """Record a page's post IDs and return the ones not seen before, in order"""
+        post_ids = list(post_ids)
+        new_post_ids = [post_id for post_id in dict.fromkeys(post_ids) if post_id not in self.post_ids]
+        if len(new_post_ids) < len(post_ids):
+            self.duplicates += len(post_ids) - len(new_post_ids)
+            self.drifted_pages += 1
+        self.post_ids.update(dict.fromkeys(new_post_ids))
+        return new_post_ids
+
+
+def track_drift(pages: Iterable[Tuple[List[int], T]],
+                fetch_below: Optional[Callable[[int], List[int]]] = None) -> Iterator[Tuple[List[int], T]]:
+    """
+    Yield each listed post once, measuring and mending page drift
+    
+    `pages` gives post IDs with a cursor per page, as the sites' page
+    iterators do; each page is yielded with the posts not seen on an
+    earlier page. Pages fetched out of order, as parallel listings do, can
+    also miss posts: when a page was fetched with less drift than the one
+    before it, the posts in between moved across the boundary unseen.
+    Once the listing is seen to drift, a newest-first page that does not
+    reach back to the previous page's last post is checked with
+    `fetch_below(post_id)`, an ID-anchored page of the posts right below a
+    post (e.g. an id:<N search), and the posts found in the gap are put in
+    front of it. Without `fetch_below` drift is only counted.
+    """
+    collector = PageCollector()
+    previous: List[int] = []
+    for post_ids, cursor in pages:
+        if (fetch_below and collector.drifting and previous and post_ids
+                and _descending(previous) and _descending(post_ids) and post_ids[0] < previous[-1]):
+            missed = []
+            anchor = previous[-1]
+            while True:
+                below = [post_id for post_id in fetch_below(anchor) if post_id < anchor]
+                gap = [post_id for post_id in below if post_id > post_ids[0]]
+                missed.extend(gap)
+                # The gap may be longer than one anchored page
+                if not gap or len(gap) < len(below):
+                    break
+                anchor = gap[-1]
+            missed = [post_id for post_id in missed if post_id not in collector.post_ids]
+            if missed:
+                logger.info(f"Page drift: {len(missed)} posts had moved past the page boundary, listed them")
+                collector.recovered += len(missed)
+                post_ids = missed + list(post_ids)
+        
+        previous = list(post_ids)
+        yield collector.add(post_ids), cursor
+    
+    if collector.drifting or collector.recovered:
+        logger.info(f"Page drift: {collector.duplicates} posts seen again on {collector.drifted_pages} pages, "
+                    f"{collector.recovered} skipped posts recovered")
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+"""
+On-disk HTTP response cache
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+import zlib
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Directory under the state dir
+HTTP_CACHE_DIR = 'http_cache'
+DEFAULT_CACHE_SIZE_MB = 512
+# Post pages barely change once posted; search results change all the time
+POST_PAGE_TTL = 7 * 24 * 3600
+LISTING_PAGE_TTL = 10 * 60
+ZSTD_LEVEL = 3
+
+
+def _compress(data: bytes) -> Tuple[bytes, str]:
+    """Compress a body with zstd, or zlib when zstandard is not installed"""
+    if zstandard is not None:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data), '.zst'
+    return zlib.compress(data), '.zz'
+
+
+def _decompress(data: bytes, suffix: str) -> Optional[bytes]:
+    if suffix == '.zst':
+        if zstandard is None:
+            return None
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+def parse_cache_ttl(value: str) -> Tuple[str, float]:
+    """Parse a PATTERN=SECONDS command-line value"""
+    pattern, sep, seconds = value.rpartition('=')
+    try:
+        ttl = float(seconds)
+        re.compile(pattern)
+    except (ValueError, re.error):
+        ttl = -1.0
+    if not sep or not pattern or ttl < 0:
+        raise argparse.ArgumentTypeError(f"expected REGEX=SECONDS, got '{value}'")
+    return pattern, ttl
+
+
+class ResponseCache:
+    """
+    Content-addressed cache of successful GET responses
+    
+    Only URLs matching one of `ttls` (regex, seconds) are cached, each for
+    its pattern's TTL; the first matching pattern wins. Bodies are stored
+    compressed under the SHA-256 of their content, so identical pages
+    fetched under different URLs are kept once; an SQLite index maps URLs
+    to bodies. When the bodies exceed `max_bytes` the least recently used
+    URLs are evicted. Concurrent requests for the same URL are collapsed:
+    one thread fetches, the others wait and read its result.
+    """
+    
+    def __init__(self, directory: Path, ttls: List[Tuple[str, float]],
+                 max_bytes: int = DEFAULT_CACHE_SIZE_MB * 1024 * 1024,
+                 clock: Callable[[], float] = time.time):
+        self.directory = Path(directory)
+        self.bodies_dir = self.directory / 'bodies'
+        self.bodies_dir.mkdir(parents=True, exist_ok=True)
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in ttls]
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.inflight: Dict[str, threading.Event] = {}
+        self.hits = 0
+        
+        self.conn = sqlite3.connect(str(self.directory / 'index.sqlite'), timeout=60,
+                                    isolation_level=None, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS entries ('
+                          'url TEXT PRIMARY KEY, digest TEXT NOT NULL, headers TEXT NOT NULL, '
+                          'expires REAL NOT NULL, accessed REAL NOT NULL)')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS bodies ('
+                          'digest TEXT PRIMARY KEY, file TEXT NOT NULL, size INTEGER NOT NULL)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+    
+    def ttl_for(self, url: str) -> float:
+        """Seconds a response for the URL may be reused (0 = not cached)"""
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+        return 0.0
+    
+    def get(self, url: str) -> Optional[requests.Response]:
+        """Get a fresh cached response for a URL"""
+        now = self.clock()
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT e.digest, e.headers, e.expires, b.file FROM entries e '
+                'JOIN bodies b ON b.digest = e.digest WHERE e.url = ?', (url,)).fetchone()
+            if row is None:
+                return None
+            digest, headers, expires, file = row
+            if expires <= now:
+                self._delete_entry(url, digest)
+                return None
+            self.conn.execute('UPDATE entries SET accessed = ? WHERE url = ?', (now, url))
+        
+        path = self.bodies_dir / file
+        try:
+            content = _decompress(path.read_bytes(), path.suffix)
+        except (OSError, zlib.error, ValueError) as e:
+            logger.warning(f"Dropping unreadable cache entry for {url}: {e}")
+            content = None
+        if content is None:
+            with self.lock:
+                self._delete_entry(url, digest)
+            return None
+        
+        self.hits += 1
+        response = requests.Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.url = url
+        response.headers = CaseInsensitiveDict(json.loads(headers))
+        response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+        response._content = content
+        return response
+    
+    def put(self, url: str, response: requests.Response):
+        """Store a 200 response for the URL's TTL"""
+        ttl = self.ttl_for(url)
+        if ttl <= 0 or response.status_code != 200:
+            return
+        
+        content = response.content
+        digest = hashlib.sha256(content).hexdigest()
+        # Bodies are decoded already; the stored headers must not claim otherwise
+        headers = {name: value for name, value in response.headers.items()
+                   if name.lower() not in ('content-encoding', 'content-length', 'transfer-encoding',
+                                           'set-cookie')}
+        now = self.clock()
+        
+        with self.lock:
+            known = self.conn.execute('SELECT 1 FROM bodies WHERE digest = ?', (digest,)).fetchone()
+            if not known:
+                data, suffix = _compress(content)
+                file = f"{digest[:2]}/{digest}{suffix}"
+                self._write_body(self.bodies_dir / file, data)
+                self.conn.execute('INSERT OR REPLACE INTO bodies (digest, file, size) VALUES (?, ?, ?)',
+                                  (digest, file, len(data)))
+            
+            old = self.conn.execute('SELECT digest FROM entries WHERE url = ?', (url,)).fetchone()
+            self.conn.execute('INSERT OR REPLACE INTO entries (url, digest, headers, expires, accessed) '
+                              'VALUES (?, ?, ?, ?, ?)', (url, digest, json.dumps(headers), now + ttl, now))
+            if old and old[0] != digest:
+                self._drop_unused_body(old[0])
+            self._evict()
+    
+    def get_or_fetch(self, url: str, fetch: Callable[[], requests.Response]) -> requests.Response:
+        """Answer from the cache, or fetch once even if several threads ask at the same time"""
+        cached = self.get(url)
+        if cached is not None:
+            return cached
+        
+        with self.lock:
+            event = self.inflight.get(url)
+            leader = event is None
+            if leader:
+                event = self.inflight[url] = threading.Event()
+        
+        if not leader:
+            event.wait()
+            cached = self.get(url)
+            if cached is not None:
+                return cached
+            # The leader failed or got no cacheable answer; ask ourselves
+            return fetch()
+        
+        try:
+            response = fetch()
+            self.put(url, response)
+            return response
+        finally:
+            with self.lock:
+                del self.inflight[url]
+            event.set()
+    
+    @staticmethod
+    def _write_body(path: Path, data: bytes):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    
+    def _delete_entry(self, url: str, digest: str):
+        self.conn.execute('DELETE FROM entries WHERE url = ?', (url,))
+        self._drop_unused_body(digest)
+    
+    def _drop_unused_body(self, digest: str):
+        """Delete a body no URL refers to any more"""
+        if self.conn.execute('SELECT 1 FROM entries WHERE digest = ? LIMIT 1', (digest,)).fetchone():
+            return
+        row = self.conn.execute('SELECT file FROM bodies WHERE digest = ?', (digest,)).fetchone()
+        self.conn.execute('DELETE FROM bodies WHERE digest = ?', (digest,))
+        if row:
+            try:
+                (self.bodies_dir / row[0]).unlink()
+            except FileNotFoundError:
+                pass
+    
+    def _evict(self):
+        """Drop least recently used entries until the bodies fit in max_bytes"""
+        total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM bodies').fetchone()[0]
+        while total > self.max_bytes:
+            row = self.conn.execute('SELECT url, digest FROM entries ORDER BY accessed LIMIT 1').fetchone()
+            if row is None:
+                break
+            self._delete_entry(*row)
+            total = self.conn.execute('SELECT COALESCE(SUM(size), 0) FROM bodies').fetchone()[0]
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""
+Incremental sync: list only the posts added since the last sync
+"""
+
+from typing import Dict, Iterable, List, Optional
+
+# Newest-first listings stop after this many pages in a row of known posts
+DEFAULT_KNOWN_PAGES = 2
+
+
+def high_water_mark(metadata: Dict, post_list: List[Dict]) -> Optional[int]:
+    """Highest post ID the task has seen, or None for an empty task"""
+    mark = max([metadata.get('max_post_id') or 0] + [p['post_id'] for p in post_list])
+    return mark or None
+
+
+def newer_than(tags: str, mark: int) -> str:
+    """Search tags restricted server-side to posts above the high-water mark"""
+    return f"{tags} id:>{mark}"
+
+
+class KnownPagesStop:
+    """
+    Tells a newest-first listing walk when the rest is already known
+    
+    Call it with each page's post IDs; it returns True once `limit` pages
+    in a row held only known posts. More than one page is required so a
+    post deleted or re-tagged near the page boundary does not end the
+    walk too early.
+    """
+    
+    def __init__(self, known_post_ids: Iterable[int], limit: int = DEFAULT_KNOWN_PAGES):
+        self.known_post_ids = set(known_post_ids)
+        self.limit = max(1, limit)
+        self.streak = 0
+    
+    def __call__(self, post_ids: List[int]) -> bool:
+        if post_ids and all(post_id in self.known_post_ids for post_id in post_ids):
+            self.streak += 1
+        else:
+            self.streak = 0
+        return self.streak >= self.limit
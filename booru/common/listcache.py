@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Conditional-request cache for listing pages
+"""
+
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Set
+
+import requests
+
+from common.state import load_json_state, save_json_state
+
+logger = logging.getLogger(__name__)
+
+# Stored in the task folder next to post_list.json
+LISTING_CACHE_FILE = 'listing_cache.json'
+
+
+class ListingCache:
+    """
+    ETag/Last-Modified validators and parsed results of listing pages
+    
+    On the next fetch of a URL the validators are sent as If-None-Match /
+    If-Modified-Since; a 304 Not Modified answer reuses the parsed result
+    stored for that page instead of downloading and parsing it again.
+    Pages served without validators are not cached, and save() keeps only
+    the pages fetched in this run: URLs that change between syncs, such
+    as id:>N searches from a new high-water mark, are never asked for
+    again and would otherwise pile up.
+    """
+    
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.entries: Dict[str, Dict] = load_json_state(self.path)
+        self.touched: Set[str] = set()
+        self.hits = 0
+        self.lock = threading.Lock()
+    
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        """Get the validator headers for a URL seen before"""
+        with self.lock:
+            entry = self.entries.get(url)
+        headers = {}
+        if entry and entry.get('etag'):
+            headers['If-None-Match'] = entry['etag']
+        if entry and entry.get('last_modified'):
+            headers['If-Modified-Since'] = entry['last_modified']
+        return headers
+    
+    def fetch(self, url: str, request: Callable[..., requests.Response],
+              parse: Callable[[str], Dict]) -> Dict:
+        """
+        Fetch a listing page through `request(url, headers=...)` and parse it
+        
+        Returns the parsed page, from the cache if the server says it has
+        not changed.
+        """
+        with self.lock:
+            self.touched.add(url)
+        response = request(url, headers=self.conditional_headers(url))
+        
+        if response.status_code == 304:
+            with self.lock:
+                entry = self.entries.get(url)
+                if entry is not None:
+                    self.hits += 1
+                    logger.info("Listing page not modified, reusing cached post IDs")
+                    return entry['data']
+            # A 304 we did not ask for; fetch the page unconditionally
+            response = request(url)
+        
+        data = parse(response.text)
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        
+        with self.lock:
+            if response.status_code == 200 and (etag or last_modified):
+                self.entries[url] = {
+                    'etag': etag,
+                    'last_modified': last_modified,
+                    'data': data
+                }
+            else:
+                self.entries.pop(url, None)
+        return data
+    
+    def save(self):
+        """Write the pages fetched in this run to the task folder"""
+        with self.lock:
+            self.entries = {url: entry for url, entry in self.entries.items() if url in self.touched}
+            save_json_state(self.path, self.entries)
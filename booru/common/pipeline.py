@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+Streaming listing-to-download pipeline
+"""
+
+import logging
+import queue
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Listed posts waiting for a download worker; the listing pauses while it is full
+PIPELINE_QUEUE_SIZE = 500
+
+# Marks the end of the producer's items in the queue
+_END = object()
+
+
+def begin_listing(metadata: Dict, tags: str, cursor: Any = None, mode: Optional[str] = None):
+    """
+    Record in metadata that a listing of `tags` starts at `cursor`
+    
+    append_pages moves listing_cursor past every page it saves and clears
+    the keys once the pages run out. A task whose metadata still names
+    listing_tags was interrupted mid-listing; passing listing_tags and
+    listing_cursor back to the site's page iterator continues it after
+    the last saved page. What a cursor holds (a page number, a pid, a
+    next page URL, ...) is up to each site; None is the first page.
+    Sites whose options change what a cursor means name the `mode` the
+    listing runs in (see match_listing_mode).
+    """
+    metadata['listing_tags'] = tags
+    metadata['listing_cursor'] = cursor
+    metadata['listing_mode'] = mode
+
+
+def match_listing_mode(metadata: Dict, mode: str, keep: Optional[Callable[[Any], bool]] = None):
+    """
+    Make sure a saved listing cursor is read in the mode that wrote it
+    
+    Page 301 of a numeric listing is not post ID 301 of a keyset one, nor
+    is a DAPI page index an HTML post offset, so a checkpoint saved in
+    another mode than `mode` starts the listing over from its first page;
+    append_pages skips the posts listed again, which costs requests but
+    no posts. `keep(cursor)` picks cursors that mean the same in every
+    mode. Checkpoints saved before listing_mode was recorded are used as
+    they are.
+    """
+    saved = metadata.get('listing_mode')
+    cursor = metadata.get('listing_cursor')
+    if saved is not None and saved != mode and cursor is not None and not (keep and keep(cursor)):
+        logger.warning(f"The interrupted listing was saved in {saved} mode, not {mode}; "
+                       "listing it again from the first page")
+        metadata['listing_cursor'] = None
+    metadata['listing_mode'] = mode
+
+
+def append_pages(pages: Iterable[Tuple[List[Dict], Any]], post_list: List[Dict], task_manager,
+                 metadata: Dict) -> Iterator[Tuple[int, Dict]]:
+    """
+    Add listed pages to post_list as they arrive and yield the new entries
+    
+    `pages` gives each page's entries with the cursor of the listing after
+    it (see begin_listing). The post list, total_posts and the cursor are
+    saved together after every page, so what has been listed is on disk
+    from the first page on and an interrupted listing can continue where
+    it stopped. Entries are yielded with their 1-based position in
+    post_list, as download_posts takes them. Posts already in the list,
+    e.g. pushed onto the next page by uploads during the listing, are
+    skipped.
+    """
+    known_post_ids = set(post['post_id'] for post in post_list)
+    for entries, cursor in pages:
+        with task_manager.lock:
+            start = len(post_list)
+            for entry in entries:
+                if entry['post_id'] not in known_post_ids:
+                    known_post_ids.add(entry['post_id'])
+                    post_list.append(entry)
+            new_entries = post_list[start:]
+            metadata['total_posts'] = len(post_list)
+            metadata['listing_cursor'] = cursor
+            task_manager.save_post_list(post_list)
+            task_manager.save_metadata(metadata)
+        yield from enumerate(new_entries, start + 1)
+    
+    logger.info(f"Total posts found: {len(post_list)}")
+    with task_manager.lock:
+        metadata['total_posts'] = len(post_list)
+        metadata['listing_tags'] = None
+        metadata['listing_cursor'] = None
+        metadata['listing_mode'] = None
+        task_manager.save_post_list(post_list)
+        task_manager.save_metadata(metadata)
+
+
+def prefetch(items: Iterable[T], size: int = PIPELINE_QUEUE_SIZE) -> 'Prefetch':
+    """
+    Iterate over `items` on a background thread, at most `size` items ahead
+    
+    Lets the listing keep paging while the caller downloads the posts
+    listed so far, and pauses it whenever `size` posts are waiting. An
+    exception raised by `items` is re-raised here once the items before
+    it have been taken. The background thread starts right away, so the
+    listing runs while the caller still works through other items; close
+    the result once done with it, also when stopping early.
+    """
+    return Prefetch(items, size)
+
+
+class Prefetch(Iterator[T]):
+    """
+    Items of an iterable produced by a background thread (see prefetch)
+    
+    close() stops the producer and waits for it, so once it returns the
+    listing no longer writes task files behind the caller's back; a page
+    being listed at that moment is finished and saved first. Unlike a
+    generator's close(), it also stops a producer whose items were never
+    asked for.
+    """
+    
+    def __init__(self, items: Iterable[T], size: int = PIPELINE_QUEUE_SIZE):
+        self.buffer = queue.Queue(maxsize=max(1, size))
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._produce, args=(iter(items),), name='listing', daemon=True)
+        self.thread.start()
+    
+    def _put(self, item, error=None) -> bool:
+        while not self.stopped.is_set():
+            try:
+                self.buffer.put((item, error), timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+    
+    def _produce(self, items: Iterator[T]):
+        try:
+            for item in items:
+                if not self._put(item):
+                    return
+        except BaseException as e:
+            self._put(_END, e)
+        else:
+            self._put(_END)
+        finally:
+            # A generator such as append_pages is left stopped, not suspended
+            close = getattr(items, 'close', None)
+            if close is not None:
+                close()
+    
+    def __next__(self) -> T:
+        while not self.stopped.is_set():
+            try:
+                item, error = self.buffer.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if item is _END:
+                self.close()
+                if error is not None:
+                    raise error
+                break
+            return item
+        raise StopIteration
+    
+    def close(self):
+        """Stop the producer and wait for it to finish"""
+        self.stopped.set()
+        if self.thread is not threading.current_thread():
+            self.thread.join()
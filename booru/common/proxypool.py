@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Pool of egress proxies with per-proxy rate budgets and health scores
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+import requests
+
+from common.ratelimit import HostRateLimiter
+
+logger = logging.getLogger(__name__)
+
+PROXY_STRATEGIES = ('round-robin', 'least-loaded')
+DEFAULT_PROXY_STRATEGY = 'round-robin'
+DEFAULT_PROXY_MAX_FAILURES = 3     # consecutive failures that eject a proxy
+DEFAULT_PROXY_COOLDOWN = 60.0      # seconds an ejected proxy sits out (doubles per repeat)
+MAX_COOLDOWN_DOUBLINGS = 4
+
+# Answers that say the proxy, not the site, is the problem: no response at
+# all, proxy auth failure, or the site blocking/limiting the proxy's IP
+PROXY_FAILURE_STATUSES = {403, 407, 429}
+
+# Weight of the newest sample in the moving averages
+SCORE_SMOOTHING = 0.3
+
+
+def load_proxy_list(path: Path) -> List[str]:
+    """Read proxy URLs from a file, one per line; blank lines and # comments are skipped"""
+    proxies = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                proxies.append(line)
+    return proxies
+
+
+class PooledProxy:
+    """One proxy of a ProxyPool, with its own rate limiter and health scores"""
+    
+    def __init__(self, url: str, limiter: HostRateLimiter):
+        self.url = url
+        self.proxies = {'http': url, 'https': url}
+        self.limiter = limiter
+        self.in_flight = 0
+        self.latency = 0.0          # moving average of response times, seconds
+        self.error_rate = 0.0       # moving average of failures, 0..1
+        self.failures = 0           # consecutive failures
+        self.ejections = 0          # consecutive ejections, for the cooldown backoff
+        self.ejected_until = 0.0
+    
+    @property
+    def display(self) -> str:
+        """Proxy address without credentials"""
+        parsed = urlparse(self.url)
+        return f"{parsed.scheme}://{parsed.hostname}:{parsed.port}" if parsed.port else f"{parsed.scheme}://{parsed.hostname}"
+    
+    def load(self) -> float:
+        """Expected cost of sending one more request through this proxy"""
+        return (self.in_flight + 1) * max(self.latency, 0.1) * (1 + 4 * self.error_rate)
+
+
+class ProxyPool:
+    """
+    Spreads requests over several proxies
+    
+    Every proxy gets its own HostRateLimiter from `limiter_for(url)`, so a
+    per-IP rate limit is honoured per proxy and throughput grows with the
+    number of healthy proxies. Proxies are picked round-robin or by lowest
+    load (requests in flight weighted by latency and error rate). After
+    `max_failures` consecutive failures a proxy is ejected for `cooldown`
+    seconds, doubling on each repeated ejection; when re-admitted it is on
+    probation, and a single failure ejects it again.
+    """
+    
+    def __init__(self, urls: List[str], limiter_for: Callable[[str], HostRateLimiter],
+                 strategy: str = DEFAULT_PROXY_STRATEGY,
+                 max_failures: int = DEFAULT_PROXY_MAX_FAILURES,
+                 cooldown: float = DEFAULT_PROXY_COOLDOWN,
+                 clock: Callable[[], float] = time.monotonic):
+        if not urls:
+            raise ValueError("Proxy pool needs at least one proxy")
+        if strategy not in PROXY_STRATEGIES:
+            raise ValueError(f"Unknown proxy strategy: {strategy}")
+        self.proxies = [PooledProxy(url, limiter_for(url)) for url in urls]
+        self.strategy = strategy
+        self.max_failures = max(1, max_failures)
+        self.cooldown = cooldown
+        self.clock = clock
+        self.next_index = 0
+        self.lock = threading.Lock()
+    
+    def _pick(self) -> Tuple[PooledProxy, float]:
+        """Choose a proxy; returns it with the seconds to wait if every proxy is ejected"""
+        now = self.clock()
+        for proxy in self.proxies:
+            if proxy.ejected_until and proxy.ejected_until <= now:
+                logger.info(f"Re-admitting proxy {proxy.display} on probation")
+                proxy.ejected_until = 0.0
+                proxy.failures = self.max_failures - 1
+        
+        healthy = [proxy for proxy in self.proxies if not proxy.ejected_until]
+        if not healthy:
+            proxy = min(self.proxies, key=lambda p: p.ejected_until)
+            return proxy, proxy.ejected_until - now
+        
+        if self.strategy == 'least-loaded':
+            return min(healthy, key=PooledProxy.load), 0.0
+        
+        # Round-robin over the pool order, skipping ejected proxies
+        while True:
+            proxy = self.proxies[self.next_index % len(self.proxies)]
+            self.next_index += 1
+            if not proxy.ejected_until:
+                return proxy, 0.0
+    
+    def checkout(self) -> PooledProxy:
+        """Take a proxy for one request; pair with release()"""
+        while True:
+            with self.lock:
+                proxy, wait = self._pick()
+                if wait <= 0:
+                    proxy.in_flight += 1
+                    return proxy
+            logger.warning(f"All proxies ejected, waiting {wait:.0f}s for {proxy.display}")
+            time.sleep(wait)
+    
+    async def checkout_async(self) -> PooledProxy:
+        """Take a proxy for one request without blocking the event loop"""
+        while True:
+            with self.lock:
+                proxy, wait = self._pick()
+                if wait <= 0:
+                    proxy.in_flight += 1
+                    return proxy
+            logger.warning(f"All proxies ejected, waiting {wait:.0f}s for {proxy.display}")
+            await asyncio.sleep(wait)
+    
+    def release(self, proxy: PooledProxy, status_code: Optional[int], elapsed: float):
+        """Return a proxy and score the request's outcome (status None = no response)"""
+        with self.lock:
+            proxy.in_flight = max(0, proxy.in_flight - 1)
+            failed = status_code is None or status_code in PROXY_FAILURE_STATUSES
+            proxy.error_rate += SCORE_SMOOTHING * ((1.0 if failed else 0.0) - proxy.error_rate)
+            
+            if not failed:
+                proxy.latency = elapsed if not proxy.latency else \
+                    proxy.latency + SCORE_SMOOTHING * (elapsed - proxy.latency)
+                proxy.failures = 0
+                proxy.ejections = 0
+                return
+            
+            proxy.failures += 1
+            if proxy.failures >= self.max_failures and not proxy.ejected_until:
+                self._eject(proxy)
+    
+    def _eject(self, proxy: PooledProxy):
+        cooldown = self.cooldown * 2 ** min(proxy.ejections, MAX_COOLDOWN_DOUBLINGS)
+        proxy.ejections += 1
+        proxy.ejected_until = self.clock() + cooldown
+        logger.warning(f"Ejecting proxy {proxy.display} for {cooldown:.0f}s after "
+                       f"{proxy.failures} consecutive failures")
+    
+    def validate(self, check: Callable[[Dict[str, str]], None]) -> int:
+        """
+        Run `check(proxies)` through every proxy, ejecting the ones that fail
+        
+        Returns the number of working proxies.
+        """
+        working = 0
+        for proxy in self.proxies:
+            try:
+                check(proxy.proxies)
+                working += 1
+            except requests.exceptions.RequestException as e:
+                logger.warning(f"Proxy {proxy.display} failed: {e}")
+                with self.lock:
+                    proxy.failures += 1
+                    proxy.error_rate = 1.0
+                    self._eject(proxy)
+        return working
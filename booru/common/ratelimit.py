@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+Rate limiting shared by the scrapers
+"""
+
+import argparse
+import asyncio
+import atexit
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import Callable, Dict, Optional, Tuple
+from urllib.parse import urlparse
+
+from common.state import load_json_state, save_json_state
+
+logger = logging.getLogger(__name__)
+
+# AIMD defaults for AdaptiveThrottle
+ADAPTIVE_INCREASE_STEP = 0.01      # requests/second added per healthy response
+ADAPTIVE_DECREASE_FACTOR = 0.5     # rate multiplier on congestion
+ADAPTIVE_SLOW_RESPONSE = 10.0      # seconds; slower responses count as congestion
+ADAPTIVE_SAVE_INTERVAL = 30.0      # seconds between state file writes
+ADAPTIVE_STATE_FILE = 'adaptive_throttle.json'
+
+# Longest Retry-After we are willing to honour (seconds)
+MAX_RETRY_AFTER = 900.0
+
+# SQLite file in the state dir shared by every process with --shared-throttle
+SHARED_LIMITER_FILE = 'ratelimit.sqlite'
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket
+    
+    Tokens refill at `rate` per second up to `capacity` (the burst size).
+    Callers reserve a token under a lock and then sleep outside it, so the
+    same bucket can be shared by worker threads and coroutines. A rate of 0
+    disables limiting.
+    """
+    
+    def __init__(self, rate: float, capacity: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.clock = clock
+        self.tokens = self.capacity
+        self.updated = clock()
+        self.paused_until = float('-inf')
+        self.lock = threading.Lock()
+    
+    @classmethod
+    def from_interval(cls, interval: float, burst: float = 1.0,
+                      clock: Callable[[], float] = time.monotonic) -> 'TokenBucket':
+        """Create a bucket allowing one request every `interval` seconds"""
+        rate = 1.0 / interval if interval > 0 else 0.0
+        return cls(rate, burst, clock)
+    
+    @property
+    def interval(self) -> float:
+        """Seconds between requests at the current rate"""
+        return 1.0 / self.rate if self.rate > 0 else 0.0
+    
+    def _refill(self, now: float):
+        # `updated` lies in the future while paused; nothing refills until then
+        if now <= self.updated:
+            return
+        if self.rate > 0:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def set_rate(self, rate: float):
+        """Change the refill rate, keeping the tokens earned so far"""
+        with self.lock:
+            self._refill(self.clock())
+            self.rate = rate
+    
+    def pause(self, seconds: float):
+        """Hold back every caller for `seconds`, then resume at the normal rate"""
+        with self.lock:
+            now = self.clock()
+            until = now + seconds
+            if until <= self.paused_until:
+                return
+            self._refill(now)
+            # No burst credit builds up while paused: one request goes
+            # out when the pause ends, the rest follow at `rate`
+            self.tokens = min(self.tokens, 1.0)
+            self.updated = until
+            self.paused_until = until
+    
+    def pause_remaining(self) -> float:
+        """Seconds left in the current pause"""
+        with self.lock:
+            return max(0.0, self.paused_until - self.clock())
+    
+    def reserve(self, tokens: float = 1.0) -> float:
+        """Take tokens now and return how long the caller must wait before using them"""
+        with self.lock:
+            now = self.clock()
+            paused = max(0.0, self.paused_until - now)
+            if self.rate <= 0:
+                return paused
+            self._refill(now + paused)
+            self.tokens -= tokens
+            if self.tokens >= 0:
+                return paused
+            return paused - self.tokens / self.rate
+    
+    def acquire(self, tokens: float = 1.0):
+        """Block until tokens are available"""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+        # A pause may have started while we were waiting
+        while True:
+            remaining = self.pause_remaining()
+            if remaining <= 0:
+                break
+            time.sleep(remaining)
+    
+    async def acquire_async(self, tokens: float = 1.0):
+        """Wait until tokens are available without blocking the event loop"""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        while True:
+            remaining = self.pause_remaining()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(remaining)
+
+
+class SharedRateStore:
+    """
+    Bucket schedules kept in an SQLite file, shared between processes
+    
+    Each bucket is stored as a theoretical arrival time (GCRA): a request
+    is reserved inside an IMMEDIATE transaction, so concurrent processes
+    serialise on the database lock and never hand out the same slot.
+    Times are wall-clock so they compare across processes.
+    """
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self.conn = sqlite3.connect(str(path), timeout=60, isolation_level=None,
+                                    check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS buckets ('
+                          'key TEXT PRIMARY KEY, tat REAL NOT NULL, paused_until REAL NOT NULL)')
+        self.lock = threading.Lock()
+    
+    def _update(self, key: str, change: Callable[[float, float], Tuple[float, float, float]]) -> float:
+        """Apply change(tat, paused_until) -> (tat, paused_until, result) atomically"""
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                row = self.conn.execute('SELECT tat, paused_until FROM buckets WHERE key = ?',
+                                        (key,)).fetchone()
+                tat, paused_until, result = change(*(row or (0.0, 0.0)))
+                self.conn.execute('INSERT OR REPLACE INTO buckets (key, tat, paused_until) VALUES (?, ?, ?)',
+                                  (key, tat, paused_until))
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+        return result
+    
+    def reserve(self, key: str, interval: float, burst: float, now: float) -> float:
+        """Reserve the next request slot and return how long to wait for it"""
+        def change(tat, paused_until):
+            tat = max(tat, now)
+            start = max(now, paused_until, tat - (burst - 1) * interval)
+            return tat + interval, paused_until, start - now
+        return self._update(key, change)
+    
+    def pause(self, key: str, until: float, interval: float, burst: float):
+        """Hold back every process until `until`, then resume at `interval`"""
+        def change(tat, paused_until):
+            if until <= paused_until:
+                return tat, paused_until, 0.0
+            # One request goes out when the pause ends, the rest follow at `interval`
+            return max(tat, until + (burst - 1) * interval), until, 0.0
+        self._update(key, change)
+    
+    def paused_until(self, key: str) -> float:
+        """Get the end of the current pause (0 if never paused)"""
+        with self.lock:
+            row = self.conn.execute('SELECT paused_until FROM buckets WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else 0.0
+
+
+class SharedTokenBucket(TokenBucket):
+    """
+    TokenBucket whose schedule lives in a SharedRateStore
+    
+    The rate stays local to the process (so --adaptive still works), but
+    the slots are drawn from the store, so every process using the same
+    key shares one budget.
+    """
+    
+    def __init__(self, store: SharedRateStore, key: str, rate: float, capacity: float = 1.0,
+                 clock: Callable[[], float] = time.time):
+        super().__init__(rate, capacity, clock)
+        self.store = store
+        self.key = key
+    
+    def reserve(self, tokens: float = 1.0) -> float:
+        return self.store.reserve(self.key, self.interval * tokens, self.capacity, self.clock())
+    
+    def pause(self, seconds: float):
+        self.store.pause(self.key, self.clock() + seconds, self.interval, self.capacity)
+    
+    def pause_remaining(self) -> float:
+        return max(0.0, self.store.paused_until(self.key) - self.clock())
+
+
+class HostRateLimiter:
+    """
+    One token bucket per hostname
+    
+    `host_intervals` maps hostnames to seconds between requests. A key of the
+    form "*.example.com" matches every subdomain; exact names win over
+    wildcards. Hosts without an entry use `default_interval`, each in their
+    own bucket, so image CDNs never queue behind throttled page requests.
+    
+    With a `store`, buckets are shared with other processes through it;
+    `scope` (the site's BASE_URL) is part of every bucket key.
+    """
+    
+    def __init__(self, default_interval: float,
+                 host_intervals: Optional[Dict[str, float]] = None,
+                 burst: float = 1.0,
+                 clock: Callable[[], float] = time.monotonic,
+                 store: Optional[SharedRateStore] = None,
+                 scope: str = ''):
+        self.default_interval = default_interval
+        self.host_intervals = dict(host_intervals or {})
+        self.burst = burst
+        self.clock = clock
+        self.store = store
+        self.scope = scope
+        self.buckets: Dict[str, TokenBucket] = {}
+        self.lock = threading.Lock()
+    
+    def interval_for(self, host: str) -> float:
+        """Get the configured seconds between requests for a host"""
+        if host in self.host_intervals:
+            return self.host_intervals[host]
+        
+        # Longest matching wildcard wins
+        best = None
+        for pattern, interval in self.host_intervals.items():
+            if pattern.startswith('*.') and host.endswith(pattern[1:]):
+                if best is None or len(pattern) > len(best[0]):
+                    best = (pattern, interval)
+        if best:
+            return best[1]
+        
+        return self.default_interval
+    
+    def bucket_for(self, url: str) -> TokenBucket:
+        """Get the bucket for the host of a URL"""
+        host = urlparse(url).hostname or ''
+        with self.lock:
+            if host not in self.buckets:
+                interval = self.interval_for(host)
+                if self.store:
+                    rate = 1.0 / interval if interval > 0 else 0.0
+                    self.buckets[host] = SharedTokenBucket(
+                        self.store, f"{self.scope} {host}", rate, self.burst)
+                else:
+                    self.buckets[host] = TokenBucket.from_interval(interval, self.burst, self.clock)
+            return self.buckets[host]
+    
+    def acquire(self, url: str):
+        """Block until a request to the URL's host is allowed"""
+        self.bucket_for(url).acquire()
+    
+    async def acquire_async(self, url: str):
+        """Wait until a request to the URL's host is allowed"""
+        await self.bucket_for(url).acquire_async()
+    
+    def pause(self, url: str, seconds: float):
+        """Stop all requests to the URL's host for `seconds`"""
+        self.bucket_for(url).pause(seconds)
+
+
+def parse_retry_after(value: Optional[str], now: Optional[datetime] = None) -> Optional[float]:
+    """
+    Parse a Retry-After header into seconds
+    
+    Accepts both delay-seconds ("120") and HTTP-date
+    ("Wed, 21 Oct 2015 07:28:00 GMT") forms. Returns None if the header
+    is missing or malformed; the result is capped at MAX_RETRY_AFTER.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    
+    if value.isdigit():
+        seconds = float(value)
+    else:
+        try:
+            when = parsedate_to_datetime(value)
+        except (TypeError, ValueError, IndexError):
+            return None
+        if when is None:
+            return None
+        if when.tzinfo is None:
+            when = when.replace(tzinfo=timezone.utc)
+        seconds = (when - (now or datetime.now(timezone.utc))).total_seconds()
+    
+    return min(max(0.0, seconds), MAX_RETRY_AFTER)
+
+
+def parse_host_throttle(value: str) -> Tuple[str, float]:
+    """Parse a HOST=SECONDS command-line value"""
+    host, sep, seconds = value.partition('=')
+    try:
+        interval = float(seconds)
+    except ValueError:
+        interval = -1.0
+    if not sep or not host or interval < 0:
+        raise argparse.ArgumentTypeError(f"expected HOST=SECONDS, got '{value}'")
+    return host.strip().lower(), interval
+
+
+class AdaptiveThrottle:
+    """
+    AIMD controller for the request rate of one host
+    
+    Healthy responses raise the rate of `bucket` additively; 429/5xx,
+    403, network errors and slow responses cut it multiplicatively. The
+    interval always stays within [min_interval, max_interval]. The learned
+    interval is stored per host in the state file so the next run starts
+    from it.
+    """
+    
+    def __init__(self, bucket: TokenBucket, host: str,
+                 min_interval: float, max_interval: float,
+                 state_file: Optional[Path] = None,
+                 increase_step: float = ADAPTIVE_INCREASE_STEP,
+                 decrease_factor: float = ADAPTIVE_DECREASE_FACTOR,
+                 slow_response: float = ADAPTIVE_SLOW_RESPONSE,
+                 clock: Callable[[], float] = time.monotonic):
+        self.bucket = bucket
+        self.host = host
+        self.min_interval = max(min_interval, 1e-3)
+        self.max_interval = max(max_interval, self.min_interval)
+        self.state_file = state_file
+        self.increase_step = increase_step
+        self.decrease_factor = decrease_factor
+        self.slow_response = slow_response
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.last_decrease = float('-inf')
+        self.last_save = clock()
+        self.dirty = False
+        
+        # Start from the rate learned by the previous run, if any
+        start_interval = bucket.interval
+        if state_file:
+            saved = load_json_state(state_file).get(host, {})
+            if saved.get('interval'):
+                start_interval = saved['interval']
+                logger.info(f"Adaptive throttle: starting {host} at learned {start_interval:.2f}s")
+            atexit.register(self.save)
+        self.bucket.set_rate(1.0 / self._clamp(start_interval))
+    
+    def _clamp(self, interval: float) -> float:
+        return min(self.max_interval, max(self.min_interval, interval))
+    
+    @property
+    def interval(self) -> float:
+        """Current seconds between requests"""
+        return self.bucket.interval
+    
+    def is_congested(self, status_code: Optional[int], elapsed: float) -> bool:
+        """Decide whether a response signals the server wants us to slow down"""
+        if status_code is None:
+            return True
+        if status_code in (403, 429) or status_code >= 500:
+            return True
+        return elapsed > self.slow_response
+    
+    def record(self, url: str, status_code: Optional[int], elapsed: float):
+        """Adjust the rate from the outcome of a request (other hosts are ignored)"""
+        if urlparse(url).hostname != self.host:
+            return
+        
+        with self.lock:
+            now = self.clock()
+            rate = self.bucket.rate
+            if self.is_congested(status_code, elapsed):
+                # Only one cut per interval, so a burst of in-flight failures
+                # does not collapse the rate to the minimum at once
+                if now - self.last_decrease < 2 * self.interval:
+                    return
+                self.last_decrease = now
+                new_rate = rate * self.decrease_factor
+            else:
+                new_rate = rate + self.increase_step
+            
+            old_interval = self.interval
+            new_interval = self._clamp(1.0 / new_rate)
+            if abs(new_interval - old_interval) < 1e-9:
+                return
+            backed_off = new_interval > old_interval
+            if backed_off:
+                logger.warning(f"Adaptive throttle: backing off {self.host} to {new_interval:.2f}s "
+                               f"(status {status_code}, {elapsed:.1f}s)")
+            self.bucket.set_rate(1.0 / new_interval)
+            self.dirty = True
+            due = now - self.last_save >= ADAPTIVE_SAVE_INTERVAL
+        
+        if backed_off or due:
+            self.save()
+    
+    def save(self):
+        """Write the learned interval to the state file"""
+        if not self.state_file or not self.dirty:
+            return
+        with self.lock:
+            state = load_json_state(self.state_file)
+            state[self.host] = {
+                'interval': round(self.interval, 4),
+                'updated_at': datetime.now().isoformat()
+            }
+            save_json_state(self.state_file, state)
+            self.last_save = self.clock()
+            self.dirty = False
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Retry policy shared by the scrapers
+"""
+
+import logging
+import random
+import threading
+import time
+from typing import Callable, Dict, Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RETRY_BUDGET = 20.0        # retries allowed, as a percentage of requests
+DEFAULT_BREAKER_THRESHOLD = 5      # consecutive failures that open a host's circuit
+DEFAULT_BREAKER_COOLDOWN = 30.0    # seconds before an open circuit lets a probe through
+MIN_RETRY_BUDGET = 10              # retries always available, so short runs are not starved
+MAX_RETRY_DELAY = 60.0             # cap for a single backoff
+
+
+class CircuitOpenError(Exception):
+    """Raised when requests to a host fail fast because its circuit is open"""
+    pass
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker for one host
+    
+    Closed: requests flow. After `threshold` consecutive failures the
+    circuit opens and requests fail fast for `cooldown` seconds. It then
+    turns half-open and lets one probe through at a time: a success closes
+    it again, a failure re-opens it for another cooldown.
+    """
+    
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+    
+    def __init__(self, host: str, threshold: int = DEFAULT_BREAKER_THRESHOLD,
+                 cooldown: float = DEFAULT_BREAKER_COOLDOWN,
+                 clock: Callable[[], float] = time.monotonic):
+        self.host = host
+        self.threshold = max(1, threshold)
+        self.cooldown = cooldown
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+    
+    def allow(self) -> bool:
+        """Check whether a request may be sent now"""
+        with self.lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN:
+                if self.clock() - self.opened_at < self.cooldown:
+                    return False
+                logger.info(f"Circuit half-open for {self.host}, sending a probe request")
+                self.state = self.HALF_OPEN
+                self.probing = False
+            
+            # Half-open: one probe in flight at a time
+            if self.probing:
+                return False
+            self.probing = True
+            return True
+    
+    def record_success(self):
+        """The host answered; close the circuit"""
+        with self.lock:
+            if self.state != self.CLOSED:
+                logger.info(f"Circuit closed for {self.host}")
+            self.state = self.CLOSED
+            self.failures = 0
+            self.probing = False
+    
+    def record_failure(self):
+        """The host failed to answer; open the circuit if it keeps failing"""
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == self.HALF_OPEN or (self.state == self.CLOSED and self.failures >= self.threshold):
+                logger.warning(f"Circuit open for {self.host} after {self.failures} consecutive failures, "
+                               f"failing fast for {self.cooldown:.0f}s")
+                self.state = self.OPEN
+                self.opened_at = self.clock()
+    
+    def retry_in(self) -> float:
+        """Seconds until an open circuit lets a probe through"""
+        with self.lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.cooldown - (self.clock() - self.opened_at))
+
+
+class RetryPolicy:
+    """
+    Decides whether and when a failed request is retried
+    
+    Backoff uses full jitter: a random delay between 0 and
+    base_delay * multiplier**attempt (capped at MAX_RETRY_DELAY), so
+    workers that fail together do not retry together. Retries across all
+    hosts are limited to `budget` (a fraction) of the requests made plus
+    MIN_RETRY_BUDGET, and every host has its own CircuitBreaker, so an
+    outage costs one cooldown instead of a full retry schedule per post.
+    """
+    
+    def __init__(self, max_retries: int, base_delay: float, multiplier: float = 2.0,
+                 budget: float = DEFAULT_RETRY_BUDGET / 100,
+                 breaker_threshold: int = DEFAULT_BREAKER_THRESHOLD,
+                 breaker_cooldown: float = DEFAULT_BREAKER_COOLDOWN,
+                 max_delay: float = MAX_RETRY_DELAY,
+                 clock: Callable[[], float] = time.monotonic,
+                 rng: Optional[random.Random] = None):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.multiplier = multiplier
+        self.budget = budget
+        self.breaker_threshold = breaker_threshold
+        self.breaker_cooldown = breaker_cooldown
+        self.max_delay = max_delay
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self.requests = 0
+        self.retries = 0
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self.lock = threading.Lock()
+    
+    def breaker_for(self, url: str) -> CircuitBreaker:
+        """Get the circuit breaker for the host of a URL"""
+        host = urlparse(url).hostname or ''
+        with self.lock:
+            if host not in self.breakers:
+                self.breakers[host] = CircuitBreaker(
+                    host, self.breaker_threshold, self.breaker_cooldown, self.clock)
+            return self.breakers[host]
+    
+    def before_attempt(self, url: str, attempt: int):
+        """Register an attempt, failing fast if the host's circuit is open"""
+        breaker = self.breaker_for(url)
+        if not breaker.allow():
+            raise CircuitOpenError(f"{breaker.host} is unavailable "
+                                   f"(circuit open, next probe in {breaker.retry_in():.0f}s)")
+        if attempt == 0:
+            with self.lock:
+                self.requests += 1
+    
+    def record_outcome(self, url: str, status_code: Optional[int]):
+        """Update the host's breaker: no response or a 5xx is a failure, anything else a success"""
+        breaker = self.breaker_for(url)
+        if status_code is None or status_code >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+    
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter delay before retry number `attempt` + 1"""
+        ceiling = min(self.max_delay, self.base_delay * (self.multiplier ** attempt))
+        return self.rng.uniform(0, ceiling)
+    
+    def next_delay(self, url: str, attempt: int) -> Optional[float]:
+        """Get the delay before retrying a failed attempt, or None to give up"""
+        if attempt >= self.max_retries:
+            return None
+        
+        breaker = self.breaker_for(url)
+        if breaker.state == CircuitBreaker.OPEN:
+            return None
+        
+        with self.lock:
+            if self.retries >= MIN_RETRY_BUDGET + self.budget * self.requests:
+                logger.warning(f"Retry budget exhausted ({self.retries} retries for "
+                               f"{self.requests} requests), not retrying")
+                return None
+            self.retries += 1
+        
+        return self.backoff(attempt)
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Priority scheduler for outgoing requests
+"""
+
+import heapq
+import itertools
+import threading
+from contextlib import contextmanager
+from typing import Dict, Hashable, Iterator, List
+
+# Request classes, most urgent first
+PRIORITY_LISTING = 0
+PRIORITY_DETAIL = 1
+PRIORITY_IMAGE = 2
+REQUEST_CLASSES = ('listing', 'detail', 'image')
+
+
+class _Waiter:
+    __slots__ = ('priority', 'tag', 'seq', 'task', 'granted')
+    
+    def __init__(self, priority: int, tag: float, seq: int, task: Hashable):
+        self.priority = priority
+        self.tag = tag
+        self.seq = seq
+        self.task = task
+        self.granted = False
+    
+    def __lt__(self, other: '_Waiter') -> bool:
+        return (self.priority, self.tag, self.seq) < (other.priority, other.tag, other.seq)
+
+
+class RequestScheduler:
+    """
+    Hands out `slots` concurrent request slots by priority class
+    
+    Waiting listing requests go before detail pages, and detail pages
+    before images. Images may use at most `slots - reserved` slots, so a
+    listing or detail request never waits for a large image transfer to
+    finish. Within a class, tasks sharing the scheduler are served by
+    weighted fair queuing: each task gets slots in proportion to its
+    weight (see set_weight), whatever the number of requests it queues.
+    """
+    
+    def __init__(self, slots: int, reserved: int = 1):
+        self.slots = max(1, slots)
+        self.image_slots = max(1, self.slots - reserved)
+        self.in_flight = [0] * len(REQUEST_CLASSES)
+        self.weights: Dict[Hashable, float] = {}
+        # Virtual time per class and the last finish tag per (class, task)
+        self.virtual_time = [0.0] * len(REQUEST_CLASSES)
+        self.finish_tags: Dict[tuple, float] = {}
+        self.queue: List[_Waiter] = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+    
+    def set_weight(self, task: Hashable, weight: float):
+        """Set the share of a task relative to the others (default 1)"""
+        with self.condition:
+            self.weights[task] = max(weight, 1e-6)
+    
+    def _can_start(self, priority: int) -> bool:
+        if sum(self.in_flight) >= self.slots:
+            return False
+        return priority != PRIORITY_IMAGE or self.in_flight[PRIORITY_IMAGE] < self.image_slots
+    
+    def _dispatch(self):
+        """Grant free slots to the best waiters; call with the lock held"""
+        granted = False
+        while self.queue and self._can_start(self.queue[0].priority):
+            waiter = heapq.heappop(self.queue)
+            waiter.granted = True
+            self.in_flight[waiter.priority] += 1
+            self.virtual_time[waiter.priority] = waiter.tag
+            granted = True
+        if granted:
+            self.condition.notify_all()
+    
+    def acquire(self, priority: int = PRIORITY_DETAIL, task: Hashable = None):
+        """Block until a slot for the class is free; pair with release()"""
+        with self.condition:
+            key = (priority, task)
+            start = max(self.virtual_time[priority], self.finish_tags.get(key, 0.0))
+            tag = start + 1.0 / self.weights.get(task, 1.0)
+            self.finish_tags[key] = tag
+            waiter = _Waiter(priority, tag, next(self.sequence), task)
+            heapq.heappush(self.queue, waiter)
+            self._dispatch()
+            while not waiter.granted:
+                self.condition.wait()
+    
+    def release(self, priority: int = PRIORITY_DETAIL):
+        """Give back a slot taken by acquire()"""
+        with self.condition:
+            self.in_flight[priority] -= 1
+            self._dispatch()
+    
+    @contextmanager
+    def slot(self, priority: int = PRIORITY_DETAIL, task: Hashable = None) -> Iterator[None]:
+        """Hold a request slot for the duration of the block"""
+        self.acquire(priority, task)
+        try:
+            yield
+        finally:
+            self.release(priority)
+    
+    def queue_depths(self) -> Dict[str, int]:
+        """Number of requests waiting for a slot, per class"""
+        with self.condition:
+            depths = dict.fromkeys(REQUEST_CLASSES, 0)
+            for waiter in self.queue:
+                depths[REQUEST_CLASSES[waiter.priority]] += 1
+            return depths
+    
+    def active(self) -> Dict[str, int]:
+        """Number of requests holding a slot, per class"""
+        with self.condition:
+            return dict(zip(REQUEST_CLASSES, self.in_flight))
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+ID-range sharding: large searches listed as post ID ranges in parallel
+"""
+
+import logging
+from typing import Callable, Iterator, List, Optional, Tuple, TypeVar
+
+from common.workers import imap_bounded
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Listing pages one shard should take; the planner halves ranges until they fit
+DEFAULT_SHARD_PAGES = 10
+
+
+def plan_shards(count: Callable[[int, int], Optional[int]], low: int, high: int,
+                shard_size: int, total: Optional[int] = None) -> List[Tuple[int, int]]:
+    """
+    Split post IDs low..high into ranges of at most `shard_size` matching posts, highest first
+    
+    `count(low, high)` is the count probe: how many posts of the search
+    lie in an ID range, or None if the site cannot tell. Ranges are
+    halved until they fit; only the upper half of a split is probed, the
+    lower half's count follows from the range's. Ranges without posts are
+    dropped and ranges of unknown size are kept whole. Pass `total` when
+    the count for low..high is already known.
+    """
+    shards = []
+    probes = 0
+    pending = [(low, high, total)]
+    while pending:
+        low, high, total = pending.pop()
+        if total is None:
+            total = count(low, high)
+            probes += 1
+        if total is not None and total <= 0:
+            continue
+        if total is None or total <= shard_size or low >= high:
+            shards.append((low, high))
+            continue
+        
+        middle = (low + high) // 2
+        upper = count(middle + 1, high)
+        probes += 1
+        # The lower half goes on the stack first so the upper one is planned first
+        pending.append((low, middle, None if upper is None else max(total - upper, 0)))
+        pending.append((middle + 1, high, upper))
+    
+    logger.info(f"Planned {len(shards)} ID-range shards with {probes} count requests")
+    return shards
+
+
+def iter_shards(list_shard: Callable[[Tuple[int, int]], List[T]], shards: List[Tuple[int, int]],
+                workers: int = 1) -> Iterator[Tuple[List[T], int]]:
+    """
+    List the shards `workers` at a time, yielding each one's posts with its lowest ID
+    
+    Shards come back in plan order, highest range first, so put together
+    they are the search's newest-first listing. Everything not yet yielded
+    lies below the low ID that came with the last shard, which is where an
+    interrupted listing continues.
+    """
+    for (low, _), posts in zip(shards, imap_bounded(list_shard, shards, workers)):
+        yield posts, low
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+"""
+Small JSON state files shared between runs
+"""
+
+import json
+import os
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+# Where learned state (throttle rates, shared limiters, caches) is kept
+DEFAULT_STATE_DIR = Path(os.environ.get('BOORU_CRAWLER_STATE_DIR',
+                                        Path.home() / '.booru-collection-crawler'))
+
+
+def resolve_state_dir(state_dir: Optional[str] = None) -> Path:
+    """Get the state directory, creating it if needed"""
+    path = Path(state_dir) if state_dir else DEFAULT_STATE_DIR
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def load_json_state(path: Path) -> Dict:
+    """Load a JSON state file, returning an empty dict if missing or unreadable"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return data if isinstance(data, dict) else {}
+    except (OSError, ValueError):
+        return {}
+
+
+def save_json_state(path: Path, data: Union[Dict, List]):
+    """Atomically replace a JSON state file, so a crash mid-write leaves the old one"""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=path.name, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Persistent cache of tag categories for API backends
+"""
+
+import logging
+import threading
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List
+
+import requests
+
+from common.state import load_json_state, save_json_state
+
+logger = logging.getLogger(__name__)
+
+# Directory under the state dir, one file per site host
+TAG_TYPES_DIR = 'tag_types'
+
+
+class TagTypeCache:
+    """
+    Category of every tag name seen on a site
+    
+    APIs that list posts return their tags as one flat string, so the
+    category of each tag is looked up once and kept across runs and tasks.
+    Categories are stored under generic names (artist, copyright,
+    character, general, meta, ...) that each site maps to its own keys.
+    """
+    
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.types: Dict[str, str] = load_json_state(self.path)
+        self.lock = threading.Lock()
+    
+    def missing(self, names: Iterable[str]) -> List[str]:
+        """Tag names whose category is not known yet, in first-seen order"""
+        with self.lock:
+            return list(dict.fromkeys(name for name in names if name not in self.types))
+    
+    def update(self, types: Dict[str, str]):
+        """Record the categories of some tags"""
+        with self.lock:
+            self.types.update(types)
+    
+    def resolve(self, names: Iterable[str], lookup: Callable[[List[str]], Dict[str, str]], batch: int = 1):
+        """
+        Look up and save the categories of tags not seen before
+        
+        `lookup` gets up to `batch` tag names per call. If it fails, the
+        remaining tags stay unknown (and count as general) until next time.
+        """
+        missing = self.missing(names)
+        if not missing:
+            return
+        
+        logger.info(f"Looking up the categories of {len(missing)} new tags...")
+        batch = max(1, batch)
+        try:
+            for start in range(0, len(missing), batch):
+                chunk = missing[start:start + batch]
+                types = lookup(chunk)
+                # Tags the server does not know (e.g. deleted ones) stay general
+                self.update({name: types.get(name, 'general') for name in chunk})
+        except (requests.exceptions.RequestException, ValueError) as e:
+            logger.warning(f"Tag lookup failed, unknown tags are filed as general: {e}")
+        finally:
+            self.save()
+    
+    def categorize(self, names: Iterable[str], category_names: Dict[str, str]) -> Dict[str, List[str]]:
+        """
+        Group tag names by category
+        
+        `category_names` maps each category to the key the site's tags
+        files use, in output order. Unknown tags count as general; tags of
+        categories missing from `category_names` are left out.
+        """
+        tags = {key: [] for key in category_names.values()}
+        with self.lock:
+            for name in names:
+                key = category_names.get(self.types.get(name, 'general'))
+                if key:
+                    tags[key].append(name)
+        return tags
+    
+    def save(self):
+        """Write the cache to the state dir"""
+        with self.lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            save_json_state(self.path, self.types)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+"""
+Connection transports mounted on the scrapers' requests sessions
+"""
+
+import http.client
+import logging
+import threading
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.cookies import extract_cookies_to_jar
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers, select_proxy
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+logger = logging.getLogger(__name__)
+
+TRANSPORTS = ('http1', 'http2')
+DEFAULT_TRANSPORT = 'http1'
+
+# Hosts a scraper talks to at once (pages, image CDN, the odd redirect)
+POOL_HOSTS = 4
+# Seconds an idle HTTP/2 connection is kept; longer than any sane throttle
+HTTP2_KEEPALIVE_EXPIRY = 60.0
+
+# Connection-specific headers are not allowed on HTTP/2
+HOP_BY_HOP_HEADERS = {'connection', 'keep-alive', 'proxy-connection', 'transfer-encoding', 'upgrade'}
+
+
+class _RawResponse:
+    """Just enough of a urllib3 response for requests' cookie handling"""
+    
+    def __init__(self, headers):
+        msg = http.client.HTTPMessage()
+        for name, value in headers.multi_items():
+            msg[name] = value
+        self.msg = msg
+        self._original_response = self
+    
+    def read(self, *args, **kwargs) -> bytes:
+        return b''
+    
+    def close(self):
+        pass
+    
+    def release_conn(self):
+        pass
+
+
+class HTTP2Adapter(BaseAdapter):
+    """
+    requests adapter that sends through an HTTP/2-capable httpx client
+    
+    Requests to one host are multiplexed as streams over a single TLS
+    connection instead of opening one connection (and handshake) per
+    worker; hosts without HTTP/2 fall back to pooled HTTP/1.1. The session
+    keeps handling headers, cookies, redirects and proxy selection. One
+    httpx client is kept per proxy URL, so HTTP(S) and SOCKS proxies work
+    as before (SOCKS needs the httpx[socks] extra).
+    """
+    
+    def __init__(self, pool_size: int = 1):
+        if httpx is None:
+            raise RuntimeError("--transport http2 requires httpx: pip install 'httpx[http2,socks]'")
+        super().__init__()
+        connections = max(1, pool_size) * POOL_HOSTS
+        self.limits = httpx.Limits(max_connections=connections,
+                                   max_keepalive_connections=connections,
+                                   keepalive_expiry=HTTP2_KEEPALIVE_EXPIRY)
+        self.clients: Dict[Tuple, 'httpx.Client'] = {}
+        self.lock = threading.Lock()
+    
+    def _client_for(self, proxy: Optional[str], verify, cert) -> 'httpx.Client':
+        """Get the shared client for a proxy/TLS combination"""
+        key = (proxy, str(verify), str(cert))
+        with self.lock:
+            if key not in self.clients:
+                # The session has already resolved proxies from the environment
+                self.clients[key] = httpx.Client(http2=True, proxy=proxy, verify=verify, cert=cert,
+                                                 limits=self.limits, follow_redirects=False,
+                                                 trust_env=False)
+            return self.clients[key]
+    
+    @staticmethod
+    def _timeout(timeout) -> 'httpx.Timeout':
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+            return httpx.Timeout(read, connect=connect)
+        return httpx.Timeout(timeout)
+    
+    def send(self, request: requests.PreparedRequest, stream: bool = False, timeout=None,
+             verify=True, cert=None, proxies=None) -> requests.Response:
+        client = self._client_for(select_proxy(request.url, proxies or {}), verify, cert)
+        headers = {name: value for name, value in request.headers.items()
+                   if name.lower() not in HOP_BY_HOP_HEADERS}
+        
+        try:
+            resp = client.request(request.method, request.url, headers=headers,
+                                  content=request.body, timeout=self._timeout(timeout))
+        except httpx.ProxyError as e:
+            raise requests.exceptions.ProxyError(e, request=request)
+        except httpx.ConnectTimeout as e:
+            raise requests.exceptions.ConnectTimeout(e, request=request)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.ReadTimeout(e, request=request)
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(e, request=request)
+        
+        return self.build_response(request, resp)
+    
+    def build_response(self, request: requests.PreparedRequest, resp: 'httpx.Response') -> requests.Response:
+        """Convert an httpx response into a requests one"""
+        response = requests.Response()
+        response.status_code = resp.status_code
+        response.headers = CaseInsensitiveDict({name: resp.headers[name] for name in resp.headers.keys()})
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.reason = resp.reason_phrase
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        # httpx has already decoded gzip/deflate/br
+        response._content = resp.content
+        response.raw = _RawResponse(resp.headers)
+        extract_cookies_to_jar(response.cookies, request, response.raw)
+        logger.debug(f"{resp.http_version} {resp.status_code} {request.url}")
+        return response
+    
+    def close(self):
+        with self.lock:
+            for client in self.clients.values():
+                client.close()
+            self.clients.clear()
+
+
+def mount_transport(session: requests.Session, transport: str = DEFAULT_TRANSPORT,
+                    pool_size: int = 1) -> BaseAdapter:
+    """
+    Mount the selected transport on a session for http:// and https://
+    
+    `pool_size` is the number of requests that may be in flight at once
+    (workers or async concurrency); pools are sized so each of them gets
+    a kept-alive connection per host.
+    """
+    if transport == 'http2':
+        adapter = HTTP2Adapter(pool_size)
+    elif transport == 'http1':
+        adapter = HTTPAdapter(pool_connections=POOL_HOSTS, pool_maxsize=max(1, pool_size))
+    else:
+        raise ValueError(f"Unknown transport: {transport}")
+    
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return adapter
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Bounded worker pool for per-post downloads and listing pages
+"""
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable, Iterable, Iterator, List, TypeVar
+
+T = TypeVar('T')
+R = TypeVar('R')
+
+
+def run_bounded(func: Callable[[T], None], items: Iterable[T], workers: int = 1):
+    """
+    Call func(item) for every item using at most `workers` threads
+    
+    With workers <= 1 the items are processed in order on the calling thread.
+    Otherwise at most 2 * workers items are queued at any time, so `items`
+    may be a lazy iterator. The first exception raised by func stops
+    scheduling, cancels queued items, waits for running ones and is
+    re-raised on the calling thread.
+    """
+    if workers <= 1:
+        for item in items:
+            func(item)
+        return
+    
+    max_pending = workers * 2
+    iterator = iter(items)
+    pending = set()
+    error = None
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while error is None:
+            # Top up the queue
+            for item in iterator:
+                pending.add(executor.submit(func, item))
+                if len(pending) >= max_pending:
+                    break
+            
+            if not pending:
+                break
+            
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if error is None and future.exception() is not None:
+                    error = future.exception()
+        
+        # Stop outstanding work: queued items never start, running ones finish
+        for future in pending:
+            future.cancel()
+        wait(pending)
+    
+    if error is not None:
+        raise error
+
+
+
+def imap_bounded(func: Callable[[T], R], items: Iterable[T], workers: int = 1) -> Iterator[R]:
+    """
+    Yield func(item) for every item in input order, using at most `workers` threads
+    
+    Up to 2 * workers items run ahead of the result being yielded, so
+    `items` may be a lazy iterator and the caller can use each result as
+    soon as it and the ones before it are done. An exception raised by
+    func is re-raised when its result is due; items not started by then
+    are cancelled, as are they when the caller stops iterating early.
+    """
+    if workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+    
+    max_pending = workers * 2
+    pending = deque()
+    
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        try:
+            for item in items:
+                pending.append(executor.submit(func, item))
+                if len(pending) >= max_pending:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+
+def map_bounded(func: Callable[[T], R], items: Iterable[T], workers: int = 1) -> List[R]:
+    """Return [func(item) for item in items], using at most `workers` threads (see imap_bounded)"""
+    return list(imap_bounded(func, items, workers))
@@ -5,21 +5,45 @@ A command-line tool for downloading images and metadata from Danbooru
 """
 
 import argparse
+import asyncio
 import sys
 import os
 import json
 import time
 import hashlib
 import re
+import threading
 from datetime import datetime
+from itertools import chain
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 from urllib.parse import urljoin, urlparse, parse_qs
 import logging
+from concurrent.futures import ThreadPoolExecutor
 
 import requests
 from bs4 import BeautifulSoup
 
+# Shared helpers live in booru/common
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.drift import sorted_by_id, track_drift
+from common.httpcache import (DEFAULT_CACHE_SIZE_MB, HTTP_CACHE_DIR, LISTING_PAGE_TTL, POST_PAGE_TTL,
+                              ResponseCache, parse_cache_ttl)
+from common.incremental import high_water_mark
+from common.listcache import LISTING_CACHE_FILE, ListingCache
+from common.pipeline import append_pages, begin_listing, match_listing_mode, prefetch
+from common.proxypool import (DEFAULT_PROXY_COOLDOWN, DEFAULT_PROXY_STRATEGY, PROXY_STRATEGIES, PooledProxy,
+                               ProxyPool, load_proxy_list)
+from common.ratelimit import (ADAPTIVE_STATE_FILE, SHARED_LIMITER_FILE, AdaptiveThrottle, HostRateLimiter,
+                              SharedRateStore, parse_host_throttle, parse_retry_after)
+from common.retry import (DEFAULT_BREAKER_COOLDOWN, DEFAULT_BREAKER_THRESHOLD,
+                          DEFAULT_RETRY_BUDGET, RetryPolicy)
+from common.scheduler import PRIORITY_DETAIL, PRIORITY_IMAGE, PRIORITY_LISTING, RequestScheduler
+from common.shards import DEFAULT_SHARD_PAGES, iter_shards, plan_shards
+from common.state import resolve_state_dir, save_json_state
+from common.transport import DEFAULT_TRANSPORT, TRANSPORTS, mount_transport
+from common.workers import imap_bounded, run_bounded
+
 
 # Constants
 BASE_URL = "https://danbooru.donmai.us"
@@ -28,6 +52,34 @@ DEFAULT_THROTTLE = 2.5
 DEFAULT_MAX_RETRIES = 3
 DEFAULT_RETRY_DELAY = 5
 RETRY_BACKOFF_MULTIPLIER = 2
+DEFAULT_WORKERS = 1
+# Listing pages fetched in parallel; the rate limiter still spaces their requests
+DEFAULT_LISTING_WORKERS = 4
+DEFAULT_BURST = 1
+# Bounds for --adaptive (seconds between page requests)
+DEFAULT_MIN_THROTTLE = 0.5
+DEFAULT_MAX_THROTTLE = 30.0
+# Image CDN hosts with their own, faster budget (HOST or *.DOMAIN -> seconds)
+DEFAULT_HOST_THROTTLES = {'cdn.donmai.us': 0.5}
+DEFAULT_CONCURRENCY = 4
+# What --cache keeps (URL regex, seconds); images are never cached
+DEFAULT_CACHE_TTLS = [
+    (r'/posts/\d+$', POST_PAGE_TTL),
+    (r'/posts(\.json)?\?', LISTING_PAGE_TTL),
+]
+# Listing backends: HTML pages, or /posts.json with image URLs and tags included
+BACKENDS = ('html', 'api')
+DEFAULT_BACKEND = 'html'
+API_PAGE_LIMIT = 200
+# Posts asked for per HTML listing page (limit=), the most Danbooru serves; its default is 20
+HTML_PAGE_LIMIT = 200
+# Listing pagination: numeric page=N (capped at page 1000 for anonymous users),
+# or keyset page=b{id}, which continues below the lowest post ID seen so far
+PAGINATIONS = ('keyset', 'numeric')
+# Tags anonymous users may search for at once; id: metatags count too
+ANONYMOUS_TAG_LIMIT = 2
+DEFAULT_PAGINATION = 'keyset'
+TAG_CATEGORIES = ('artist', 'copyright', 'character', 'general', 'meta')
 
 # Exit codes
 EXIT_SUCCESS = 0
@@ -83,17 +135,100 @@ class DanbooruScraper:
     def __init__(self, throttle: float = DEFAULT_THROTTLE, 
                  max_retries: int = DEFAULT_MAX_RETRIES,
                  proxy: Optional[str] = None,
-                 proxy_auth: Optional[str] = None):
+                 proxy_auth: Optional[str] = None,
+                 workers: int = DEFAULT_WORKERS,
+                 burst: int = DEFAULT_BURST,
+                 host_throttles: Optional[Dict[str, float]] = None,
+                 adaptive: bool = False,
+                 min_throttle: float = DEFAULT_MIN_THROTTLE,
+                 max_throttle: float = DEFAULT_MAX_THROTTLE,
+                 state_dir: Optional[str] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 transport: str = DEFAULT_TRANSPORT,
+                 shared_throttle: bool = False,
+                 cache: bool = False,
+                 cache_size: int = DEFAULT_CACHE_SIZE_MB,
+                 cache_ttls: Optional[List[Tuple[str, float]]] = None,
+                 proxy_list: Optional[List[str]] = None,
+                 proxy_strategy: str = DEFAULT_PROXY_STRATEGY,
+                 proxy_cooldown: float = DEFAULT_PROXY_COOLDOWN,
+                 scheduler: Optional[RequestScheduler] = None,
+                 task_weight: float = 1.0,
+                 backend: str = DEFAULT_BACKEND,
+                 pagination: str = DEFAULT_PAGINATION,
+                 listing_workers: int = DEFAULT_LISTING_WORKERS,
+                 shard_pages: int = 0):
         self.throttle = throttle
         self.max_retries = max_retries
+        self.backend = backend
+        self.pagination = pagination
+        # With --shard-pages searches are listed as ID ranges of about that many pages
+        self.shard_pages = max(0, shard_pages)
+        self.retry_policy = retry_policy or RetryPolicy(
+            max_retries, DEFAULT_RETRY_DELAY, RETRY_BACKOFF_MULTIPLIER)
         self.session = requests.Session()
-        self.last_request_time = 0
+        
+        # Pages use --throttle; other hosts (image CDNs) get separate budgets
+        host_intervals = {urlparse(BASE_URL).hostname: throttle}
+        host_intervals.update(DEFAULT_HOST_THROTTLES)
+        host_intervals.update(host_throttles or {})
+        
+        # With --shared-throttle every process crawling this site draws from one budget
+        shared_store = None
+        if shared_throttle:
+            shared_store = SharedRateStore(resolve_state_dir(state_dir) / SHARED_LIMITER_FILE)
+            logger.info(f"Sharing the throttle with other processes via {shared_store.path}")
+        self.rate_limiter = HostRateLimiter(throttle, host_intervals, burst,
+                                            store=shared_store, scope=BASE_URL)
+        self.workers = max(1, workers)
+        self.listing_workers = max(1, listing_workers)
+        # Posts per HTML listing page the server serves, less than asked for if it caps limit=
+        self.page_size = HTML_PAGE_LIMIT
+        
+        # Learn the page rate from server feedback, starting from the last run's value
+        self.adaptive = None
+        if adaptive:
+            self.adaptive = AdaptiveThrottle(
+                self.rate_limiter.bucket_for(BASE_URL), urlparse(BASE_URL).hostname,
+                min_throttle, max_throttle, resolve_state_dir(state_dir) / ADAPTIVE_STATE_FILE)
+            logger.info(f"Adaptive throttle: {min_throttle}s - {max_throttle}s, "
+                        f"starting at {self.adaptive.interval:.2f}s")
+        
+        # Give every worker thread its own pooled connection (or HTTP/2 stream)
+        self.transport = transport
+        mount_transport(self.session, transport, self._pool_size())
+        
+        # Listing and detail requests go ahead of image downloads; scrapers
+        # sharing a scheduler get slots in proportion to their task_weight
+        self.scheduler = scheduler or RequestScheduler(max(self.workers, self.listing_workers) + 1)
+        self.scheduler.set_weight(self, task_weight)
+        
+        # Set by sync to answer unchanged listing pages from the task folder
+        self.listing_cache: Optional[ListingCache] = None
+        
+        # With --cache, pages fetched before are answered from disk while fresh
+        self.response_cache: Optional[ResponseCache] = None
+        if cache:
+            self.response_cache = ResponseCache(resolve_state_dir(state_dir) / HTTP_CACHE_DIR,
+                                                list(cache_ttls or []) + DEFAULT_CACHE_TTLS,
+                                                cache_size * 1024 * 1024)
+            logger.info(f"Response cache: {self.response_cache.directory} (up to {cache_size} MB)")
         
         # Setup proxy if provided
         self.proxy_config = self._setup_proxy(proxy, proxy_auth)
         if self.proxy_config:
             self.session.proxies.update(self.proxy_config)
             logger.info(f"Proxy: {self._get_proxy_display_string(proxy, proxy_auth)}")
+        
+        # With --proxy-list requests are spread over the pool, each proxy with its own budget
+        self.proxy_pool: Optional[ProxyPool] = None
+        if proxy_list:
+            self.proxy_pool = ProxyPool(
+                [self._setup_proxy(url, proxy_auth)['http'] for url in proxy_list],
+                lambda url: HostRateLimiter(throttle, host_intervals, burst, store=shared_store,
+                                            scope=f"{BASE_URL} via {urlparse(url).netloc.rpartition('@')[2]}"),
+                proxy_strategy, cooldown=proxy_cooldown)
+            logger.info(f"Proxy pool: {len(proxy_list)} proxies, {proxy_strategy}")
     
     def _setup_proxy(self, proxy: Optional[str], proxy_auth: Optional[str]) -> Optional[Dict]:
         """Setup proxy configuration"""
@@ -126,8 +261,30 @@ class DanbooruScraper:
             auth_status = " (authenticated)"
         return f"{parsed.scheme}://{parsed.netloc}{auth_status}"
     
+    def _pool_size(self) -> int:
+        """Get how many requests may be in flight at once"""
+        return max(self.workers, self.listing_workers)
+    
+    def close(self):
+        """Close the session's connection pools"""
+        self.session.close()
+    
+    @property
+    def listing_mode(self) -> str:
+        """Whether listing cursors are keyset post IDs or page numbers, and of which backend"""
+        return 'keyset' if self.pagination == 'keyset' else f"numeric-{self.backend}"
+    
     def _validate_proxy(self):
         """Test proxy connection to Danbooru"""
+        if self.proxy_pool:
+            logger.info(f"Testing {len(self.proxy_pool.proxies)} proxies...")
+            working = self.proxy_pool.validate(
+                lambda proxies: self.session.get(BASE_URL, proxies=proxies, timeout=10).raise_for_status())
+            if not working:
+                raise ProxyConnectionError("No proxy in the pool could connect")
+            logger.info(f"{working} of {len(self.proxy_pool.proxies)} proxies working")
+            return
+        
         try:
             logger.info("Testing proxy connection...")
             response = self.session.get(BASE_URL, timeout=10)
@@ -142,54 +299,118 @@ class DanbooruScraper:
                 raise ProxyAuthError("Proxy authentication required or credentials invalid")
             raise
     
-    def _throttle_request(self):
-        """Enforce rate limiting between requests"""
-        elapsed = time.time() - self.last_request_time
-        if elapsed < self.throttle:
-            time.sleep(self.throttle - elapsed)
-        self.last_request_time = time.time()
+    def _throttle_request(self, url: str = BASE_URL, proxy: Optional[PooledProxy] = None):
+        """Enforce the rate limit of the URL's host (shared by all worker threads, or per pooled proxy)"""
+        (proxy.limiter if proxy else self.rate_limiter).acquire(url)
     
-    def _make_request(self, url: str, retry_count: int = 0) -> requests.Response:
-        """Make HTTP request with retry logic"""
-        self._throttle_request()
+    def _record_response(self, url: str, status_code: Optional[int], elapsed: float,
+                         proxy: Optional[PooledProxy] = None):
+        """Feed the outcome of a request to the adaptive throttle, the circuit breakers and the proxy pool"""
+        if proxy:
+            self.proxy_pool.release(proxy, status_code, elapsed)
+        self.retry_policy.record_outcome(url, status_code)
+        if self.adaptive:
+            self.adaptive.record(url, status_code, elapsed)
+    
+    def _pause_for_retry_after(self, url: str, response: requests.Response, delay: float, attempt: int,
+                               proxy: Optional[PooledProxy] = None):
+        """Pause every request to the host for as long as a 429/503 response asks (`delay` without Retry-After)"""
+        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        if retry_after is not None:
+            delay = retry_after
+        logger.warning(f"HTTP {response.status_code} from {urlparse(url).hostname}, "
+                       f"pausing requests to it for {delay:.0f}s "
+                       f"(Attempt {attempt + 1}/{self.max_retries})")
+        # Behind a pool only the proxy that was refused has to wait
+        (proxy.limiter if proxy else self.rate_limiter).pause(url, delay)
+    
+    def _make_request(self, url: str, headers: Optional[Dict[str, str]] = None,
+                      use_cache: bool = True, priority: int = PRIORITY_DETAIL) -> requests.Response:
+        """Make HTTP request in the scheduler class `priority`, retrying as the retry policy allows"""
+        # Cacheable pages are fetched once, however many workers ask for them
+        if use_cache and self.response_cache and not headers and self.response_cache.ttl_for(url):
+            return self.response_cache.get_or_fetch(
+                url, lambda: self._make_request(url, use_cache=False, priority=priority))
         
-        try:
-            response = self.session.get(url, timeout=30)
-            
-            # Check for server refusal
-            if response.status_code in [403, 410]:
-                logger.error(f"HTTP {response.status_code} - Server refused request")
-                logger.error(f"URL: {url}")
-                logger.error(f"Headers: {dict(response.headers)}")
-                raise ServerRefusedError(f"Server returned {response.status_code}")
+        with self.scheduler.slot(priority, self):
+            return self._send_request(url, headers)
+    
+    def _send_request(self, url: str, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        """Send a request, retrying as the retry policy allows"""
+        attempt = 0
+        while True:
+            self.retry_policy.before_attempt(url, attempt)
+            proxy = self.proxy_pool.checkout() if self.proxy_pool else None
+            self._throttle_request(url, proxy)
             
-            # Check for 404
-            if response.status_code == 404:
-                logger.warning(f"Resource not found: {url}")
+            try:
+                started = time.monotonic()
+                response = self.session.get(url, headers=headers, timeout=30,
+                                            proxies=proxy.proxies if proxy else None)
+                self._record_response(url, response.status_code, time.monotonic() - started, proxy)
+                
+                # Check for server refusal
+                if response.status_code in [403, 410]:
+                    logger.error(f"HTTP {response.status_code} - Server refused request")
+                    logger.error(f"URL: {url}")
+                    logger.error(f"Headers: {dict(response.headers)}")
+                    raise ServerRefusedError(f"Server returned {response.status_code}")
+                
+                # Check for 404
+                if response.status_code == 404:
+                    logger.warning(f"Resource not found: {url}")
+                    return response
+                
+                response.raise_for_status()
                 return response
-            
-            response.raise_for_status()
-            return response
-            
-        except ServerRefusedError:
-            raise
-        except requests.exceptions.RequestException as e:
-            if retry_count < self.max_retries:
-                delay = DEFAULT_RETRY_DELAY * (RETRY_BACKOFF_MULTIPLIER ** retry_count)
-                logger.warning(f"Request failed: {e}. Retrying in {delay}s... (Attempt {retry_count + 1}/{self.max_retries})")
-                time.sleep(delay)
-                return self._make_request(url, retry_count + 1)
-            else:
-                logger.error(f"Request failed after {self.max_retries} retries: {e}")
+                
+            except ServerRefusedError:
                 raise
+            except requests.exceptions.RequestException as e:
+                if e.response is None:
+                    self._record_response(url, None, time.monotonic() - started, proxy)
+                delay = self.retry_policy.next_delay(url, attempt)
+                if delay is None:
+                    logger.error(f"Request failed after {attempt} retries: {e}")
+                    raise
+                if e.response is not None and e.response.status_code in [429, 503]:
+                    # Rate limited: pause the whole host, the retry waits in the limiter
+                    self._pause_for_retry_after(url, e.response, delay, attempt, proxy)
+                else:
+                    logger.warning(f"Request failed: {e}. Retrying in {delay:.1f}s... (Attempt {attempt + 1}/{self.max_retries})")
+                    time.sleep(delay)
+                attempt += 1
+    
+    def _fetch_listing(self, url: str, parse: Callable[[str], Dict]) -> Dict:
+        """Fetch and parse a listing page, reusing the cached result if it has not changed"""
+        if self.listing_cache is None:
+            return parse(self._make_request(url, priority=PRIORITY_LISTING).text)
+        return self.listing_cache.fetch(
+            url, lambda url, headers=None: self._make_request(url, headers, priority=PRIORITY_LISTING), parse)
     
     def get_total_pages(self, tags: str) -> int:
         """Get total number of pages for search results"""
-        url = f"{BASE_URL}/posts?page=1&tags={tags.replace(' ', '+')}"
         logger.info("Fetching search results...")
+        return self.get_listing_page(tags, 1)['total_pages']
+    
+    def get_listing_page(self, tags: str, page: Union[int, str]) -> Dict:
+        """
+        Get page count and post IDs of a search results page
         
-        response = self._make_request(url)
-        soup = BeautifulSoup(response.text, 'html.parser')
+        Pages always ask for HTML_PAGE_LIMIT posts, so numeric page offsets
+        stay the same throughout a listing. A page 1 with pages after it
+        shows how many the server actually serves.
+        """
+        url = f"{BASE_URL}/posts?page={page}&limit={HTML_PAGE_LIMIT}&tags={tags.replace(' ', '+')}"
+        listing = self._fetch_listing(url, self._parse_listing_page)
+        if page == 1 and listing['total_pages'] > 1 and 0 < len(listing['post_ids']) < self.page_size:
+            logger.info(f"Server serves {len(listing['post_ids'])} posts per page (asked for {HTML_PAGE_LIMIT})")
+            self.page_size = len(listing['post_ids'])
+        return listing
+    
+    def _parse_total_pages(self, html: str) -> int:
+        """Parse total page count from a search results page"""
+        soup = BeautifulSoup(html, 'html.parser')
         
         # Find paginator-next element
         paginator_next = soup.select_one('.paginator-next')
@@ -209,12 +430,26 @@ class DanbooruScraper:
         
         return 1
     
-    def get_post_ids_from_page(self, tags: str, page: int) -> List[int]:
-        """Extract post IDs from a search results page"""
-        url = f"{BASE_URL}/posts?page={page}&tags={tags.replace(' ', '+')}"
-        
-        response = self._make_request(url)
-        soup = BeautifulSoup(response.text, 'html.parser')
+    def count_posts(self, tags: str) -> Optional[int]:
+        """Number of posts matching search tags, from /counts/posts.json (None if not counted)"""
+        url = f"{BASE_URL}/counts/posts.json?tags={tags.replace(' ', '+')}"
+        counts = json.loads(self._make_request(url, priority=PRIORITY_LISTING).text).get('counts') or {}
+        return counts.get('posts')
+    
+    def get_post_ids_from_page(self, tags: str, page: Union[int, str]) -> List[int]:
+        """Extract post IDs from a search results page (a number, b{id} below or a{id} above a post)"""
+        return self.get_listing_page(tags, page)['post_ids']
+    
+    def _parse_listing_page(self, html: str) -> Dict:
+        """Parse page count and post IDs from a search results page (page 1 serves both)"""
+        return {
+            'total_pages': self._parse_total_pages(html),
+            'post_ids': self._parse_post_ids(html)
+        }
+    
+    def _parse_post_ids(self, html: str) -> List[int]:
+        """Parse post IDs from a search results page"""
+        soup = BeautifulSoup(html, 'html.parser')
         
         post_ids = []
         # Find all post preview links
@@ -230,6 +465,53 @@ class DanbooruScraper:
         
         return post_ids
     
+    def get_api_posts_page(self, tags: str, page: Union[int, str]) -> List[Dict]:
+        """Get the posts on one /posts.json page (a number, b{id} or a{id}), with image URL and tags filled in"""
+        url = f"{BASE_URL}/posts.json?tags={tags.replace(' ', '+')}&limit={API_PAGE_LIMIT}&page={page}"
+        return self._fetch_listing(url, self._parse_api_posts)['posts']
+    
+    def get_all_api_posts(self, tags: str) -> List[Dict]:
+        """Get every post for search tags from the JSON API"""
+        return [post for posts, _ in self.iter_api_pages(tags) for post in posts]
+    
+    def iter_api_pages(self, tags: str, page: int = 1) -> Iterator[Tuple[List[Dict], int]]:
+        """
+        Yield the JSON API posts for search tags page by page
+        
+        Each page comes with the number of the next one; pass it as `page`
+        to continue an interrupted listing from there.
+        """
+        while True:
+            logger.info(f"Fetching API page {page}...")
+            posts = self.get_api_posts_page(tags, page)
+            # Posts hidden from anonymous users are dropped from a page after
+            # the query, so only an empty page marks the end
+            if not posts:
+                return
+            yield posts, page + 1
+            page += 1
+    
+    def _parse_api_posts(self, text: str) -> Dict:
+        """Parse a /posts.json response into post_list fields"""
+        data = json.loads(text)
+        if not isinstance(data, list):
+            raise ValueError(f"Unexpected API response: {data.get('message', data)}")
+        
+        posts = []
+        for item in data:
+            # file_url is withheld for some posts (e.g. restricted ones);
+            # those fall back to the post page when downloaded
+            posts.append({
+                'post_id': item['id'],
+                'image_url': item.get('file_url'),
+                'file_extension': item.get('file_ext'),
+                'md5': item.get('md5'),
+                'file_size': item.get('file_size'),
+                'tags': {category: item.get(f'tag_string_{category}', '').split()
+                         for category in TAG_CATEGORIES}
+            })
+        return {'posts': posts}
+    
     def get_post_details(self, post_id: int) -> Tuple[Optional[str], Dict[str, List[str]]]:
         """
         Get image URL and tags for a post
@@ -241,7 +523,11 @@ class DanbooruScraper:
         if response.status_code == 404:
             return None, {}
         
-        soup = BeautifulSoup(response.text, 'html.parser')
+        return self._parse_post_details(response.text)
+    
+    def _parse_post_details(self, html: str) -> Tuple[Optional[str], Dict[str, List[str]]]:
+        """Parse image URL and tags from a post page"""
+        soup = BeautifulSoup(html, 'html.parser')
         
         # Extract image URL
         # Try original link first, fallback to img#image if not available
@@ -282,8 +568,11 @@ class DanbooruScraper:
     
     def download_image(self, url: str) -> bytes:
         """Download image to memory"""
-        response = self._make_request(url)
-        
+        response = self._make_request(url, priority=PRIORITY_IMAGE)
+        return self._validate_image_response(response)
+    
+    def _validate_image_response(self, response: requests.Response) -> bytes:
+        """Return image bytes after checking them against Content-Length"""
         # Validate content length if available
         content_length = response.headers.get('Content-Length')
         if content_length:
@@ -295,6 +584,122 @@ class DanbooruScraper:
         return response.content
 
 
+class AsyncDanbooruScraper(DanbooruScraper):
+    """
+    Asyncio variant of DanbooruScraper
+    
+    Keeps up to `concurrency` requests in flight per host. Requests are still
+    spaced by the politeness throttle; the blocking session calls run on a
+    thread pool so proxy and SOCKS support stay identical to the sync scraper.
+    """
+    
+    def __init__(self, concurrency: int = DEFAULT_CONCURRENCY, **kwargs):
+        # Set first: DanbooruScraper sizes the connection pools from it
+        self.concurrency = max(1, concurrency)
+        # Remaining options are the same as DanbooruScraper's
+        super().__init__(**kwargs)
+        self.executor = ThreadPoolExecutor(max_workers=self.concurrency * 2)
+        
+        # Created lazily so they bind to the running event loop
+        self._host_semaphores: Dict[str, asyncio.Semaphore] = {}
+    
+    def _pool_size(self) -> int:
+        """Get how many requests may be in flight at once, a connection (or HTTP/2 stream) each"""
+        return max(super()._pool_size(), self.concurrency)
+    
+    def close(self):
+        """Release the worker threads and the connection pools"""
+        self.executor.shutdown(wait=False)
+        super().close()
+    
+    def reset_loop_state(self):
+        """Drop loop-bound primitives so the scraper can run under a new event loop"""
+        self._host_semaphores = {}
+    
+    def _get_host_semaphore(self, url: str) -> asyncio.Semaphore:
+        """Get the in-flight limiter for the host of a URL"""
+        host = urlparse(url).hostname or ''
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self.concurrency)
+        return self._host_semaphores[host]
+    
+    async def _throttle_request_async(self, url: str, proxy: Optional[PooledProxy] = None):
+        """Enforce the rate limit of the URL's host between request starts"""
+        await (proxy.limiter if proxy else self.rate_limiter).acquire_async(url)
+    
+    async def _make_request_async(self, url: str) -> requests.Response:
+        """Make HTTP request, retrying as the retry policy allows without blocking the event loop"""
+        loop = asyncio.get_running_loop()
+        cache = self.response_cache if self.response_cache and self.response_cache.ttl_for(url) else None
+        if cache:
+            cached = cache.get(url)
+            if cached is not None:
+                return cached
+        
+        attempt = 0
+        while True:
+            self.retry_policy.before_attempt(url, attempt)
+            
+            try:
+                async with self._get_host_semaphore(url):
+                    proxy = await self.proxy_pool.checkout_async() if self.proxy_pool else None
+                    await self._throttle_request_async(url, proxy)
+                    options = {'proxies': proxy.proxies} if proxy else {}
+                    started = time.monotonic()
+                    response = await loop.run_in_executor(
+                        self.executor, lambda: self.session.get(url, timeout=30, **options))
+                    self._record_response(url, response.status_code, time.monotonic() - started, proxy)
+                
+                # Check for server refusal
+                if response.status_code in [403, 410]:
+                    logger.error(f"HTTP {response.status_code} - Server refused request")
+                    logger.error(f"URL: {url}")
+                    logger.error(f"Headers: {dict(response.headers)}")
+                    raise ServerRefusedError(f"Server returned {response.status_code}")
+                
+                # Check for 404
+                if response.status_code == 404:
+                    logger.warning(f"Resource not found: {url}")
+                    return response
+                
+                response.raise_for_status()
+                if cache:
+                    cache.put(url, response)
+                return response
+                
+            except ServerRefusedError:
+                raise
+            except requests.exceptions.RequestException as e:
+                if e.response is None:
+                    self._record_response(url, None, time.monotonic() - started, proxy)
+                delay = self.retry_policy.next_delay(url, attempt)
+                if delay is None:
+                    logger.error(f"Request failed after {attempt} retries: {e}")
+                    raise
+                if e.response is not None and e.response.status_code in [429, 503]:
+                    # Rate limited: pause the whole host, the retry waits in the limiter
+                    self._pause_for_retry_after(url, e.response, delay, attempt, proxy)
+                else:
+                    logger.warning(f"Request failed: {e}. Retrying in {delay:.1f}s... (Attempt {attempt + 1}/{self.max_retries})")
+                    await asyncio.sleep(delay)
+                attempt += 1
+    
+    async def get_post_details_async(self, post_id: int) -> Tuple[Optional[str], Dict[str, List[str]]]:
+        """Async version of get_post_details"""
+        url = f"{BASE_URL}/posts/{post_id}"
+        
+        response = await self._make_request_async(url)
+        if response.status_code == 404:
+            return None, {}
+        
+        return self._parse_post_details(response.text)
+    
+    async def download_image_async(self, url: str) -> bytes:
+        """Async version of download_image"""
+        response = await self._make_request_async(url)
+        return self._validate_image_response(response)
+
+
 class TaskManager:
     """Manages task folder structure and metadata"""
     
@@ -303,6 +708,8 @@ class TaskManager:
         self.metadata_file = self.task_folder / "task_metadata.json"
         self.post_list_file = self.task_folder / "post_list.json"
         self.posts_folder = self.task_folder / "posts"
+        # Guards post_list/metadata updates made by download workers
+        self.lock = threading.RLock()
     
     @staticmethod
     def sanitize_tags(tags: str) -> str:
@@ -351,8 +758,8 @@ class TaskManager:
     
     def save_metadata(self, metadata: Dict):
         """Save task metadata"""
-        with open(self.metadata_file, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, indent=2, ensure_ascii=False)
+        with self.lock:
+            save_json_state(self.metadata_file, metadata)
     
     def load_metadata(self) -> Dict:
         """Load task metadata"""
@@ -365,8 +772,8 @@ class TaskManager:
     
     def save_post_list(self, posts: List[Dict]):
         """Save post list"""
-        with open(self.post_list_file, 'w', encoding='utf-8') as f:
-            json.dump(posts, f, indent=2, ensure_ascii=False)
+        with self.lock:
+            save_json_state(self.post_list_file, posts)
     
     def load_post_list(self) -> List[Dict]:
         """Load post list"""
@@ -411,6 +818,53 @@ class TaskManager:
         return 0.0
 
 
+def create_retry_policy(args) -> RetryPolicy:
+    """Create the retry policy from command-line arguments"""
+    return RetryPolicy(
+        max_retries=args.max_retries if hasattr(args, 'max_retries') else DEFAULT_MAX_RETRIES,
+        base_delay=DEFAULT_RETRY_DELAY,
+        multiplier=RETRY_BACKOFF_MULTIPLIER,
+        budget=getattr(args, 'retry_budget', DEFAULT_RETRY_BUDGET) / 100,
+        breaker_threshold=getattr(args, 'breaker_threshold', DEFAULT_BREAKER_THRESHOLD),
+        breaker_cooldown=getattr(args, 'breaker_cooldown', DEFAULT_BREAKER_COOLDOWN)
+    )
+
+
+def create_scraper(args) -> DanbooruScraper:
+    """Create the scraper for the engine selected on the command line"""
+    options = dict(
+        throttle=args.throttle if hasattr(args, 'throttle') else DEFAULT_THROTTLE,
+        max_retries=args.max_retries if hasattr(args, 'max_retries') else DEFAULT_MAX_RETRIES,
+        proxy=args.proxy,
+        proxy_auth=args.proxy_auth,
+        burst=getattr(args, 'burst', DEFAULT_BURST),
+        host_throttles=dict(getattr(args, 'host_throttle', None) or []),
+        adaptive=getattr(args, 'adaptive', False),
+        min_throttle=getattr(args, 'min_throttle', DEFAULT_MIN_THROTTLE),
+        max_throttle=getattr(args, 'max_throttle', DEFAULT_MAX_THROTTLE),
+        state_dir=getattr(args, 'state_dir', None),
+        retry_policy=create_retry_policy(args),
+        transport=getattr(args, 'transport', DEFAULT_TRANSPORT),
+        shared_throttle=getattr(args, 'shared_throttle', False),
+        cache=getattr(args, 'cache', False),
+        cache_size=getattr(args, 'cache_size', DEFAULT_CACHE_SIZE_MB),
+        cache_ttls=getattr(args, 'cache_ttl', None),
+        proxy_list=load_proxy_list(args.proxy_list) if getattr(args, 'proxy_list', None) else None,
+        proxy_strategy=getattr(args, 'proxy_strategy', DEFAULT_PROXY_STRATEGY),
+        proxy_cooldown=getattr(args, 'proxy_cooldown', DEFAULT_PROXY_COOLDOWN),
+        backend=getattr(args, 'backend', DEFAULT_BACKEND),
+        pagination=getattr(args, 'pagination', DEFAULT_PAGINATION),
+        listing_workers=getattr(args, 'listing_workers', DEFAULT_LISTING_WORKERS),
+        shard_pages=getattr(args, 'shard_pages', 0)
+    )
+    
+    if getattr(args, 'engine', 'sync') == 'async':
+        logger.info(f"Engine: async ({args.concurrency} requests in flight per host)")
+        return AsyncDanbooruScraper(concurrency=args.concurrency, **options)
+    
+    return DanbooruScraper(workers=getattr(args, 'workers', DEFAULT_WORKERS), **options)
+
+
 def mode_new(args):
     """Execute new task creation mode"""
     logger.info(f"Danbooru Scraper v{VERSION}")
@@ -419,15 +873,10 @@ def mode_new(args):
     logger.info(f"Storage: {args.storage_path}")
     
     # Create scraper
-    scraper = DanbooruScraper(
-        throttle=args.throttle,
-        max_retries=args.max_retries,
-        proxy=args.proxy,
-        proxy_auth=args.proxy_auth
-    )
+    scraper = create_scraper(args)
     
     # Validate proxy if configured
-    if args.proxy:
+    if args.proxy or getattr(args, 'proxy_list', None):
         try:
             scraper._validate_proxy()
         except ProxyConnectionError:
@@ -454,37 +903,16 @@ def mode_new(args):
     task_manager.save_metadata(metadata)
     
     try:
-        # Get total pages
-        total_pages = scraper.get_total_pages(args.tags)
-        logger.info(f"Total pages found: {total_pages}")
-        
-        # Build post list
-        all_post_ids = []
-        for page in range(1, total_pages + 1):
-            logger.info(f"Fetching page {page}/{total_pages}...")
-            post_ids = scraper.get_post_ids_from_page(args.tags, page)
-            all_post_ids.extend(post_ids)
-        
-        logger.info(f"Total posts found: {len(all_post_ids)}")
-        
-        # Create post list with initial status
+        # Download posts as the listing finds them; post_list.json and the
+        # listing cursor are saved page by page, so resume can continue it
         post_list = []
-        for post_id in all_post_ids:
-            post_list.append({
-                'post_id': post_id,
-                'status': STATUS_PENDING,
-                'image_url': None,
-                'file_extension': None,
-                'download_timestamp': None
-            })
-        
-        # Update metadata
-        metadata['total_posts'] = len(all_post_ids)
-        task_manager.save_metadata(metadata)
-        task_manager.save_post_list(post_list)
-        
-        # Download posts
-        download_posts(scraper, task_manager, post_list, metadata)
+        begin_listing(metadata, args.tags, mode=scraper.listing_mode)
+        listed = prefetch(run_listing(scraper, task_manager, metadata, post_list))
+        try:
+            download_posts(scraper, task_manager, post_list, metadata, listed)
+        finally:
+            # The listing must not keep saving after a refusal or error
+            listed.close()
         
         # Mark task as complete
         metadata['status'] = STATUS_COMPLETE
@@ -508,6 +936,8 @@ def mode_new(args):
         metadata['last_updated'] = datetime.now().isoformat()
         task_manager.save_metadata(metadata)
         sys.exit(EXIT_NETWORK_ERROR)
+    finally:
+        scraper.close()
 
 
 def mode_resume(args):
@@ -524,15 +954,10 @@ def mode_resume(args):
     logger.info(f"Tags: {metadata['search_tags']}")
     
     # Create scraper
-    scraper = DanbooruScraper(
-        throttle=args.throttle if hasattr(args, 'throttle') else DEFAULT_THROTTLE,
-        max_retries=args.max_retries if hasattr(args, 'max_retries') else DEFAULT_MAX_RETRIES,
-        proxy=args.proxy,
-        proxy_auth=args.proxy_auth
-    )
+    scraper = create_scraper(args)
     
     # Validate proxy if configured
-    if args.proxy:
+    if args.proxy or getattr(args, 'proxy_list', None):
         try:
             scraper._validate_proxy()
         except ProxyConnectionError:
@@ -552,15 +977,29 @@ def mode_resume(args):
     task_manager.save_metadata(metadata)
     
     try:
-        # Resume download
-        download_posts(scraper, task_manager, post_list, metadata)
+        # Tasks from before listing_tags was saved only kept a keyset cursor
+        if metadata.get('listing_tags') is None and metadata.get('listing_cursor'):
+            begin_listing(metadata, metadata['search_tags'], metadata['listing_cursor'], 'keyset')
+        
+        # Resume download, finishing an interrupted listing alongside
+        pending = [(i, post) for i, post in enumerate(post_list, 1) if post['status'] != STATUS_COMPLETE]
+        listed = None
+        if metadata.get('listing_tags') is not None:
+            logger.info(f"Continuing the interrupted listing after {len(post_list)} posts...")
+            listed = prefetch(run_listing(scraper, task_manager, metadata, post_list))
+            pending = chain(pending, listed)
+        try:
+            download_posts(scraper, task_manager, post_list, metadata, pending)
+        finally:
+            if listed is not None:
+                listed.close()
         
         # Download phase complete
         logger.info(f"Download phase complete: {metadata['completed_posts']}/{metadata['total_posts']} posts")
         
         # Auto-trigger sync
         logger.info("Triggering automatic sync operation...")
-        sync_posts(scraper, task_manager, metadata, post_list)
+        sync_posts(scraper, task_manager, metadata, post_list, getattr(args, 'full_sync', False))
         
         # Mark as complete
         metadata['status'] = STATUS_COMPLETE
@@ -584,6 +1023,8 @@ def mode_resume(args):
         metadata['last_updated'] = datetime.now().isoformat()
         task_manager.save_metadata(metadata)
         sys.exit(EXIT_NETWORK_ERROR)
+    finally:
+        scraper.close()
 
 
 def mode_sync(args):
@@ -600,15 +1041,10 @@ def mode_sync(args):
     logger.info(f"Tags: {metadata['search_tags']}")
     
     # Create scraper
-    scraper = DanbooruScraper(
-        throttle=args.throttle if hasattr(args, 'throttle') else DEFAULT_THROTTLE,
-        max_retries=args.max_retries if hasattr(args, 'max_retries') else DEFAULT_MAX_RETRIES,
-        proxy=args.proxy,
-        proxy_auth=args.proxy_auth
-    )
+    scraper = create_scraper(args)
     
     # Validate proxy if configured
-    if args.proxy:
+    if args.proxy or getattr(args, 'proxy_list', None):
         try:
             scraper._validate_proxy()
         except ProxyConnectionError:
@@ -621,7 +1057,7 @@ def mode_sync(args):
         metadata['mode_history'].append('sync')
     
     try:
-        sync_posts(scraper, task_manager, metadata, post_list)
+        sync_posts(scraper, task_manager, metadata, post_list, getattr(args, 'full_sync', False))
         
         metadata['status'] = STATUS_COMPLETE
         metadata['last_updated'] = datetime.now().isoformat()
@@ -637,124 +1073,429 @@ def mode_sync(args):
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
         sys.exit(EXIT_NETWORK_ERROR)
+    finally:
+        scraper.close()
 
 
-def download_posts(scraper: DanbooruScraper, task_manager: TaskManager, 
-                   post_list: List[Dict], metadata: Dict):
-    """Download posts from the list"""
-    total = len(post_list)
+def new_post_entry(post_id: int, details: Optional[Dict] = None) -> Dict:
+    """Create a PENDING post_list entry; API listings pre-fill image URL and tags"""
+    entry = {
+        'post_id': post_id,
+        'status': STATUS_PENDING,
+        'image_url': None,
+        'file_extension': None,
+        'download_timestamp': None
+    }
+    if details:
+        entry.update(details)
+    return entry
+
+
+def get_page_entries(scraper: DanbooruScraper, tags: str, page: Union[int, str]) -> List[Dict]:
+    """Get one listing page (a number, b{id} or a{id}) as new post_list entries"""
+    if scraper.backend == 'api':
+        return [new_post_entry(post['post_id'], post) for post in scraper.get_api_posts_page(tags, page)]
+    return [new_post_entry(post_id) for post_id in scraper.get_post_ids_from_page(tags, page)]
+
+
+def iter_keyset_pages(scraper: DanbooruScraper, tags: str,
+                      cursor: Optional[int] = None) -> Iterator[Tuple[List[Dict], int]]:
+    """
+    Yield the posts matching the tags page by page as new post_list entries
+    
+    Pages are requested as page=b{cursor}, the posts below the lowest ID
+    seen so far, so listings are complete however deep they go and every
+    page costs the server the same. Each page comes with the cursor for
+    the next one; pass it back to continue an interrupted listing.
+    """
+    page_num = 1
+    while True:
+        page = f"b{cursor}" if cursor else 1
+        logger.info(f"Fetching page {page_num} (page={page})...")
+        entries = get_page_entries(scraper, tags, page)
+        if not entries:
+            return
+        
+        cursor = min(entry['post_id'] for entry in entries)
+        yield entries, cursor
+        page_num += 1
+
+
+def iter_posts_after(scraper: DanbooruScraper, tags: str, mark: int) -> Iterator[Tuple[List[Dict], str]]:
+    """
+    Yield the posts above post ID `mark` page by page as new post_list entries
+    
+    Walks page=a{id} upwards from the mark. Unlike an id:>N search this
+    does not count against the two-tag search limit of anonymous users.
+    Each page comes with the a{id} cursor for the next one.
+    """
+    cursor = mark
+    while True:
+        logger.info(f"Fetching posts after {cursor}...")
+        entries = get_page_entries(scraper, tags, f"a{cursor}")
+        if not entries:
+            return
+        cursor = max(entry['post_id'] for entry in entries)
+        yield entries, f"a{cursor}"
+
+
+def list_id_range(scraper: DanbooruScraper, tags: str, low: int, high: int) -> List[Dict]:
+    """List the posts with IDs low..high as new post_list entries, walking keyset pages down from high"""
+    logger.info(f"Listing posts {low}..{high}...")
+    entries = []
+    for page_entries, cursor in iter_keyset_pages(scraper, tags, high + 1):
+        entries.extend(entry for entry in page_entries if entry['post_id'] >= low)
+        if cursor <= low:
+            break
+    return entries
+
+
+def iter_shard_pages(scraper: DanbooruScraper, tags: str,
+                     below: Optional[int] = None) -> Iterator[Tuple[List[Dict], int]]:
+    """
+    Yield the posts matching the tags one ID-range shard at a time, newest first
+    
+    The IDs up to the newest post (below `below` if given) are split into
+    ranges of about `shard_pages` pages, sized with /counts/posts.json
+    probes (see common.shards), and `listing_workers` ranges are walked at
+    a time with keyset pages, so deep searches are not listed one page
+    after the other. Each shard comes with its lowest post ID, a keyset
+    cursor: everything below it is still to be listed.
+    """
+    newest = get_page_entries(scraper, tags, f"b{below}" if below else 1)
+    if not newest:
+        return
+    
+    page_size = API_PAGE_LIMIT if scraper.backend == 'api' else scraper.page_size
+    shards = plan_shards(lambda low, high: scraper.count_posts(f"{tags} id:{low}..{high}"),
+                         1, max(entry['post_id'] for entry in newest), scraper.shard_pages * page_size)
+    yield from iter_shards(lambda shard: list_id_range(scraper, tags, *shard), shards, scraper.listing_workers)
+
+
+def list_remote_posts(scraper: DanbooruScraper, tags: str) -> List[Dict]:
+    """List the posts matching the tags on the server as new post_list entries"""
+    # Uploads during the listing push posts onto the next page; a post
+    # seen twice that way is listed once
+    entries = {}
+    for page_entries, _ in iter_remote_pages(scraper, tags):
+        for entry in page_entries:
+            entries.setdefault(entry['post_id'], entry)
+    return list(entries.values())
+
+
+def iter_remote_pages(scraper: DanbooruScraper, tags: str,
+                      cursor: Union[int, str, None] = None) -> Iterator[Tuple[List[Dict], Union[int, str]]]:
+    """
+    Yield the posts matching the tags page by page as new post_list entries
+    
+    Each page comes with where the listing continues: the lowest post ID
+    so far for keyset pagination and ID-range shards, a{id} when walking
+    up from a post (see iter_posts_after), else the next page number. Pass
+    it as `cursor` to continue an interrupted listing.
+    """
+    if isinstance(cursor, str) and cursor.startswith('a'):
+        yield from iter_posts_after(scraper, tags, int(cursor[1:]))
+        return
+    
+    # Shards are walked with keyset pages, whose cursor they share. Their
+    # count probes add an id: tag, which a search already at the anonymous
+    # tag limit has no room for, so such searches are listed unsharded
+    if scraper.shard_pages and scraper.pagination == 'keyset' and sorted_by_id(tags):
+        if len(tags.split()) < ANONYMOUS_TAG_LIMIT:
+            yield from iter_shard_pages(scraper, tags, cursor)
+            return
+        logger.info(f"Not sharding a search of {ANONYMOUS_TAG_LIMIT} or more tags: "
+                    "the count requests would exceed the anonymous tag limit")
+    
+    if scraper.pagination == 'keyset':
+        yield from iter_keyset_pages(scraper, tags, cursor)
+        return
+    
+    if scraper.backend == 'api':
+        for posts, next_page in scraper.iter_api_pages(tags, cursor or 1):
+            yield [new_post_entry(post['post_id'], post) for post in posts], next_page
+        return
+    
+    start = cursor or 1
+    logger.info("Fetching search results...")
+    first_page = scraper.get_listing_page(tags, start)
+    total_pages = first_page['total_pages']
+    logger.info(f"Total pages found: {total_pages}")
+    
+    def fetch_page(page):
+        logger.info(f"Fetching page {page}/{total_pages}...")
+        return scraper.get_post_ids_from_page(tags, page)
+    
+    def iter_pages():
+        yield first_page['post_ids'], start + 1
+        # The other pages are fetched in parallel and come back in page order
+        pages = imap_bounded(fetch_page, range(start + 1, total_pages + 1), scraper.listing_workers)
+        for page, post_ids in enumerate(pages, start + 1):
+            yield post_ids, page + 1
+    
+    # Posts that page drift moved past a page boundary are listed from a
+    # keyset page, which uploads cannot shift
+    fetch_below = None
+    if sorted_by_id(tags):
+        fetch_below = lambda post_id: scraper.get_post_ids_from_page(tags, f"b{post_id}")
+    for post_ids, next_page in track_drift(iter_pages(), fetch_below):
+        yield [new_post_entry(post_id) for post_id in post_ids], next_page
+
+
+def run_listing(scraper: DanbooruScraper, task_manager: TaskManager, metadata: Dict,
+                post_list: List[Dict]) -> Iterator[Tuple[int, Dict]]:
+    """
+    Run the task's current listing (see begin_listing) into post_list
     
-    for i, post in enumerate(post_list, 1):
-        if post['status'] == STATUS_COMPLETE:
-            continue
+    Continues from the saved listing cursor, unless another listing mode
+    saved it (see match_listing_mode), and yields the new entries with
+    their positions as the pages arrive (see append_pages).
+    """
+    # Walks up from a post ID (a{id}) read the same in every mode
+    match_listing_mode(metadata, scraper.listing_mode,
+                       keep=lambda cursor: isinstance(cursor, str) and cursor.startswith('a'))
+    pages = iter_remote_pages(scraper, metadata['listing_tags'], metadata['listing_cursor'])
+    return append_pages(pages, post_list, task_manager, metadata)
+
+
+def store_post(task_manager: TaskManager, post: Dict, post_list: List[Dict],
+               metadata: Dict, image_url: str, image_data: bytes,
+               tags: Dict[str, List[str]]):
+    """Save a downloaded post to disk and mark it COMPLETE"""
+    post_id = post['post_id']
+    
+    # Extract file extension
+    extension = image_url.split('.')[-1].split('?')[0]
+    
+    # Save image
+    filename = task_manager.save_image(post_id, image_data, extension)
+    file_size = task_manager.get_file_size_mb(post_id, extension)
+    logger.info(f"Image saved: {filename} ({file_size:.1f} MB)")
+    
+    # Save tags
+    task_manager.save_tags(post_id, tags)
+    logger.info(f"Tags saved: {post_id}_tags.json")
+    
+    with task_manager.lock:
+        # Update post status
+        post['status'] = STATUS_COMPLETE
+        post['image_url'] = image_url
+        post['file_extension'] = extension
+        post['download_timestamp'] = datetime.now().isoformat()
+        # Listed tags now live in the tags file
+        post.pop('tags', None)
+        
+        # Update metadata
+        metadata['completed_posts'] = sum(1 for p in post_list if p['status'] == STATUS_COMPLETE)
+        metadata['last_updated'] = datetime.now().isoformat()
+        
+        # Save progress
+        task_manager.save_post_list(post_list)
+        task_manager.save_metadata(metadata)
+        
         
+def download_posts(scraper: DanbooruScraper, task_manager: TaskManager, 
+                   post_list: List[Dict], metadata: Dict,
+                   pending: Optional[Iterable[Tuple[int, Dict]]] = None):
+    """
+    Download posts from the list, using scraper.workers threads
+    
+    `pending` gives the (position, entry) pairs to download, by default
+    the list's unfinished posts. It may be a lazy iterator that appends
+    to post_list while the downloads run (see common.pipeline).
+    """
+    if isinstance(scraper, AsyncDanbooruScraper):
+        asyncio.run(download_posts_async(scraper, task_manager, post_list, metadata, pending))
+        return
+    
+    def download_one(item):
+        i, post = item
         post_id = post['post_id']
-        logger.info(f"Downloading post {i}/{total} (ID: {post_id})")
+        logger.info(f"Downloading post {i}/{len(post_list)} (ID: {post_id})")
         
         try:
-            # Get post details
-            image_url, tags = scraper.get_post_details(post_id)
+            # Get post details, unless the API listing already provided them
+            if post.get('image_url') and 'tags' in post:
+                image_url, tags = post['image_url'], post['tags']
+            else:
+                image_url, tags = scraper.get_post_details(post_id)
             
             if not image_url:
                 logger.warning(f"Post {post_id}: No image URL found")
-                post['status'] = STATUS_FAIL
-                task_manager.save_post_list(post_list)
-                continue
-            
-            # Extract file extension
-            extension = image_url.split('.')[-1].split('?')[0]
+                with task_manager.lock:
+                    post['status'] = STATUS_FAIL
+                    task_manager.save_post_list(post_list)
+                return
             
             # Download image
             image_data = scraper.download_image(image_url)
             
-            # Save image
-            filename = task_manager.save_image(post_id, image_data, extension)
-            file_size = task_manager.get_file_size_mb(post_id, extension)
-            logger.info(f"Image saved: {filename} ({file_size:.1f} MB)")
+            store_post(task_manager, post, post_list, metadata, image_url, image_data, tags)
             
-            # Save tags
-            task_manager.save_tags(post_id, tags)
-            logger.info(f"Tags saved: {post_id}_tags.json")
+        except ServerRefusedError:
+            with task_manager.lock:
+                post['status'] = STATUS_FAIL
+                task_manager.save_post_list(post_list)
+            raise
+        except Exception as e:
+            logger.error(f"Post {post_id}: Download failed - {e}")
+            with task_manager.lock:
+                post['status'] = STATUS_FAIL
+                task_manager.save_post_list(post_list)
+            # Continue to next post
+    
+    if pending is None:
+        pending = ((i, post) for i, post in enumerate(post_list, 1)
+                   if post['status'] != STATUS_COMPLETE)
+    run_bounded(download_one, pending, scraper.workers)
+
+
+async def download_posts_async(scraper: AsyncDanbooruScraper, task_manager: TaskManager,
+                               post_list: List[Dict], metadata: Dict,
+                               pending: Optional[Iterable[Tuple[int, Dict]]] = None):
+    """
+    Download posts from the list with several posts in flight
+    
+    Status handling matches download_posts, and so does `pending`: a lazy
+    listing is advanced on a helper thread and its posts are queued for
+    the workers as they are listed. The first ServerRefusedError, or an
+    error from the listing, cancels all outstanding downloads (they stay
+    PENDING) and is re-raised.
+    """
+    scraper.reset_loop_state()
+    if pending is None:
+        pending = [(i, post) for i, post in enumerate(post_list, 1) if post['status'] != STATUS_COMPLETE]
+    worker_count = scraper.concurrency * 2
+    queue: asyncio.Queue = asyncio.Queue(maxsize=worker_count * 2)
+    # The listing blocks on the network; it gets a thread of its own so
+    # the loop can return without waiting for its next page
+    feeder = ThreadPoolExecutor(max_workers=1, thread_name_prefix='listing-feed')
+    
+    async def feed():
+        loop = asyncio.get_running_loop()
+        items = iter(pending)
+        while True:
+            item = await loop.run_in_executor(feeder, next, items, None)
+            if item is None:
+                break
+            await queue.put(item)
+        for _ in range(worker_count):
+            await queue.put(None)
+    
+    def mark_failed(post: Dict):
+        with task_manager.lock:
+            post['status'] = STATUS_FAIL
+            task_manager.save_post_list(post_list)
+    
+    async def download_one(i: int, post: Dict):
+        post_id = post['post_id']
+        logger.info(f"Downloading post {i}/{len(post_list)} (ID: {post_id})")
+        # Files are written on the executor; rewriting post_list.json would
+        # otherwise stall every download in flight
+        loop = asyncio.get_running_loop()
+        
+        try:
+            # Get post details, unless the API listing already provided them
+            if post.get('image_url') and 'tags' in post:
+                image_url, tags = post['image_url'], post['tags']
+            else:
+                image_url, tags = await scraper.get_post_details_async(post_id)
             
-            # Update post status
-            post['status'] = STATUS_COMPLETE
-            post['image_url'] = image_url
-            post['file_extension'] = extension
-            post['download_timestamp'] = datetime.now().isoformat()
+            if not image_url:
+                logger.warning(f"Post {post_id}: No image URL found")
+                await loop.run_in_executor(scraper.executor, mark_failed, post)
+                return
             
-            # Update metadata
-            metadata['completed_posts'] = sum(1 for p in post_list if p['status'] == STATUS_COMPLETE)
-            metadata['last_updated'] = datetime.now().isoformat()
+            # Download image
+            image_data = await scraper.download_image_async(image_url)
             
-            # Save progress
-            task_manager.save_post_list(post_list)
-            task_manager.save_metadata(metadata)
+            await loop.run_in_executor(scraper.executor, store_post, task_manager, post, post_list,
+                                       metadata, image_url, image_data, tags)
             
         except ServerRefusedError:
-            post['status'] = STATUS_FAIL
-            task_manager.save_post_list(post_list)
+            await loop.run_in_executor(scraper.executor, mark_failed, post)
             raise
         except Exception as e:
             logger.error(f"Post {post_id}: Download failed - {e}")
-            post['status'] = STATUS_FAIL
-            task_manager.save_post_list(post_list)
-            # Continue to next post
+            await loop.run_in_executor(scraper.executor, mark_failed, post)
+    
+    async def worker():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            await download_one(*item)
+    
+    # Each post visits the page host and then the image host, so twice the
+    # per-host limit keeps both hosts saturated
+    tasks = [asyncio.ensure_future(feed())]
+    tasks.extend(asyncio.ensure_future(worker()) for _ in range(worker_count))
+    try:
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+    finally:
+        feeder.shutdown(wait=False)
 
 
 def sync_posts(scraper: DanbooruScraper, task_manager: TaskManager,
-               metadata: Dict, post_list: List[Dict]):
-    """Sync task with remote server to get new posts"""
+               metadata: Dict, post_list: List[Dict], full_sync: bool = False):
+    """
+    Sync task with remote server to get new posts
+    
+    Only posts newer than the task's highest post ID are listed unless
+    `full_sync` is set; a full sync also finds older posts that were
+    tagged after the last sync.
+    """
     tags = metadata['search_tags']
     
     # Get current post list from server
     logger.info("Fetching current post list from server...")
-    total_pages = scraper.get_total_pages(tags)
-    
-    remote_post_ids = set()
-    for page in range(1, total_pages + 1):
-        logger.info(f"Fetching page {page}/{total_pages}...")
-        post_ids = scraper.get_post_ids_from_page(tags, page)
-        remote_post_ids.update(post_ids)
+    scraper.listing_cache = ListingCache(task_manager.task_folder / LISTING_CACHE_FILE)
+    # A listing an earlier run left unfinished goes first, as the posts it
+    # found already count towards the high-water mark
+    new_posts = []
+    if metadata.get('listing_tags') is not None:
+        logger.info("Continuing the interrupted listing...")
+        new_posts.extend(run_listing(scraper, task_manager, metadata, post_list))
     
-    # Compare with local
-    local_post_ids = set(p['post_id'] for p in post_list)
-    new_post_ids = remote_post_ids - local_post_ids
+    # Only posts above the high-water mark are listed, unless --full-sync
+    mark = None if full_sync else high_water_mark(metadata, post_list)
+    if mark:
+        logger.info(f"Listing posts newer than {mark} (--full-sync lists every post)")
+        begin_listing(metadata, tags, f"a{mark}", scraper.listing_mode)
+    else:
+        begin_listing(metadata, tags, mode=scraper.listing_mode)
+    # New posts are saved to post_list page by page
+    new_posts.extend(run_listing(scraper, task_manager, metadata, post_list))
+    scraper.listing_cache.save()
+    if scraper.listing_cache.hits:
+        logger.info(f"{scraper.listing_cache.hits} listing pages unchanged since the last sync")
     
-    if not new_post_ids:
+    if not new_posts:
         logger.info("Sync complete: No new posts found")
+        metadata['max_post_id'] = high_water_mark(metadata, post_list)
         metadata['last_synced'] = datetime.now().isoformat()
         task_manager.save_metadata(metadata)
         return
     
-    logger.info(f"Found {len(new_post_ids)} new posts")
-    
-    # Add new posts to list
-    for post_id in new_post_ids:
-        post_list.append({
-            'post_id': post_id,
-            'status': STATUS_PENDING,
-            'image_url': None,
-            'file_extension': None,
-            'download_timestamp': None
-        })
-    
-    # Update metadata
-    metadata['total_posts'] = len(post_list)
-    task_manager.save_post_list(post_list)
-    task_manager.save_metadata(metadata)
+    logger.info(f"Found {len(new_posts)} new posts")
     
     # Download new posts
-    new_posts = [p for p in post_list if p['post_id'] in new_post_ids]
-    download_posts(scraper, task_manager, new_posts, metadata)
+    download_posts(scraper, task_manager, post_list, metadata, new_posts)
     
-    # Update sync timestamp
+    # Update sync timestamp and high-water mark
     metadata['last_synced'] = datetime.now().isoformat()
+    metadata['max_post_id'] = high_water_mark(metadata, post_list)
     metadata['total_posts'] = len(post_list)
     metadata['completed_posts'] = sum(1 for p in post_list if p['status'] == STATUS_COMPLETE)
     task_manager.save_metadata(metadata)
     task_manager.save_post_list(post_list)
     
-    logger.info(f"Sync complete: {len(new_post_ids)} new posts downloaded")
+    logger.info(f"Sync complete: {len(new_posts)} new posts downloaded")
 
 
 def main():
@@ -779,6 +1520,60 @@ def main():
                        help=f'Maximum retry attempts (default: {DEFAULT_MAX_RETRIES})')
     parser.add_argument('--proxy', help='Proxy server URL (HTTP/HTTPS/SOCKS5)')
     parser.add_argument('--proxy-auth', help='Proxy authentication (username:password)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                       help=f'Posts downloaded in parallel (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--listing-workers', type=int, default=DEFAULT_LISTING_WORKERS,
+                       help=f'Listing pages fetched in parallel (default: {DEFAULT_LISTING_WORKERS})')
+    parser.add_argument('--engine', choices=['sync', 'async'], default='sync',
+                       help='Download engine (default: sync)')
+    parser.add_argument('--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                       help=f'Requests in flight per host for the async engine (default: {DEFAULT_CONCURRENCY})')
+    parser.add_argument('--burst', type=int, default=DEFAULT_BURST,
+                       help=f'Requests allowed back-to-back before the throttle applies (default: {DEFAULT_BURST})')
+    parser.add_argument('--host-throttle', type=parse_host_throttle, action='append', metavar='HOST=SECONDS',
+                       help='Seconds between requests for one host, e.g. an image CDN (repeatable; "*.domain" matches subdomains)')
+    parser.add_argument('--adaptive', action='store_true',
+                       help='Adjust the throttle from server feedback (speeds up while healthy, backs off on 429/503/slow responses)')
+    parser.add_argument('--min-throttle', type=float, default=DEFAULT_MIN_THROTTLE,
+                       help=f'Fastest throttle --adaptive may reach in seconds (default: {DEFAULT_MIN_THROTTLE})')
+    parser.add_argument('--max-throttle', type=float, default=DEFAULT_MAX_THROTTLE,
+                       help=f'Slowest throttle --adaptive may back off to in seconds (default: {DEFAULT_MAX_THROTTLE})')
+    parser.add_argument('--state-dir', type=str, default=None,
+                       help='Directory for state kept between runs, e.g. learned throttles (default: ~/.booru-collection-crawler)')
+    parser.add_argument('--retry-budget', type=float, default=DEFAULT_RETRY_BUDGET, metavar='PERCENT',
+                       help=f'Retries allowed across the run, as a percentage of requests (default: {DEFAULT_RETRY_BUDGET:g})')
+    parser.add_argument('--breaker-threshold', type=int, default=DEFAULT_BREAKER_THRESHOLD,
+                       help=f'Consecutive failures before requests to a host fail fast (default: {DEFAULT_BREAKER_THRESHOLD})')
+    parser.add_argument('--breaker-cooldown', type=float, default=DEFAULT_BREAKER_COOLDOWN,
+                       help=f'Seconds a failing host is skipped before a probe request (default: {DEFAULT_BREAKER_COOLDOWN:g})')
+    parser.add_argument('--transport', choices=TRANSPORTS, default=DEFAULT_TRANSPORT,
+                       help='Connection transport: http1 (requests pools) or http2 (multiplexed, needs httpx[http2,socks]) '
+                            f'(default: {DEFAULT_TRANSPORT})')
+    parser.add_argument('--shared-throttle', action='store_true',
+                       help='Share the throttle with every other process crawling this site that uses the same --state-dir')
+    parser.add_argument('--cache', action='store_true',
+                       help='Reuse post and search pages fetched before from an on-disk cache under --state-dir')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE_MB, metavar='MB',
+                       help=f'Size limit of the response cache, least recently used pages go first (default: {DEFAULT_CACHE_SIZE_MB})')
+    parser.add_argument('--cache-ttl', type=parse_cache_ttl, action='append', metavar='REGEX=SECONDS',
+                       help='Seconds to cache pages whose URL matches REGEX, checked before the built-in rules (repeatable; 0 disables)')
+    parser.add_argument('--proxy-list', metavar='FILE',
+                       help='File of proxy URLs, one per line; requests are spread over them, each with its own throttle')
+    parser.add_argument('--proxy-strategy', choices=PROXY_STRATEGIES, default=DEFAULT_PROXY_STRATEGY,
+                       help=f'How --proxy-list proxies are picked (default: {DEFAULT_PROXY_STRATEGY})')
+    parser.add_argument('--proxy-cooldown', type=float, default=DEFAULT_PROXY_COOLDOWN,
+                       help=f'Seconds a failing proxy is left out before it is tried again (default: {DEFAULT_PROXY_COOLDOWN:g})')
+    parser.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND,
+                       help='Listing source: html pages, or the JSON API, which lists image URLs and tags '
+                            f'so posts need no page request of their own (default: {DEFAULT_BACKEND})')
+    parser.add_argument('--pagination', choices=PAGINATIONS, default=DEFAULT_PAGINATION,
+                       help='Listing pagination: keyset (page=b<id>) lists every post and resumes mid-listing; '
+                            f'numeric stops at page 1000 (default: {DEFAULT_PAGINATION})')
+    parser.add_argument('--full-sync', action='store_true',
+                       help='List every post on sync instead of only the ones newer than the task\'s latest post')
+    parser.add_argument('--shard-pages', type=int, default=0, metavar='PAGES',
+                       help='Split searches into ID ranges of about PAGES pages, listed --listing-workers at a time, '
+                            f'sized with /counts/posts.json requests (keyset pagination; e.g. {DEFAULT_SHARD_PAGES}; default: off)')
     
     args = parser.parse_args()
     
@@ -5,12 +5,20 @@ Test script for Danbooru scraper
 
 import sys
 import os
+import json
+import re
+import tempfile
+import threading
 from pathlib import Path
+from unittest.mock import Mock
 
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from danbooru_scraper import DanbooruScraper, TaskManager
+from danbooru_scraper import (
+    DanbooruScraper, AsyncDanbooruScraper, TaskManager, begin_listing, download_posts, iter_remote_pages,
+    list_remote_posts, run_listing, sync_posts, STATUS_PENDING, STATUS_COMPLETE
+)
 
 def test_pagination_parsing():
     """Test parsing pagination from search results"""
@@ -97,6 +105,334 @@ def test_task_folder_creation():
         print(f"✗ Failed task folder test: {e}")
         return False
 
+def test_async_download_posts():
+    """Test the async engine downloads every post and saves the task files"""
+    print("\nTesting async download engine...")
+    scraper = AsyncDanbooruScraper(throttle=0, concurrency=3, host_throttles={"cdn.donmai.us": 0})
+    
+    def fake_get(url, timeout=30):
+        response = Mock()
+        response.status_code = 200
+        if '/posts/' in url:
+            post_id = url.rsplit('/', 1)[-1]
+            response.text = (
+                f'<a class="image-view-original-link" href="https://cdn.donmai.us/original/{post_id}.png"></a>'
+                '<section id="tag-list"><ul class="artist-tag-list"><li data-tag-name="someone"></li></ul></section>'
+            )
+            response.headers = {}
+        else:
+            response.content = b'image-bytes'
+            response.headers = {'Content-Length': str(len(response.content))}
+        return response
+    
+    scraper.session.get = fake_get
+    
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            task_manager = TaskManager(Path(tmp))
+            task_manager.posts_folder.mkdir()
+            post_list = [{'post_id': post_id, 'status': STATUS_PENDING} for post_id in range(1, 11)]
+            metadata = {'completed_posts': 0}
+            
+            download_posts(scraper, task_manager, post_list, metadata)
+            
+            assert all(p['status'] == STATUS_COMPLETE for p in post_list)
+            assert metadata['completed_posts'] == 10
+            assert (task_manager.posts_folder / "7.png").read_bytes() == b'image-bytes'
+            assert (task_manager.posts_folder / "7_tags.json").exists()
+        print("✓ Async engine downloaded all posts")
+        
+        # A single adapter is mounted, sized for the threads and the async concurrency
+        adapter = scraper.session.get_adapter("https://danbooru.donmai.us/")
+        assert adapter is scraper.session.get_adapter("http://danbooru.donmai.us/")
+        assert adapter._pool_maxsize == max(scraper.workers, scraper.listing_workers, scraper.concurrency)
+        
+        # A lazy listing feeds the workers page by page: the second page is
+        # only listed once a post of the first one has been downloaded
+        first_done = threading.Event()
+        waited = []
+        
+        def listing(post_list):
+            post_list.append({'post_id': 1, 'status': STATUS_PENDING})
+            yield 1, post_list[0]
+            waited.append(first_done.wait(5))
+            post_list.append({'post_id': 2, 'status': STATUS_PENDING})
+            yield 2, post_list[1]
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            task_manager = TaskManager(Path(tmp))
+            task_manager.posts_folder.mkdir()
+            post_list = []
+            metadata = {'completed_posts': 0}
+            original_download = scraper.download_image_async
+            
+            async def download_image_async(url):
+                data = await original_download(url)
+                first_done.set()
+                return data
+            
+            scraper.download_image_async = download_image_async
+            # The event loop runs on this thread; saving must not block it
+            saved_on = set()
+            save_post_list = task_manager.save_post_list
+            task_manager.save_post_list = lambda posts: (saved_on.add(threading.current_thread()), save_post_list(posts))
+            download_posts(scraper, task_manager, post_list, metadata, listing(post_list))
+            
+            assert waited == [True]
+            assert saved_on and threading.current_thread() not in saved_on
+            assert [p['status'] for p in post_list] == [STATUS_COMPLETE, STATUS_COMPLETE]
+        print("✓ Async engine downloads posts while the listing runs")
+        return True
+    finally:
+        scraper.close()
+
+def test_api_backend():
+    """Test the API backend lists image URLs and tags so downloads skip post pages"""
+    print("\nTesting API backend...")
+    scraper = DanbooruScraper(throttle=0, backend='api', host_throttles={"cdn.donmai.us": 0})
+    requested = []
+    
+    def fake_get(url, **kwargs):
+        requested.append(url)
+        response = Mock()
+        response.status_code = 200
+        response.headers = {}
+        if '/posts.json' in url and 'page=1' in url:
+            response.text = json.dumps([
+                {'id': 7, 'file_url': 'https://cdn.donmai.us/original/7.png', 'file_ext': 'png',
+                 'md5': 'abc', 'file_size': 11, 'tag_string_artist': 'someone',
+                 'tag_string_general': '1girl solo', 'tag_string_meta': ''},
+                {'id': 6, 'file_ext': 'jpg'}
+            ])
+        elif '/posts.json' in url:
+            response.text = '[]'
+        elif '/posts/6' in url:
+            response.text = '<a class="image-view-original-link" href="https://cdn.donmai.us/original/6.jpg"></a>'
+        else:
+            response.content = b'image-bytes'
+        return response
+    
+    scraper.session.get = fake_get
+    post_list = list_remote_posts(scraper, "someone")
+    assert [p['post_id'] for p in post_list] == [7, 6]
+    assert post_list[0]['tags']['general'] == ['1girl', 'solo']
+    assert post_list[0]['image_url'] == 'https://cdn.donmai.us/original/7.png'
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        task_manager = TaskManager(Path(tmp))
+        task_manager.posts_folder.mkdir()
+        download_posts(scraper, task_manager, post_list, {'completed_posts': 0})
+        
+        assert all(p['status'] == STATUS_COMPLETE for p in post_list)
+        assert 'tags' not in post_list[0]
+        # Only the post without a file_url needed its page
+        assert [url for url in requested if '/posts/' in url] == ['https://danbooru.donmai.us/posts/6']
+        assert json.loads((task_manager.posts_folder / "7_tags.json").read_text())['artist'] == ['someone']
+    print("✓ API backend pre-filled URLs and tags")
+    return True
+
+
+def test_keyset_listing():
+    """Test keyset listings walk page=b<id> and resume from the saved cursor"""
+    print("\nTesting keyset pagination...")
+    scraper = DanbooruScraper(throttle=0)
+    pages = {'1': [9, 8, 7], 'b7': [6, 5, 4], 'b4': [3], 'b3': []}
+    requested = []
+    
+    def fake_get(url, **kwargs):
+        page = url.split('page=')[1].split('&')[0]
+        requested.append(page)
+        if page == 'b4' and fake_get.fail:
+            raise ConnectionError("interrupted")
+        response = Mock()
+        response.status_code = 200
+        response.headers = {}
+        response.text = ''.join(f'<a class="post-preview-link" href="/posts/{post_id}"></a>' for post_id in pages[page])
+        return response
+    
+    fake_get.fail = True
+    scraper.session.get = fake_get
+    with tempfile.TemporaryDirectory() as tmp:
+        task_manager = TaskManager(Path(tmp))
+        metadata = {'search_tags': 'tag', 'total_posts': 0}
+        post_list = []
+        begin_listing(metadata, 'tag')
+        try:
+            list(run_listing(scraper, task_manager, metadata, post_list))
+            assert False, "listing should have been interrupted"
+        except ConnectionError:
+            pass
+        
+        # The first two pages and the cursor below them were saved
+        metadata = task_manager.load_metadata()
+        post_list = task_manager.load_post_list()
+        assert metadata['listing_tags'] == 'tag'
+        assert metadata['listing_cursor'] == 4
+        assert [p['post_id'] for p in post_list] == [9, 8, 7, 6, 5, 4]
+        
+        fake_get.fail = False
+        requested.clear()
+        list(run_listing(scraper, task_manager, metadata, post_list))
+        assert requested == ['b4', 'b3']
+        assert [p['post_id'] for p in post_list] == [9, 8, 7, 6, 5, 4, 3]
+        assert task_manager.load_metadata()['listing_tags'] is None
+        assert task_manager.load_metadata()['listing_cursor'] is None
+    print("✓ Keyset listing resumed at the saved cursor")
+    return True
+
+
+def test_resume_numeric_checkpoint_with_keyset():
+    """Test a numeric page cursor is not read as a keyset post ID"""
+    print("\nTesting a numeric checkpoint resumed with keyset pagination...")
+    numeric = DanbooruScraper(throttle=0, pagination='numeric')
+    scraper = DanbooruScraper(throttle=0)
+    assert numeric.listing_mode == 'numeric-html'
+    assert scraper.listing_mode == 'keyset'
+    pages = {'1': [900, 800, 700], 'b700': [600, 500], 'b500': []}
+    requested = []
+    
+    def fake_get(url, **kwargs):
+        page = url.split('page=')[1].split('&')[0]
+        requested.append(page)
+        response = Mock()
+        response.status_code = 200
+        response.headers = {}
+        response.text = ''.join(f'<a class="post-preview-link" href="/posts/{post_id}"></a>' for post_id in pages[page])
+        return response
+    
+    scraper.session.get = fake_get
+    with tempfile.TemporaryDirectory() as tmp:
+        task_manager = TaskManager(Path(tmp))
+        metadata = {'search_tags': 'tag', 'total_posts': 1}
+        post_list = [{'post_id': 900, 'status': STATUS_PENDING}]
+        # Saved by --pagination numeric after its first page
+        begin_listing(metadata, 'tag', 2, numeric.listing_mode)
+        
+        list(run_listing(scraper, task_manager, metadata, post_list))
+        # page=b2 would have listed nothing; the listing starts over instead
+        assert requested == ['1', 'b700', 'b500']
+        assert [p['post_id'] for p in post_list] == [900, 800, 700, 600, 500]
+        assert task_manager.load_metadata()['listing_tags'] is None
+    print("✓ Numeric checkpoint listed again from the first page")
+    return True
+
+
+def test_incremental_sync():
+    """Test sync lists only the posts above the task's highest post ID"""
+    print("\nTesting incremental sync...")
+    scraper = DanbooruScraper(throttle=0)
+    pages = {'a5': [7, 6], 'a7': []}
+    requested = []
+    
+    def fake_get(url, **kwargs):
+        page = url.split('page=')[1].split('&')[0]
+        requested.append(page)
+        response = Mock()
+        response.status_code = 200
+        response.headers = {}
+        response.text = ''.join(f'<a class="post-preview-link" href="/posts/{post_id}"></a>' for post_id in pages[page])
+        return response
+    
+    scraper.session.get = fake_get
+    scraper.get_post_details = Mock(return_value=(None, {}))
+    with tempfile.TemporaryDirectory() as tmp:
+        task_manager = TaskManager(Path(tmp))
+        task_manager.posts_folder.mkdir()
+        post_list = [{'post_id': post_id, 'status': STATUS_COMPLETE} for post_id in (5, 4)]
+        metadata = {'search_tags': 'tag', 'completed_posts': 2}
+        sync_posts(scraper, task_manager, metadata, post_list)
+        
+        assert requested == ['a5', 'a7']
+        assert sorted(p['post_id'] for p in post_list) == [4, 5, 6, 7]
+        assert metadata['max_post_id'] == 7
+    print("✓ Sync walked only the pages above the high-water mark")
+    return True
+
+
+def test_parallel_numeric_listing():
+    """Test numeric pages are fetched in parallel, kept in page order and de-duplicated"""
+    print("\nTesting parallel numeric listing...")
+    scraper = DanbooruScraper(throttle=0, pagination='numeric', listing_workers=3)
+    # A post uploaded mid-listing pushed 7 from page 2 onto page 3
+    pages = {'1': [10, 9, 8], '2': [7, 6, 5], '3': [7, 4, 3], '4': [2]}
+    paginator = ('<a class="paginator-page" href="/posts?page=4&tags=tag">4</a>'
+                 '<a class="paginator-next" href="/posts?page=2&tags=tag">&gt;</a>')
+    requested = []
+    
+    def fake_get(url, **kwargs):
+        page = url.split('page=')[1].split('&')[0]
+        requested.append(page)
+        if page.startswith('b'):
+            # Boundary checks once drift is seen: the posts below an ID
+            post_ids = [post_id for post_id in range(10, 1, -1) if post_id < int(page[1:])][:3]
+        else:
+            post_ids = pages[page]
+        response = Mock()
+        response.status_code = 200
+        response.headers = {}
+        response.text = ''.join(f'<a class="post-preview-link" href="/posts/{post_id}"></a>'
+                                for post_id in post_ids) + paginator
+        return response
+    
+    scraper.session.get = fake_get
+    entries = list_remote_posts(scraper, 'tag')
+    
+    assert sorted(page for page in requested if page.isdigit()) == ['1', '2', '3', '4']
+    assert [entry['post_id'] for entry in entries] == [10, 9, 8, 7, 6, 5, 4, 3, 2]
+    # Page 4 was checked for posts skipped at its boundary, there were none
+    assert [page for page in requested if not page.isdigit()] == ['b3']
+    print("✓ Pages fetched once each and merged in page order")
+    return True
+
+
+def test_sharded_listing():
+    """Test --shard-pages lists counted ID ranges in parallel and merges them newest first"""
+    print("\nTesting ID-range sharded listing...")
+    scraper = DanbooruScraper(throttle=0, listing_workers=3, shard_pages=1)
+    post_ids = list(range(50, 0, -1))
+    counted = []
+    
+    def fake_get(url, **kwargs):
+        response = Mock()
+        response.status_code = 200
+        response.headers = {}
+        if '/counts/posts.json' in url:
+            low, high = re.search(r'id:(\d+)\.\.(\d+)', url).groups()
+            counted.append((int(low), int(high)))
+            response.text = json.dumps({'counts': {'posts': sum(int(low) <= i <= int(high) for i in post_ids)}})
+            return response
+        page = url.split('page=')[1].split('&')[0]
+        below = int(page[1:]) if page.startswith('b') else 51
+        # The server caps limit=200 at 20 posts per page
+        response.text = ''.join(f'<a class="post-preview-link" href="/posts/{post_id}"></a>'
+                                for post_id in [i for i in post_ids if i < below][:20])
+        if page == '1':
+            response.text += ('<a class="paginator-page" href="/posts?page=3&tags=tag">3</a>'
+                              '<a class="paginator-next" href="/posts?page=2&tags=tag">&gt;</a>')
+        return response
+    
+    scraper.session.get = fake_get
+    pages = list(iter_remote_pages(scraper, 'tag'))
+    
+    # Ranges of at most one served page, planned with one count per split
+    assert scraper.page_size == 20
+    assert [cursor for _, cursor in pages] == [39, 26, 14, 1]
+    assert counted[:2] == [(1, 50), (26, 50)]
+    assert [entry['post_id'] for entries, _ in pages for entry in entries] == post_ids
+    
+    # An interrupted sharded listing continues below its keyset cursor
+    assert [entry['post_id'] for entries, _ in iter_remote_pages(scraper, 'tag', 14)
+            for entry in entries] == list(range(13, 0, -1))
+    
+    # A two-tag search has no room for the probes' id: tag and is walked unsharded
+    counted.clear()
+    pages = list(iter_remote_pages(scraper, 'tag other'))
+    assert counted == []
+    assert [entry['post_id'] for entries, _ in pages for entry in entries] == post_ids
+    print("✓ Shards listed in parallel and merged newest first")
+    return True
+
+
 def main():
     """Run all tests"""
     print("=" * 60)
@@ -107,7 +443,14 @@ def main():
         test_pagination_parsing,
         test_post_id_extraction,
         test_post_details,
-        test_task_folder_creation
+        test_task_folder_creation,
+        test_async_download_posts,
+        test_api_backend,
+        test_keyset_listing,
+        test_resume_numeric_checkpoint_with_keyset,
+        test_incremental_sync,
+        test_parallel_numeric_listing,
+        test_sharded_listing
     ]
     
     results = []
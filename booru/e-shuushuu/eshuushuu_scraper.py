@@ -11,15 +11,36 @@ import json
 import time
 import hashlib
 import re
+import threading
 from datetime import datetime
+from itertools import chain
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
 from urllib.parse import urljoin, urlparse
 import logging
 
 import requests
 from bs4 import BeautifulSoup
 
+# Shared helpers live in booru/common
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.drift import track_drift
+from common.httpcache import (DEFAULT_CACHE_SIZE_MB, HTTP_CACHE_DIR, LISTING_PAGE_TTL, POST_PAGE_TTL,
+                              ResponseCache, parse_cache_ttl)
+from common.incremental import KnownPagesStop
+from common.listcache import LISTING_CACHE_FILE, ListingCache
+from common.pipeline import append_pages, begin_listing, prefetch
+from common.proxypool import (DEFAULT_PROXY_COOLDOWN, DEFAULT_PROXY_STRATEGY, PROXY_STRATEGIES, PooledProxy,
+                               ProxyPool, load_proxy_list)
+from common.ratelimit import (ADAPTIVE_STATE_FILE, SHARED_LIMITER_FILE, AdaptiveThrottle, HostRateLimiter,
+                              SharedRateStore, parse_host_throttle, parse_retry_after)
+from common.retry import (DEFAULT_BREAKER_COOLDOWN, DEFAULT_BREAKER_THRESHOLD,
+                          DEFAULT_RETRY_BUDGET, RetryPolicy)
+from common.scheduler import PRIORITY_DETAIL, PRIORITY_IMAGE, PRIORITY_LISTING, RequestScheduler
+from common.state import resolve_state_dir, save_json_state
+from common.transport import DEFAULT_TRANSPORT, TRANSPORTS, mount_transport
+from common.workers import run_bounded
+
 
 # Constants
 BASE_URL = "https://e-shuushuu.net"
@@ -28,6 +49,19 @@ DEFAULT_THROTTLE = 2.5
 DEFAULT_MAX_RETRIES = 3
 DEFAULT_RETRY_DELAY = 5
 RETRY_BACKOFF_MULTIPLIER = 2
+DEFAULT_WORKERS = 1
+DEFAULT_BURST = 1
+# Bounds for --adaptive (seconds between page requests)
+DEFAULT_MIN_THROTTLE = 0.5
+DEFAULT_MAX_THROTTLE = 30.0
+# Hosts with their own budget (HOST or *.DOMAIN -> seconds); images are
+# served from the page host, so there is nothing to split by default
+DEFAULT_HOST_THROTTLES = {}
+# What --cache keeps (URL regex, seconds); images are never cached
+DEFAULT_CACHE_TTLS = [
+    (r'/image/\d+/$', POST_PAGE_TTL),
+    (r'/search/results/', LISTING_PAGE_TTL),
+]
 
 # Exit codes
 EXIT_SUCCESS = 0
@@ -88,17 +122,89 @@ class EShuushuuScraper:
     def __init__(self, throttle: float = DEFAULT_THROTTLE, 
                  max_retries: int = DEFAULT_MAX_RETRIES,
                  proxy: Optional[str] = None,
-                 proxy_auth: Optional[str] = None):
+                 proxy_auth: Optional[str] = None,
+                 workers: int = DEFAULT_WORKERS,
+                 burst: int = DEFAULT_BURST,
+                 host_throttles: Optional[Dict[str, float]] = None,
+                 adaptive: bool = False,
+                 min_throttle: float = DEFAULT_MIN_THROTTLE,
+                 max_throttle: float = DEFAULT_MAX_THROTTLE,
+                 state_dir: Optional[str] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 transport: str = DEFAULT_TRANSPORT,
+                 shared_throttle: bool = False,
+                 cache: bool = False,
+                 cache_size: int = DEFAULT_CACHE_SIZE_MB,
+                 cache_ttls: Optional[List[Tuple[str, float]]] = None,
+                 proxy_list: Optional[List[str]] = None,
+                 proxy_strategy: str = DEFAULT_PROXY_STRATEGY,
+                 proxy_cooldown: float = DEFAULT_PROXY_COOLDOWN,
+                 scheduler: Optional[RequestScheduler] = None,
+                 task_weight: float = 1.0):
         self.throttle = throttle
         self.max_retries = max_retries
+        self.retry_policy = retry_policy or RetryPolicy(
+            max_retries, DEFAULT_RETRY_DELAY, RETRY_BACKOFF_MULTIPLIER)
         self.session = requests.Session()
-        self.last_request_time = 0
+        
+        # Pages use --throttle; other hosts (image CDNs) get separate budgets
+        host_intervals = {urlparse(BASE_URL).hostname: throttle}
+        host_intervals.update(DEFAULT_HOST_THROTTLES)
+        host_intervals.update(host_throttles or {})
+        
+        # With --shared-throttle every process crawling this site draws from one budget
+        shared_store = None
+        if shared_throttle:
+            shared_store = SharedRateStore(resolve_state_dir(state_dir) / SHARED_LIMITER_FILE)
+            logger.info(f"Sharing the throttle with other processes via {shared_store.path}")
+        self.rate_limiter = HostRateLimiter(throttle, host_intervals, burst,
+                                            store=shared_store, scope=BASE_URL)
+        self.workers = max(1, workers)
+        
+        # Learn the page rate from server feedback, starting from the last run's value
+        self.adaptive = None
+        if adaptive:
+            self.adaptive = AdaptiveThrottle(
+                self.rate_limiter.bucket_for(BASE_URL), urlparse(BASE_URL).hostname,
+                min_throttle, max_throttle, resolve_state_dir(state_dir) / ADAPTIVE_STATE_FILE)
+            logger.info(f"Adaptive throttle: {min_throttle}s - {max_throttle}s, "
+                        f"starting at {self.adaptive.interval:.2f}s")
+        
+        # Give every worker thread its own pooled connection (or HTTP/2 stream)
+        self.transport = transport
+        mount_transport(self.session, transport, self.workers)
+        
+        # Listing and detail requests go ahead of image downloads; scrapers
+        # sharing a scheduler get slots in proportion to their task_weight
+        self.scheduler = scheduler or RequestScheduler(self.workers + 1)
+        self.scheduler.set_weight(self, task_weight)
+        
+        # Set by sync to answer unchanged listing pages from the task folder
+        self.listing_cache: Optional[ListingCache] = None
+        
+        # With --cache, pages fetched before are answered from disk while fresh
+        self.response_cache: Optional[ResponseCache] = None
+        if cache:
+            self.response_cache = ResponseCache(resolve_state_dir(state_dir) / HTTP_CACHE_DIR,
+                                                list(cache_ttls or []) + DEFAULT_CACHE_TTLS,
+                                                cache_size * 1024 * 1024)
+            logger.info(f"Response cache: {self.response_cache.directory} (up to {cache_size} MB)")
         
         # Setup proxy if provided
         self.proxy_config = self._setup_proxy(proxy, proxy_auth)
         if self.proxy_config:
             self.session.proxies.update(self.proxy_config)
             logger.info(f"Proxy: {self._get_proxy_display_string(proxy, proxy_auth)}")
+        
+        # With --proxy-list requests are spread over the pool, each proxy with its own budget
+        self.proxy_pool: Optional[ProxyPool] = None
+        if proxy_list:
+            self.proxy_pool = ProxyPool(
+                [self._setup_proxy(url, proxy_auth)['http'] for url in proxy_list],
+                lambda url: HostRateLimiter(throttle, host_intervals, burst, store=shared_store,
+                                            scope=f"{BASE_URL} via {urlparse(url).netloc.rpartition('@')[2]}"),
+                proxy_strategy, cooldown=proxy_cooldown)
+            logger.info(f"Proxy pool: {len(proxy_list)} proxies, {proxy_strategy}")
     
     def _setup_proxy(self, proxy: Optional[str], proxy_auth: Optional[str]) -> Optional[Dict]:
         """Setup proxy configuration"""
@@ -133,6 +239,15 @@ class EShuushuuScraper:
     
     def _validate_proxy(self):
         """Test proxy connection to E-Shuushuu"""
+        if self.proxy_pool:
+            logger.info(f"Testing {len(self.proxy_pool.proxies)} proxies...")
+            working = self.proxy_pool.validate(
+                lambda proxies: self.session.get(BASE_URL, proxies=proxies, timeout=10).raise_for_status())
+            if not working:
+                raise ProxyConnectionError("No proxy in the pool could connect")
+            logger.info(f"{working} of {len(self.proxy_pool.proxies)} proxies working")
+            return
+        
         try:
             logger.info("Testing proxy connection...")
             response = self.session.get(BASE_URL, timeout=10)
@@ -147,46 +262,87 @@ class EShuushuuScraper:
                 raise ProxyAuthError("Proxy authentication required or credentials invalid")
             raise
     
-    def _throttle_request(self):
-        """Enforce rate limiting between requests"""
-        elapsed = time.time() - self.last_request_time
-        if elapsed < self.throttle:
-            time.sleep(self.throttle - elapsed)
-        self.last_request_time = time.time()
+    def _throttle_request(self, url: str = BASE_URL, proxy: Optional[PooledProxy] = None):
+        """Enforce the rate limit of the URL's host (shared by all worker threads, or per pooled proxy)"""
+        (proxy.limiter if proxy else self.rate_limiter).acquire(url)
     
-    def _make_request(self, url: str, retry_count: int = 0) -> requests.Response:
-        """Make HTTP request with retry logic"""
-        self._throttle_request()
+    def _record_response(self, url: str, status_code: Optional[int], elapsed: float,
+                         proxy: Optional[PooledProxy] = None):
+        """Feed the outcome of a request to the adaptive throttle, the circuit breakers and the proxy pool"""
+        if proxy:
+            self.proxy_pool.release(proxy, status_code, elapsed)
+        self.retry_policy.record_outcome(url, status_code)
+        if self.adaptive:
+            self.adaptive.record(url, status_code, elapsed)
+    
+    def _pause_for_retry_after(self, url: str, response: requests.Response, delay: float, attempt: int,
+                               proxy: Optional[PooledProxy] = None):
+        """Pause every request to the host for as long as a 429/503 response asks (`delay` without Retry-After)"""
+        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        if retry_after is not None:
+            delay = retry_after
+        logger.warning(f"HTTP {response.status_code} from {urlparse(url).hostname}, "
+                       f"pausing requests to it for {delay:.0f}s "
+                       f"(Attempt {attempt + 1}/{self.max_retries})")
+        # Behind a pool only the proxy that was refused has to wait
+        (proxy.limiter if proxy else self.rate_limiter).pause(url, delay)
+    
+    def _make_request(self, url: str, headers: Optional[Dict[str, str]] = None,
+                      use_cache: bool = True, priority: int = PRIORITY_DETAIL) -> requests.Response:
+        """Make HTTP request in the scheduler class `priority`, retrying as the retry policy allows"""
+        # Cacheable pages are fetched once, however many workers ask for them
+        if use_cache and self.response_cache and not headers and self.response_cache.ttl_for(url):
+            return self.response_cache.get_or_fetch(
+                url, lambda: self._make_request(url, use_cache=False, priority=priority))
         
-        try:
-            response = self.session.get(url, timeout=30)
-            
-            # Check for server refusal
-            if response.status_code in [403, 410]:
-                logger.error(f"HTTP {response.status_code} - Server refused request")
-                logger.error(f"URL: {url}")
-                logger.error(f"Headers: {dict(response.headers)}")
-                raise ServerRefusedError(f"Server returned {response.status_code}")
+        with self.scheduler.slot(priority, self):
+            return self._send_request(url, headers)
+    
+    def _send_request(self, url: str, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        """Send a request, retrying as the retry policy allows"""
+        attempt = 0
+        while True:
+            self.retry_policy.before_attempt(url, attempt)
+            proxy = self.proxy_pool.checkout() if self.proxy_pool else None
+            self._throttle_request(url, proxy)
             
-            # Check for 404
-            if response.status_code == 404:
-                logger.warning(f"Resource not found: {url}")
+            try:
+                started = time.monotonic()
+                response = self.session.get(url, headers=headers, timeout=30,
+                                            proxies=proxy.proxies if proxy else None)
+                self._record_response(url, response.status_code, time.monotonic() - started, proxy)
+                
+                # Check for server refusal
+                if response.status_code in [403, 410]:
+                    logger.error(f"HTTP {response.status_code} - Server refused request")
+                    logger.error(f"URL: {url}")
+                    logger.error(f"Headers: {dict(response.headers)}")
+                    raise ServerRefusedError(f"Server returned {response.status_code}")
+                
+                # Check for 404
+                if response.status_code == 404:
+                    logger.warning(f"Resource not found: {url}")
+                    return response
+                
+                response.raise_for_status()
                 return response
-            
-            response.raise_for_status()
-            return response
-            
-        except ServerRefusedError:
-            raise
-        except requests.exceptions.RequestException as e:
-            if retry_count < self.max_retries:
-                delay = DEFAULT_RETRY_DELAY * (RETRY_BACKOFF_MULTIPLIER ** retry_count)
-                logger.warning(f"Request failed: {e}. Retrying in {delay}s... (Attempt {retry_count + 1}/{self.max_retries})")
-                time.sleep(delay)
-                return self._make_request(url, retry_count + 1)
-            else:
-                logger.error(f"Request failed after {self.max_retries} retries: {e}")
+                
+            except ServerRefusedError:
                 raise
+            except requests.exceptions.RequestException as e:
+                if e.response is None:
+                    self._record_response(url, None, time.monotonic() - started, proxy)
+                delay = self.retry_policy.next_delay(url, attempt)
+                if delay is None:
+                    logger.error(f"Request failed after {attempt} retries: {e}")
+                    raise
+                if e.response is not None and e.response.status_code in [429, 503]:
+                    # Rate limited: pause the whole host, the retry waits in the limiter
+                    self._pause_for_retry_after(url, e.response, delay, attempt, proxy)
+                else:
+                    logger.warning(f"Request failed: {e}. Retrying in {delay:.1f}s... (Attempt {attempt + 1}/{self.max_retries})")
+                    time.sleep(delay)
+                attempt += 1
     
     def _build_search_url(self, tag_id: str, page: int = 1) -> str:
         """Build search URL from tag ID and page number"""
@@ -195,46 +351,80 @@ class EShuushuuScraper:
         else:
             return f"{BASE_URL}/search/results/?page={page}&tags={tag_id}"
     
-    def get_all_post_ids(self, tag_id: str) -> List[int]:
+    def _fetch_listing(self, url: str, parse: Callable[[str], Dict]) -> Dict:
+        """Fetch and parse a listing page, reusing the cached result if it has not changed"""
+        if self.listing_cache is None:
+            return parse(self._make_request(url, priority=PRIORITY_LISTING).text)
+        return self.listing_cache.fetch(
+            url, lambda url, headers=None: self._make_request(url, headers, priority=PRIORITY_LISTING), parse)
+    
+    def get_all_post_ids(self, tag_id: str,
+                         stop: Optional[Callable[[List[int]], bool]] = None) -> List[int]:
         """
         Get all post IDs by following pagination until exhaustion
         Returns list of post IDs
         """
-        all_post_ids = []
-        current_url = self._build_search_url(tag_id)
+        # A post pushed onto the next page by new uploads is listed once
+        pages = track_drift(self.iter_post_id_pages(tag_id, stop))
+        all_post_ids = [post_id for post_ids, _ in pages for post_id in post_ids]
+        logger.info(f"Total posts found: {len(all_post_ids)}")
+        return all_post_ids
+    
+    def iter_post_id_pages(self, tag_id: str, stop: Optional[Callable[[List[int]], bool]] = None,
+                           url: Optional[str] = None) -> Iterator[Tuple[List[int], Optional[str]]]:
+        """
+        Yield the post IDs page by page until the last page, or until `stop` says the rest is known
+        
+        Each page comes with the URL of the next one (None after the last);
+        pass it as `url` to continue an interrupted listing from there.
+        """
+        current_url = url or self._build_search_url(tag_id)
         page_num = 1
         
         while current_url:
             logger.info(f"Fetching page {page_num}...")
-            response = self._make_request(current_url)
-            soup = BeautifulSoup(response.text, 'html.parser')
+            page = self._fetch_listing(current_url, lambda html: self._parse_listing_page(html, current_url))
             
             # Extract post IDs from current page
-            post_ids = self._extract_post_ids_from_page(soup)
-            all_post_ids.extend(post_ids)
+            post_ids = page['post_ids']
             logger.info(f"Found {len(post_ids)} posts on page {page_num}")
+            yield post_ids, page['next_url']
             
-            # Find next page link
-            pagination = soup.select_one('.pagination')
-            if pagination:
-                next_link = pagination.select_one('.next a')
-                if next_link and next_link.get('href'):
-                    # Construct full URL for next page
-                    # The href contains query params like "?page=2&tags=76604"
-                    # We need to append to the search results path
-                    next_href = next_link['href']
-                    current_url = f"{BASE_URL}/search/results/{next_href}"
-                    page_num += 1
-                else:
-                    # No more pages
-                    current_url = None
-            else:
-                # No paginator, only one page
-                current_url = None
+            # Incremental sync: the remaining pages are already known
+            if stop and stop(post_ids):
+                logger.info("Remaining pages hold only known posts, stopping")
+                break
+            
+            # Follow the next page link
+            current_url = page['next_url']
+            if current_url:
+                page_num += 1
         
         logger.info(f"Total pages traversed: {page_num}")
-        logger.info(f"Total posts found: {len(all_post_ids)}")
-        return all_post_ids
+    
+    def _parse_listing_page(self, html: str, url: str) -> Dict:
+        """Parse post IDs and the next page URL from a search results page"""
+        soup = BeautifulSoup(html, 'html.parser')
+        post_ids = self._extract_post_ids_from_page(soup)
+        
+        # Find next page link
+        pagination = soup.select_one('.pagination')
+        if pagination:
+            next_link = pagination.select_one('.next a')
+            if next_link and next_link.get('href'):
+                # Construct full URL for next page
+                # The href contains query params like "?page=2&tags=76604"
+                # We need to append to the search results path
+                next_href = next_link['href']
+                next_url = f"{BASE_URL}/search/results/{next_href}"
+            else:
+                # No more pages
+                next_url = None
+        else:
+            # No paginator, only one page
+            next_url = None
+        
+        return {'post_ids': post_ids, 'next_url': next_url}
     
     def _extract_post_ids_from_page(self, soup: BeautifulSoup) -> List[int]:
         """Extract post IDs from a search results page"""
@@ -327,7 +517,7 @@ class EShuushuuScraper:
     
     def download_image(self, url: str) -> bytes:
         """Download image to memory"""
-        response = self._make_request(url)
+        response = self._make_request(url, priority=PRIORITY_IMAGE)
         
         # Validate content length if available
         content_length = response.headers.get('Content-Length')
@@ -348,6 +538,8 @@ class TaskManager:
         self.metadata_file = self.task_folder / "task_metadata.json"
         self.post_list_file = self.task_folder / "post_list.json"
         self.posts_folder = self.task_folder / "posts"
+        # Guards post_list/metadata updates made by download workers
+        self.lock = threading.RLock()
     
     @staticmethod
     def sanitize_tag_id(tag_id: str) -> str:
@@ -389,8 +581,8 @@ class TaskManager:
     
     def save_metadata(self, metadata: Dict):
         """Save task metadata"""
-        with open(self.metadata_file, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, indent=2, ensure_ascii=False)
+        with self.lock:
+            save_json_state(self.metadata_file, metadata)
     
     def load_metadata(self) -> Dict:
         """Load task metadata"""
@@ -403,8 +595,8 @@ class TaskManager:
     
     def save_post_list(self, posts: List[Dict]):
         """Save post list"""
-        with open(self.post_list_file, 'w', encoding='utf-8') as f:
-            json.dump(posts, f, indent=2, ensure_ascii=False)
+        with self.lock:
+            save_json_state(self.post_list_file, posts)
     
     def load_post_list(self) -> List[Dict]:
         """Load post list"""
@@ -449,6 +641,44 @@ class TaskManager:
         return 0.0
 
 
+def create_retry_policy(args) -> RetryPolicy:
+    """Create the retry policy from command-line arguments"""
+    return RetryPolicy(
+        max_retries=args.max_retries if hasattr(args, 'max_retries') else DEFAULT_MAX_RETRIES,
+        base_delay=DEFAULT_RETRY_DELAY,
+        multiplier=RETRY_BACKOFF_MULTIPLIER,
+        budget=getattr(args, 'retry_budget', DEFAULT_RETRY_BUDGET) / 100,
+        breaker_threshold=getattr(args, 'breaker_threshold', DEFAULT_BREAKER_THRESHOLD),
+        breaker_cooldown=getattr(args, 'breaker_cooldown', DEFAULT_BREAKER_COOLDOWN)
+    )
+
+
+def create_scraper(args) -> EShuushuuScraper:
+    """Create the scraper from command-line arguments"""
+    return EShuushuuScraper(
+        throttle=args.throttle if hasattr(args, 'throttle') else DEFAULT_THROTTLE,
+        max_retries=args.max_retries if hasattr(args, 'max_retries') else DEFAULT_MAX_RETRIES,
+        proxy=args.proxy,
+        proxy_auth=args.proxy_auth,
+        workers=getattr(args, 'workers', DEFAULT_WORKERS),
+        burst=getattr(args, 'burst', DEFAULT_BURST),
+        host_throttles=dict(getattr(args, 'host_throttle', None) or []),
+        adaptive=getattr(args, 'adaptive', False),
+        min_throttle=getattr(args, 'min_throttle', DEFAULT_MIN_THROTTLE),
+        max_throttle=getattr(args, 'max_throttle', DEFAULT_MAX_THROTTLE),
+        state_dir=getattr(args, 'state_dir', None),
+        retry_policy=create_retry_policy(args),
+        transport=getattr(args, 'transport', DEFAULT_TRANSPORT),
+        shared_throttle=getattr(args, 'shared_throttle', False),
+        cache=getattr(args, 'cache', False),
+        cache_size=getattr(args, 'cache_size', DEFAULT_CACHE_SIZE_MB),
+        cache_ttls=getattr(args, 'cache_ttl', None),
+        proxy_list=load_proxy_list(args.proxy_list) if getattr(args, 'proxy_list', None) else None,
+        proxy_strategy=getattr(args, 'proxy_strategy', DEFAULT_PROXY_STRATEGY),
+        proxy_cooldown=getattr(args, 'proxy_cooldown', DEFAULT_PROXY_COOLDOWN)
+    )
+
+
 def mode_new(args):
     """Execute new task creation mode"""
     logger.info(f"E-Shuushuu Scraper v{VERSION}")
@@ -457,15 +687,10 @@ def mode_new(args):
     logger.info(f"Storage: {args.storage_path}")
     
     # Create scraper
-    scraper = EShuushuuScraper(
-        throttle=args.throttle,
-        max_retries=args.max_retries,
-        proxy=args.proxy,
-        proxy_auth=args.proxy_auth
-    )
+    scraper = create_scraper(args)
     
     # Validate proxy if configured
-    if args.proxy:
+    if args.proxy or getattr(args, 'proxy_list', None):
         try:
             scraper._validate_proxy()
         except ProxyConnectionError:
@@ -492,27 +717,16 @@ def mode_new(args):
     task_manager.save_metadata(metadata)
     
     try:
-        # Get all post IDs by traversing pagination
-        all_post_ids = scraper.get_all_post_ids(args.tag_id)
-        
-        # Create post list with initial status
+        # Download posts as the listing finds them; post_list.json and the
+        # listing cursor are saved page by page, so resume can continue it
         post_list = []
-        for post_id in all_post_ids:
-            post_list.append({
-                'post_id': post_id,
-                'status': STATUS_PENDING,
-                'image_url': None,
-                'file_extension': None,
-                'download_timestamp': None
-            })
-        
-        # Update metadata
-        metadata['total_posts'] = len(all_post_ids)
-        task_manager.save_metadata(metadata)
-        task_manager.save_post_list(post_list)
-        
-        # Download posts
-        download_posts(scraper, task_manager, post_list, metadata)
+        begin_listing(metadata, args.tag_id)
+        listed = prefetch(run_listing(scraper, task_manager, metadata, post_list))
+        try:
+            download_posts(scraper, task_manager, post_list, metadata, listed)
+        finally:
+            # The listing must not keep saving after a refusal or error
+            listed.close()
         
         # Mark task as complete
         metadata['status'] = STATUS_COMPLETE
@@ -552,15 +766,10 @@ def mode_resume(args):
     logger.info(f"Tag ID: {metadata['search_tag_id']}")
     
     # Create scraper
-    scraper = EShuushuuScraper(
-        throttle=args.throttle if hasattr(args, 'throttle') else DEFAULT_THROTTLE,
-        max_retries=args.max_retries if hasattr(args, 'max_retries') else DEFAULT_MAX_RETRIES,
-        proxy=args.proxy,
-        proxy_auth=args.proxy_auth
-    )
+    scraper = create_scraper(args)
     
     # Validate proxy if configured
-    if args.proxy:
+    if args.proxy or getattr(args, 'proxy_list', None):
         try:
             scraper._validate_proxy()
         except ProxyConnectionError:
@@ -580,15 +789,25 @@ def mode_resume(args):
     task_manager.save_metadata(metadata)
     
     try:
-        # Resume download
-        download_posts(scraper, task_manager, post_list, metadata)
+        # Resume download, finishing an interrupted listing alongside
+        pending = [(i, post) for i, post in enumerate(post_list, 1) if post['status'] != STATUS_COMPLETE]
+        listed = None
+        if metadata.get('listing_tags') is not None:
+            logger.info(f"Continuing the interrupted listing after {len(post_list)} posts...")
+            listed = prefetch(run_listing(scraper, task_manager, metadata, post_list))
+            pending = chain(pending, listed)
+        try:
+            download_posts(scraper, task_manager, post_list, metadata, pending)
+        finally:
+            if listed is not None:
+                listed.close()
         
         # Download phase complete
         logger.info(f"Download phase complete: {metadata['completed_posts']}/{metadata['total_posts']} posts")
         
         # Auto-trigger sync
         logger.info("Triggering automatic sync operation...")
-        sync_posts(scraper, task_manager, metadata, post_list)
+        sync_posts(scraper, task_manager, metadata, post_list, getattr(args, 'full_sync', False))
         
         # Mark as complete
         metadata['status'] = STATUS_COMPLETE
@@ -628,15 +847,10 @@ def mode_sync(args):
     logger.info(f"Tag ID: {metadata['search_tag_id']}")
     
     # Create scraper
-    scraper = EShuushuuScraper(
-        throttle=args.throttle if hasattr(args, 'throttle') else DEFAULT_THROTTLE,
-        max_retries=args.max_retries if hasattr(args, 'max_retries') else DEFAULT_MAX_RETRIES,
-        proxy=args.proxy,
-        proxy_auth=args.proxy_auth
-    )
+    scraper = create_scraper(args)
     
     # Validate proxy if configured
-    if args.proxy:
+    if args.proxy or getattr(args, 'proxy_list', None):
         try:
             scraper._validate_proxy()
         except ProxyConnectionError:
@@ -649,7 +863,7 @@ def mode_sync(args):
         metadata['mode_history'].append('sync')
     
     try:
-        sync_posts(scraper, task_manager, metadata, post_list)
+        sync_posts(scraper, task_manager, metadata, post_list, getattr(args, 'full_sync', False))
         
         metadata['status'] = STATUS_COMPLETE
         metadata['last_updated'] = datetime.now().isoformat()
@@ -667,17 +881,55 @@ def mode_sync(args):
         sys.exit(EXIT_NETWORK_ERROR)
 
 
+def new_post_entry(post_id: int) -> Dict:
+    """Create a PENDING post_list entry"""
+    return {
+        'post_id': post_id,
+        'status': STATUS_PENDING,
+        'image_url': None,
+        'file_extension': None,
+        'download_timestamp': None
+    }
+
+
+def iter_remote_pages(scraper: EShuushuuScraper, tag_id: str, cursor: Optional[str] = None,
+                      stop: Optional[Callable[[List[int]], bool]] = None) -> Iterator[Tuple[List[Dict], str]]:
+    """Yield the posts of the search page by page as new post_list entries, each with the next page's URL"""
+    for post_ids, next_url in track_drift(scraper.iter_post_id_pages(tag_id, stop, cursor)):
+        yield [new_post_entry(post_id) for post_id in post_ids], next_url
+
+
+def run_listing(scraper: EShuushuuScraper, task_manager: TaskManager, metadata: Dict,
+                post_list: List[Dict]) -> Iterator[Tuple[int, Dict]]:
+    """
+    Run the task's current listing (see begin_listing) into post_list
+    
+    Continues from the saved listing cursor and yields the new entries
+    with their positions as the pages arrive (see append_pages). The
+    listing of an incremental sync stops once its pages hold only known
+    posts.
+    """
+    stop = None
+    if metadata.get('listing_incremental') and post_list:
+        stop = KnownPagesStop(p['post_id'] for p in post_list)
+    pages = iter_remote_pages(scraper, metadata['listing_tags'], metadata['listing_cursor'], stop)
+    return append_pages(pages, post_list, task_manager, metadata)
+
+
 def download_posts(scraper: EShuushuuScraper, task_manager: TaskManager, 
-                   post_list: List[Dict], metadata: Dict):
-    """Download posts from the list"""
-    total = len(post_list)
+                   post_list: List[Dict], metadata: Dict,
+                   pending: Optional[Iterable[Tuple[int, Dict]]] = None):
+    """
+    Download posts from the list, using scraper.workers threads
     
-    for i, post in enumerate(post_list, 1):
-        if post['status'] == STATUS_COMPLETE:
-            continue
-        
+    `pending` gives the (position, entry) pairs to download, by default
+    the list's unfinished posts. It may be a lazy iterator that appends
+    to post_list while the downloads run (see common.pipeline).
+    """
+    def download_one(item):
+        i, post = item
         post_id = post['post_id']
-        logger.info(f"Downloading post {i}/{total} (ID: {post_id})")
+        logger.info(f"Downloading post {i}/{len(post_list)} (ID: {post_id})")
         
         try:
             # Get post details
@@ -685,9 +937,10 @@ def download_posts(scraper: EShuushuuScraper, task_manager: TaskManager,
             
             if not image_url:
                 logger.warning(f"Post {post_id}: No image URL found")
-                post['status'] = STATUS_FAIL
-                task_manager.save_post_list(post_list)
-                continue
+                with task_manager.lock:
+                    post['status'] = STATUS_FAIL
+                    task_manager.save_post_list(post_list)
+                return
             
             # Extract file extension
             extension = image_url.split('.')[-1].split('?')[0]
@@ -704,74 +957,85 @@ def download_posts(scraper: EShuushuuScraper, task_manager: TaskManager,
             task_manager.save_tags(post_id, tags)
             logger.info(f"Tags saved: {post_id}_tags.json")
             
-            # Update post status
-            post['status'] = STATUS_COMPLETE
-            post['image_url'] = image_url
-            post['file_extension'] = extension
-            post['download_timestamp'] = datetime.now().isoformat()
-            
-            # Update metadata
-            metadata['completed_posts'] = sum(1 for p in post_list if p['status'] == STATUS_COMPLETE)
-            metadata['last_updated'] = datetime.now().isoformat()
-            
-            # Save progress
-            task_manager.save_post_list(post_list)
-            task_manager.save_metadata(metadata)
-            
+            with task_manager.lock:
+                # Update post status
+                post['status'] = STATUS_COMPLETE
+                post['image_url'] = image_url
+                post['file_extension'] = extension
+                post['download_timestamp'] = datetime.now().isoformat()
+                
+                # Update metadata
+                metadata['completed_posts'] = sum(1 for p in post_list if p['status'] == STATUS_COMPLETE)
+                metadata['last_updated'] = datetime.now().isoformat()
+                
+                # Save progress
+                task_manager.save_post_list(post_list)
+                task_manager.save_metadata(metadata)
+                
         except ImageNotFoundError as e:
             logger.error(f"Post {post_id}: {e}")
-            post['status'] = STATUS_FAIL
-            task_manager.save_post_list(post_list)
+            with task_manager.lock:
+                post['status'] = STATUS_FAIL
+                task_manager.save_post_list(post_list)
         except ServerRefusedError:
-            post['status'] = STATUS_FAIL
-            task_manager.save_post_list(post_list)
+            with task_manager.lock:
+                post['status'] = STATUS_FAIL
+                task_manager.save_post_list(post_list)
             raise
         except Exception as e:
             logger.error(f"Post {post_id}: Download failed - {e}")
-            post['status'] = STATUS_FAIL
-            task_manager.save_post_list(post_list)
+            with task_manager.lock:
+                post['status'] = STATUS_FAIL
+                task_manager.save_post_list(post_list)
             # Continue to next post
+    
+    if pending is None:
+        pending = ((i, post) for i, post in enumerate(post_list, 1)
+                   if post['status'] != STATUS_COMPLETE)
+    run_bounded(download_one, pending, scraper.workers)
 
 
 def sync_posts(scraper: EShuushuuScraper, task_manager: TaskManager,
-               metadata: Dict, post_list: List[Dict]):
-    """Sync task with remote server to get new posts"""
+               metadata: Dict, post_list: List[Dict], full_sync: bool = False):
+    """
+    Sync task with remote server to get new posts
+    
+    E-shuushuu has no post ID search, so the tag's newest-first pages are
+    walked until a few pages in a row hold only posts the task already
+    has. With `full_sync` every page is listed, which also finds older
+    images that were tagged after the last sync.
+    """
     tag_id = metadata['search_tag_id']
     
     # Get current post list from server
     logger.info("Fetching current post list from server...")
-    remote_post_ids = scraper.get_all_post_ids(tag_id)
+    scraper.listing_cache = ListingCache(task_manager.task_folder / LISTING_CACHE_FILE)
+    # A listing an earlier run left unfinished goes first, as the newest
+    # pages it found would already count as known
+    new_posts = []
+    if metadata.get('listing_tags') is not None:
+        logger.info("Continuing the interrupted listing...")
+        new_posts.extend(run_listing(scraper, task_manager, metadata, post_list))
     
-    # Compare with local
-    local_post_ids = set(p['post_id'] for p in post_list)
-    new_post_ids = set(remote_post_ids) - local_post_ids
+    # Newest-first pages are walked until they hold only known posts, unless --full-sync
+    begin_listing(metadata, tag_id)
+    metadata['listing_incremental'] = not full_sync
+    # New posts are saved to post_list page by page
+    new_posts.extend(run_listing(scraper, task_manager, metadata, post_list))
+    scraper.listing_cache.save()
+    if scraper.listing_cache.hits:
+        logger.info(f"{scraper.listing_cache.hits} listing pages unchanged since the last sync")
     
-    if not new_post_ids:
+    if not new_posts:
         logger.info("Sync complete: No new posts found")
         metadata['last_synced'] = datetime.now().isoformat()
         task_manager.save_metadata(metadata)
         return
     
-    logger.info(f"Found {len(new_post_ids)} new posts")
-    
-    # Add new posts to list
-    for post_id in new_post_ids:
-        post_list.append({
-            'post_id': post_id,
-            'status': STATUS_PENDING,
-            'image_url': None,
-            'file_extension': None,
-            'download_timestamp': None
-        })
-    
-    # Update metadata
-    metadata['total_posts'] = len(post_list)
-    task_manager.save_post_list(post_list)
-    task_manager.save_metadata(metadata)
+    logger.info(f"Found {len(new_posts)} new posts")
     
     # Download new posts
-    new_posts = [p for p in post_list if p['post_id'] in new_post_ids]
-    download_posts(scraper, task_manager, new_posts, metadata)
+    download_posts(scraper, task_manager, post_list, metadata, new_posts)
     
     # Update sync timestamp
     metadata['last_synced'] = datetime.now().isoformat()
@@ -780,7 +1044,7 @@ def sync_posts(scraper: EShuushuuScraper, task_manager: TaskManager,
     task_manager.save_metadata(metadata)
     task_manager.save_post_list(post_list)
     
-    logger.info(f"Sync complete: {len(new_post_ids)} new posts downloaded")
+    logger.info(f"Sync complete: {len(new_posts)} new posts downloaded")
 
 
 def main():
@@ -805,6 +1069,45 @@ def main():
                        help=f'Maximum retry attempts (default: {DEFAULT_MAX_RETRIES})')
     parser.add_argument('--proxy', help='Proxy server URL (HTTP/HTTPS/SOCKS5)')
     parser.add_argument('--proxy-auth', help='Proxy authentication (username:password)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                       help=f'Posts downloaded in parallel (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--burst', type=int, default=DEFAULT_BURST,
+                       help=f'Requests allowed back-to-back before the throttle applies (default: {DEFAULT_BURST})')
+    parser.add_argument('--host-throttle', type=parse_host_throttle, action='append', metavar='HOST=SECONDS',
+                       help='Seconds between requests for one host, e.g. an image CDN (repeatable; "*.domain" matches subdomains)')
+    parser.add_argument('--adaptive', action='store_true',
+                       help='Adjust the throttle from server feedback (speeds up while healthy, backs off on 429/503/slow responses)')
+    parser.add_argument('--min-throttle', type=float, default=DEFAULT_MIN_THROTTLE,
+                       help=f'Fastest throttle --adaptive may reach in seconds (default: {DEFAULT_MIN_THROTTLE})')
+    parser.add_argument('--max-throttle', type=float, default=DEFAULT_MAX_THROTTLE,
+                       help=f'Slowest throttle --adaptive may back off to in seconds (default: {DEFAULT_MAX_THROTTLE})')
+    parser.add_argument('--state-dir', type=str, default=None,
+                       help='Directory for state kept between runs, e.g. learned throttles (default: ~/.booru-collection-crawler)')
+    parser.add_argument('--retry-budget', type=float, default=DEFAULT_RETRY_BUDGET, metavar='PERCENT',
+                       help=f'Retries allowed across the run, as a percentage of requests (default: {DEFAULT_RETRY_BUDGET:g})')
+    parser.add_argument('--breaker-threshold', type=int, default=DEFAULT_BREAKER_THRESHOLD,
+                       help=f'Consecutive failures before requests to a host fail fast (default: {DEFAULT_BREAKER_THRESHOLD})')
+    parser.add_argument('--breaker-cooldown', type=float, default=DEFAULT_BREAKER_COOLDOWN,
+                       help=f'Seconds a failing host is skipped before a probe request (default: {DEFAULT_BREAKER_COOLDOWN:g})')
+    parser.add_argument('--transport', choices=TRANSPORTS, default=DEFAULT_TRANSPORT,
+                       help='Connection transport: http1 (requests pools) or http2 (multiplexed, needs httpx[http2,socks]) '
+                            f'(default: {DEFAULT_TRANSPORT})')
+    parser.add_argument('--shared-throttle', action='store_true',
+                       help='Share the throttle with every other process crawling this site that uses the same --state-dir')
+    parser.add_argument('--cache', action='store_true',
+                       help='Reuse post and search pages fetched before from an on-disk cache under --state-dir')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE_MB, metavar='MB',
+                       help=f'Size limit of the response cache, least recently used pages go first (default: {DEFAULT_CACHE_SIZE_MB})')
+    parser.add_argument('--cache-ttl', type=parse_cache_ttl, action='append', metavar='REGEX=SECONDS',
+                       help='Seconds to cache pages whose URL matches REGEX, checked before the built-in rules (repeatable; 0 disables)')
+    parser.add_argument('--proxy-list', metavar='FILE',
+                       help='File of proxy URLs, one per line; requests are spread over them, each with its own throttle')
+    parser.add_argument('--proxy-strategy', choices=PROXY_STRATEGIES, default=DEFAULT_PROXY_STRATEGY,
+                       help=f'How --proxy-list proxies are picked (default: {DEFAULT_PROXY_STRATEGY})')
+    parser.add_argument('--proxy-cooldown', type=float, default=DEFAULT_PROXY_COOLDOWN,
+                       help=f'Seconds a failing proxy is left out before it is tried again (default: {DEFAULT_PROXY_COOLDOWN:g})')
+    parser.add_argument('--full-sync', action='store_true',
+                       help='List every post on sync instead of only the ones newer than the task\'s latest post')
     
     args = parser.parse_args()
     
@@ -11,15 +11,39 @@ import json
 import time
 import hashlib
 import re
+import threading
 from datetime import datetime
+from itertools import chain
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
 from urllib.parse import urljoin, urlparse, quote_plus
 import logging
 
 import requests
 from bs4 import BeautifulSoup
 
+# Shared helpers live in booru/common
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from common.dapi import DapiClient
+from common.drift import sorted_by_id, track_drift
+from common.httpcache import (DEFAULT_CACHE_SIZE_MB, HTTP_CACHE_DIR, LISTING_PAGE_TTL, POST_PAGE_TTL,
+                              ResponseCache, parse_cache_ttl)
+from common.incremental import high_water_mark, newer_than
+from common.listcache import LISTING_CACHE_FILE, ListingCache
+from common.pipeline import append_pages, begin_listing, match_listing_mode, prefetch
+from common.proxypool import (DEFAULT_PROXY_COOLDOWN, DEFAULT_PROXY_STRATEGY, PROXY_STRATEGIES, PooledProxy,
+                               ProxyPool, load_proxy_list)
+from common.ratelimit import (ADAPTIVE_STATE_FILE, SHARED_LIMITER_FILE, AdaptiveThrottle, HostRateLimiter,
+                              SharedRateStore, parse_host_throttle, parse_retry_after)
+from common.retry import (DEFAULT_BREAKER_COOLDOWN, DEFAULT_BREAKER_THRESHOLD,
+                          DEFAULT_RETRY_BUDGET, RetryPolicy)
+from common.scheduler import PRIORITY_DETAIL, PRIORITY_IMAGE, PRIORITY_LISTING, RequestScheduler
+from common.shards import DEFAULT_SHARD_PAGES
+from common.state import resolve_state_dir, save_json_state
+from common.tagtypes import TAG_TYPES_DIR, TagTypeCache
+from common.transport import DEFAULT_TRANSPORT, TRANSPORTS, mount_transport
+from common.workers import imap_bounded, run_bounded
+
 
 # Constants
 BASE_URL = "https://gelbooru.com"
@@ -28,6 +52,32 @@ DEFAULT_THROTTLE = 2.5
 DEFAULT_MAX_RETRIES = 3
 DEFAULT_RETRY_DELAY = 5
 RETRY_BACKOFF_MULTIPLIER = 2
+DEFAULT_WORKERS = 1
+# Listing pages fetched in parallel; the rate limiter still spaces their requests
+DEFAULT_LISTING_WORKERS = 4
+DEFAULT_BURST = 1
+# Posts asked for per listing page (limit=); the site default is 42
+HTML_PAGE_LIMIT = 200
+# Bounds for --adaptive (seconds between page requests)
+DEFAULT_MIN_THROTTLE = 0.5
+DEFAULT_MAX_THROTTLE = 30.0
+# Image CDN hosts with their own, faster budget (HOST or *.DOMAIN -> seconds)
+DEFAULT_HOST_THROTTLES = {'*.gelbooru.com': 0.5}
+# What --cache keeps (URL regex, seconds); images are never cached
+DEFAULT_CACHE_TTLS = [
+    (r'[?&]s=view&', POST_PAGE_TTL),
+    (r'[?&]s=list&', LISTING_PAGE_TTL),
+    (r'[?&]page=dapi&s=post&', LISTING_PAGE_TTL),
+]
+# Listing backends: HTML pages, or the DAPI with image URLs and tags included
+BACKENDS = ('html', 'api')
+DEFAULT_BACKEND = 'html'
+# DAPI tag categories as named in tags files, and how many tags one type lookup may name
+DAPI_TAG_CATEGORIES = {'artist': 'artist', 'copyright': 'copyright', 'character': 'character',
+                       'meta': 'metadata', 'general': 'tag'}
+DAPI_TAG_BATCH = 100
+# gelbooru.com serves at most 100 posts per DAPI page
+DAPI_PAGE_LIMIT = 100
 
 # Exit codes
 EXIT_SUCCESS = 0
@@ -88,17 +138,108 @@ class GelbooruScraper:
     def __init__(self, throttle: float = DEFAULT_THROTTLE, 
                  max_retries: int = DEFAULT_MAX_RETRIES,
                  proxy: Optional[str] = None,
-                 proxy_auth: Optional[str] = None):
+                 proxy_auth: Optional[str] = None,
+                 workers: int = DEFAULT_WORKERS,
+                 burst: int = DEFAULT_BURST,
+                 host_throttles: Optional[Dict[str, float]] = None,
+                 adaptive: bool = False,
+                 min_throttle: float = DEFAULT_MIN_THROTTLE,
+                 max_throttle: float = DEFAULT_MAX_THROTTLE,
+                 state_dir: Optional[str] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 transport: str = DEFAULT_TRANSPORT,
+                 shared_throttle: bool = False,
+                 cache: bool = False,
+                 cache_size: int = DEFAULT_CACHE_SIZE_MB,
+                 cache_ttls: Optional[List[Tuple[str, float]]] = None,
+                 proxy_list: Optional[List[str]] = None,
+                 proxy_strategy: str = DEFAULT_PROXY_STRATEGY,
+                 proxy_cooldown: float = DEFAULT_PROXY_COOLDOWN,
+                 scheduler: Optional[RequestScheduler] = None,
+                 task_weight: float = 1.0,
+                 backend: str = DEFAULT_BACKEND,
+                 api_key: Optional[str] = None,
+                 user_id: Optional[str] = None,
+                 listing_workers: int = DEFAULT_LISTING_WORKERS,
+                 shard_pages: int = 0):
         self.throttle = throttle
         self.max_retries = max_retries
+        self.retry_policy = retry_policy or RetryPolicy(
+            max_retries, DEFAULT_RETRY_DELAY, RETRY_BACKOFF_MULTIPLIER)
         self.session = requests.Session()
-        self.last_request_time = 0
+        
+        # Pages use --throttle; other hosts (image CDNs) get separate budgets
+        host_intervals = {urlparse(BASE_URL).hostname: throttle}
+        host_intervals.update(DEFAULT_HOST_THROTTLES)
+        host_intervals.update(host_throttles or {})
+        
+        # With --shared-throttle every process crawling this site draws from one budget
+        shared_store = None
+        if shared_throttle:
+            shared_store = SharedRateStore(resolve_state_dir(state_dir) / SHARED_LIMITER_FILE)
+            logger.info(f"Sharing the throttle with other processes via {shared_store.path}")
+        self.rate_limiter = HostRateLimiter(throttle, host_intervals, burst,
+                                            store=shared_store, scope=BASE_URL)
+        self.workers = max(1, workers)
+        self.listing_workers = max(1, listing_workers)
+        # Lowered to what the server serves once a listing shows it caps limit=
+        self.page_limit = HTML_PAGE_LIMIT
+        
+        # Learn the page rate from server feedback, starting from the last run's value
+        self.adaptive = None
+        if adaptive:
+            self.adaptive = AdaptiveThrottle(
+                self.rate_limiter.bucket_for(BASE_URL), urlparse(BASE_URL).hostname,
+                min_throttle, max_throttle, resolve_state_dir(state_dir) / ADAPTIVE_STATE_FILE)
+            logger.info(f"Adaptive throttle: {min_throttle}s - {max_throttle}s, "
+                        f"starting at {self.adaptive.interval:.2f}s")
+        
+        # Give every worker thread its own pooled connection (or HTTP/2 stream)
+        self.transport = transport
+        mount_transport(self.session, transport, max(self.workers, self.listing_workers))
+        
+        # Listing and detail requests go ahead of image downloads; scrapers
+        # sharing a scheduler get slots in proportion to their task_weight
+        self.scheduler = scheduler or RequestScheduler(max(self.workers, self.listing_workers) + 1)
+        self.scheduler.set_weight(self, task_weight)
+        
+        # Set by sync to answer unchanged listing pages from the task folder
+        self.listing_cache: Optional[ListingCache] = None
+        
+        # With --cache, pages fetched before are answered from disk while fresh
+        self.response_cache: Optional[ResponseCache] = None
+        if cache:
+            self.response_cache = ResponseCache(resolve_state_dir(state_dir) / HTTP_CACHE_DIR,
+                                                list(cache_ttls or []) + DEFAULT_CACHE_TTLS,
+                                                cache_size * 1024 * 1024)
+            logger.info(f"Response cache: {self.response_cache.directory} (up to {cache_size} MB)")
         
         # Setup proxy if provided
         self.proxy_config = self._setup_proxy(proxy, proxy_auth)
         if self.proxy_config:
             self.session.proxies.update(self.proxy_config)
             logger.info(f"Proxy: {self._get_proxy_display_string(proxy, proxy_auth)}")
+        
+        # With --proxy-list requests are spread over the pool, each proxy with its own budget
+        self.proxy_pool: Optional[ProxyPool] = None
+        if proxy_list:
+            self.proxy_pool = ProxyPool(
+                [self._setup_proxy(url, proxy_auth)['http'] for url in proxy_list],
+                lambda url: HostRateLimiter(throttle, host_intervals, burst, store=shared_store,
+                                            scope=f"{BASE_URL} via {urlparse(url).netloc.rpartition('@')[2]}"),
+                proxy_strategy, cooldown=proxy_cooldown)
+            logger.info(f"Proxy pool: {len(proxy_list)} proxies, {proxy_strategy}")
+        
+        # With --backend api posts are listed through the DAPI, image URLs and tags included
+        self.backend = backend
+        self.dapi: Optional[DapiClient] = None
+        if backend == 'api':
+            tag_types = TagTypeCache(resolve_state_dir(state_dir) / TAG_TYPES_DIR /
+                                     f"{urlparse(BASE_URL).hostname}.json")
+            self.dapi = DapiClient(BASE_URL, self._fetch_listing, self._make_request, tag_types,
+                                   DAPI_TAG_CATEGORIES, api_key, user_id, DAPI_TAG_BATCH, DAPI_PAGE_LIMIT)
+        # With --shard-pages DAPI searches are listed as ID ranges of about that many pages
+        self.shard_pages = max(0, shard_pages)
     
     def _setup_proxy(self, proxy: Optional[str], proxy_auth: Optional[str]) -> Optional[Dict]:
         """Setup proxy configuration"""
@@ -131,8 +272,22 @@ class GelbooruScraper:
             auth_status = " (authenticated)"
         return f"{parsed.scheme}://{parsed.netloc}{auth_status}"
     
+    @property
+    def listing_mode(self) -> str:
+        """What listing cursors count: DAPI pages (api) or HTML post offsets (html)"""
+        return self.backend
+    
     def _validate_proxy(self):
         """Test proxy connection to Gelbooru"""
+        if self.proxy_pool:
+            logger.info(f"Testing {len(self.proxy_pool.proxies)} proxies...")
+            working = self.proxy_pool.validate(
+                lambda proxies: self.session.get(BASE_URL, proxies=proxies, timeout=10).raise_for_status())
+            if not working:
+                raise ProxyConnectionError("No proxy in the pool could connect")
+            logger.info(f"{working} of {len(self.proxy_pool.proxies)} proxies working")
+            return
+        
         try:
             logger.info("Testing proxy connection...")
             response = self.session.get(BASE_URL, timeout=10)
@@ -147,46 +302,87 @@ class GelbooruScraper:
                 raise ProxyAuthError("Proxy authentication required or credentials invalid")
             raise
     
-    def _throttle_request(self):
-        """Enforce rate limiting between requests"""
-        elapsed = time.time() - self.last_request_time
-        if elapsed < self.throttle:
-            time.sleep(self.throttle - elapsed)
-        self.last_request_time = time.time()
+    def _throttle_request(self, url: str = BASE_URL, proxy: Optional[PooledProxy] = None):
+        """Enforce the rate limit of the URL's host (shared by all worker threads, or per pooled proxy)"""
+        (proxy.limiter if proxy else self.rate_limiter).acquire(url)
+    
+    def _record_response(self, url: str, status_code: Optional[int], elapsed: float,
+                         proxy: Optional[PooledProxy] = None):
+        """Feed the outcome of a request to the adaptive throttle, the circuit breakers and the proxy pool"""
+        if proxy:
+            self.proxy_pool.release(proxy, status_code, elapsed)
+        self.retry_policy.record_outcome(url, status_code)
+        if self.adaptive:
+            self.adaptive.record(url, status_code, elapsed)
+    
+    def _pause_for_retry_after(self, url: str, response: requests.Response, delay: float, attempt: int,
+                               proxy: Optional[PooledProxy] = None):
+        """Pause every request to the host for as long as a 429/503 response asks (`delay` without Retry-After)"""
+        retry_after = parse_retry_after(response.headers.get('Retry-After'))
+        if retry_after is not None:
+            delay = retry_after
+        logger.warning(f"HTTP {response.status_code} from {urlparse(url).hostname}, "
+                       f"pausing requests to it for {delay:.0f}s "
+                       f"(Attempt {attempt + 1}/{self.max_retries})")
+        # Behind a pool only the proxy that was refused has to wait
+        (proxy.limiter if proxy else self.rate_limiter).pause(url, delay)
     
-    def _make_request(self, url: str, retry_count: int = 0) -> requests.Response:
-        """Make HTTP request with retry logic"""
-        self._throttle_request()
+    def _make_request(self, url: str, headers: Optional[Dict[str, str]] = None,
+                      use_cache: bool = True, priority: int = PRIORITY_DETAIL) -> requests.Response:
+        """Make HTTP request in the scheduler class `priority`, retrying as the retry policy allows"""
+        # Cacheable pages are fetched once, however many workers ask for them
+        if use_cache and self.response_cache and not headers and self.response_cache.ttl_for(url):
+            return self.response_cache.get_or_fetch(
+                url, lambda: self._make_request(url, use_cache=False, priority=priority))
         
-        try:
-            response = self.session.get(url, timeout=30)
-            
-            # Check for server refusal
-            if response.status_code in [403, 410]:
-                logger.error(f"HTTP {response.status_code} - Server refused request")
-                logger.error(f"URL: {url}")
-                logger.error(f"Headers: {dict(response.headers)}")
-                raise ServerRefusedError(f"Server returned {response.status_code}")
+        with self.scheduler.slot(priority, self):
+            return self._send_request(url, headers)
+    
+    def _send_request(self, url: str, headers: Optional[Dict[str, str]] = None) -> requests.Response:
+        """Send a request, retrying as the retry policy allows"""
+        attempt = 0
+        while True:
+            self.retry_policy.before_attempt(url, attempt)
+            proxy = self.proxy_pool.checkout() if self.proxy_pool else None
+            self._throttle_request(url, proxy)
             
-            # Check for 404
-            if response.status_code == 404:
-                logger.warning(f"Resource not found: {url}")
+            try:
+                started = time.monotonic()
+                response = self.session.get(url, headers=headers, timeout=30,
+                                            proxies=proxy.proxies if proxy else None)
+                self._record_response(url, response.status_code, time.monotonic() - started, proxy)
+                
+                # Check for server refusal
+                if response.status_code in [403, 410]:
+                    logger.error(f"HTTP {response.status_code} - Server refused request")
+                    logger.error(f"URL: {url}")
+                    logger.error(f"Headers: {dict(response.headers)}")
+                    raise ServerRefusedError(f"Server returned {response.status_code}")
+                
+                # Check for 404
+                if response.status_code == 404:
+                    logger.warning(f"Resource not found: {url}")
+                    return response
+                
+                response.raise_for_status()
                 return response
-            
-            response.raise_for_status()
-            return response
-            
-        except ServerRefusedError:
-            raise
-        except requests.exceptions.RequestException as e:
-            if retry_count < self.max_retries:
-                delay = DEFAULT_RETRY_DELAY * (RETRY_BACKOFF_MULTIPLIER ** retry_count)
-                logger.warning(f"Request failed: {e}. Retrying in {delay}s... (Attempt {retry_count + 1}/{self.max_retries})")
-                time.sleep(delay)
-                return self._make_request(url, retry_count + 1)
-            else:
-                logger.error(f"Request failed after {self.max_retries} retries: {e}")
+                
+            except ServerRefusedError:
                 raise
+            except requests.exceptions.RequestException as e:
+                if e.response is None:
+                    self._record_response(url, None, time.monotonic() - started, proxy)
+                delay = self.retry_policy.next_delay(url, attempt)
+                if delay is None:
+                    logger.error(f"Request failed after {attempt} retries: {e}")
+                    raise
+                if e.response is not None and e.response.status_code in [429, 503]:
+                    # Rate limited: pause the whole host, the retry waits in the limiter
+                    self._pause_for_retry_after(url, e.response, delay, attempt, proxy)
+                else:
+                    logger.warning(f"Request failed: {e}. Retrying in {delay:.1f}s... (Attempt {attempt + 1}/{self.max_retries})")
+                    time.sleep(delay)
+                attempt += 1
     
     def _build_search_url(self, tags: str, pid: int = 0) -> str:
         """Build search URL with proper tag encoding"""
@@ -196,47 +392,121 @@ class GelbooruScraper:
         encoded_tags = '+'.join(quote_plus(tag) for tag in tag_list)
         
         if pid == 0:
-            return f"{BASE_URL}/index.php?page=post&s=list&tags={encoded_tags}"
+            return f"{BASE_URL}/index.php?page=post&s=list&tags={encoded_tags}&limit={self.page_limit}"
         else:
-            return f"{BASE_URL}/index.php?page=post&s=list&tags={encoded_tags}&pid={pid}"
+            return f"{BASE_URL}/index.php?page=post&s=list&tags={encoded_tags}&limit={self.page_limit}&pid={pid}"
+    
+    def _fetch_listing(self, url: str, parse: Callable[[str], Dict]) -> Dict:
+        """Fetch and parse a listing page, reusing the cached result if it has not changed"""
+        if self.listing_cache is None:
+            return parse(self._make_request(url, priority=PRIORITY_LISTING).text)
+        return self.listing_cache.fetch(
+            url, lambda url, headers=None: self._make_request(url, headers, priority=PRIORITY_LISTING), parse)
     
     def get_all_post_ids(self, tags: str) -> List[int]:
         """
-        Get all post IDs by following pagination until exhaustion
+        Get all post IDs for search tags
         Returns list of post IDs
         """
-        all_post_ids = []
-        current_url = self._build_search_url(tags)
-        page_num = 1
-        
-        while current_url:
-            logger.info(f"Fetching page {page_num}...")
-            response = self._make_request(current_url)
-            soup = BeautifulSoup(response.text, 'html.parser')
+        all_post_ids = [post_id for post_ids, _ in self.iter_post_id_pages(tags) for post_id in post_ids]
+        logger.info(f"Total posts found: {len(all_post_ids)}")
+        return all_post_ids
+    
+    def iter_post_id_pages(self, tags: str, pid: int = 0) -> Iterator[Tuple[List[int], Optional[int]]]:
+        """
+        Yield the post IDs for search tags page by page, in page order, each post once
+        
+        Each page comes with the pid of the next one (None after the last);
+        pass it as `pid` to continue an interrupted listing from there.
+        Posts that page drift moved past a page boundary are listed from
+        an id:<N page (see common.drift), unless the tags sort the results.
+        """
+        fetch_below = (lambda post_id: self.get_post_ids_below(tags, post_id)) if sorted_by_id(tags) else None
+        return track_drift(self._iter_pid_pages(tags, pid), fetch_below)
+    
+    def _iter_pid_pages(self, tags: str, pid: int) -> Iterator[Tuple[List[int], Optional[int]]]:
+        """
+        Yield the post IDs of the pages from offset `pid` on, each with the next page's pid
+        
+        The first page's paginator gives the pid step (its next link) and
+        the pid of the last page, so the other pages are fetched
+        `listing_workers` at a time. Next links are followed one page at a
+        time when the last-page link is missing, and past the last page it
+        announced.
+        """
+        logger.info(f"Fetching the page at pid {pid}..." if pid else "Fetching page 1...")
+        page = self._get_listing_page(self._build_search_url(tags, pid))
+        yield page['post_ids'], self._parse_pid(page['next_url'])
+        page_count = 1
+        
+        step = (self._parse_pid(page['next_url']) or pid) - pid
+        if 0 < step < self.page_limit:
+            # The next page starts after the posts the server actually served
+            logger.info(f"Server serves {step} posts per page (asked for {self.page_limit})")
+            self.page_limit = step
+        last_pid = page.get('last_pid')
+        if step > 0 and last_pid and (last_pid - pid) % step == 0:
+            total_pages = last_pid // step + 1
+            logger.info(f"Total pages found: {total_pages}")
             
-            # Extract post IDs from current page
-            post_ids = self._extract_post_ids_from_page(soup)
-            all_post_ids.extend(post_ids)
-            logger.info(f"Found {len(post_ids)} posts on page {page_num}")
+            def fetch_page(page_pid):
+                logger.info(f"Fetching page {page_pid // step + 1}/{total_pages}...")
+                return self._get_listing_page(self._build_search_url(tags, page_pid))
             
-            # Find next page link
-            paginator = soup.select_one('#paginator')
-            if paginator:
-                next_link = paginator.select_one('a[alt="next"]')
-                if next_link and next_link.get('href'):
-                    # Construct full URL for next page
-                    current_url = urljoin(BASE_URL, next_link['href'])
-                    page_num += 1
-                else:
-                    # No more pages
-                    current_url = None
+            for page in imap_bounded(fetch_page, range(pid + step, last_pid + 1, step), self.listing_workers):
+                yield page['post_ids'], self._parse_pid(page['next_url'])
+                page_count += 1
+        
+        # Follow the next page links a truncated paginator leaves
+        while page['next_url']:
+            logger.info(f"Fetching page {page_count + 1}...")
+            page = self._get_listing_page(self._build_search_url(tags, self._parse_pid(page['next_url'])))
+            yield page['post_ids'], self._parse_pid(page['next_url'])
+            page_count += 1
+        
+        logger.info(f"Total pages traversed: {page_count}")
+    
+    def get_post_ids_below(self, tags: str, post_id: int) -> List[int]:
+        """Post IDs on the first page of the posts below `post_id`, a page uploads cannot shift"""
+        return self._get_listing_page(self._build_search_url(f"{tags} id:<{post_id}"))['post_ids']
+    
+    def _get_listing_page(self, url: str) -> Dict:
+        """Get post IDs and paginator links of a search results page"""
+        return self._fetch_listing(url, lambda html: self._parse_listing_page(html, url))
+    
+    def _parse_listing_page(self, html: str, url: str) -> Dict:
+        """Parse post IDs, the next page URL and the last page's pid from a search results page"""
+        soup = BeautifulSoup(html, 'html.parser')
+        post_ids = self._extract_post_ids_from_page(soup)
+        
+        # Find next page link
+        paginator = soup.select_one('#paginator')
+        if paginator:
+            next_link = paginator.select_one('a[alt="next"]')
+            if next_link and next_link.get('href'):
+                # Construct full URL for next page
+                next_url = urljoin(BASE_URL, next_link['href'])
             else:
-                # No paginator, only one page
-                current_url = None
+                # No more pages
+                next_url = None
+        else:
+            # No paginator, only one page
+            next_url = None
         
-        logger.info(f"Total pages traversed: {page_num}")
-        logger.info(f"Total posts found: {len(all_post_ids)}")
-        return all_post_ids
+        return {'post_ids': post_ids, 'next_url': next_url, 'last_pid': self._parse_last_pid(soup)}
+    
+    @staticmethod
+    def _parse_pid(url: Optional[str]) -> Optional[int]:
+        """Offset (pid) of a search results page URL, None for page 1"""
+        match = re.search(r'[?&]pid=(\d+)', url or '')
+        return int(match.group(1)) if match else None
+    
+    def _parse_last_pid(self, soup: BeautifulSoup) -> Optional[int]:
+        """Offset (pid) of the last page, from the paginator's last-page link"""
+        last_link = soup.select_one('#paginator a[alt="last page"]')
+        if last_link and last_link.get('href'):
+            return self._parse_pid(last_link['href'])
+        return None
     
     def _extract_post_ids_from_page(self, soup: BeautifulSoup) -> List[int]:
         """Extract post IDs from a search results page"""
@@ -336,7 +606,7 @@ class GelbooruScraper:
     
     def download_image(self, url: str) -> bytes:
         """Download image to memory"""
-        response = self._make_request(url)
+        response = self._make_request(url, priority=PRIORITY_IMAGE)
         
         # Validate content length if available
         content_length = response.headers.get('Content-Length')
@@ -357,6 +627,8 @@ class TaskManager:
         self.metadata_file = self.task_folder / "task_metadata.json"
         self.post_list_file = self.task_folder / "post_list.json"
         self.posts_folder = self.task_folder / "posts"
+        # Guards post_list/metadata updates made by download workers
+        self.lock = threading.RLock()
     
     @staticmethod
     def sanitize_tags(tags: str) -> str:
@@ -405,8 +677,8 @@ class TaskManager:
     
     def save_metadata(self, metadata: Dict):
         """Save task metadata"""
-        with open(self.metadata_file, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, indent=2, ensure_ascii=False)
+        with self.lock:
+            save_json_state(self.metadata_file, metadata)
     
     def load_metadata(self) -> Dict:
         """Load task metadata"""
@@ -419,8 +691,8 @@ class TaskManager:
     
     def save_post_list(self, posts: List[Dict]):
         """Save post list"""
-        with open(self.post_list_file, 'w', encoding='utf-8') as f:
-            json.dump(posts, f, indent=2, ensure_ascii=False)
+        with self.lock:
+            save_json_state(self.post_list_file, posts)
     
     def load_post_list(self) -> List[Dict]:
         """Load post list"""
@@ -465,6 +737,49 @@ class TaskManager:
         return 0.0
 
 
+def create_retry_policy(args) -> RetryPolicy:
+    """Create the retry policy from command-line arguments"""
+    return RetryPolicy(
+        max_retries=args.max_retries if hasattr(args, 'max_retries') else DEFAULT_MAX_RETRIES,
+        base_delay=DEFAULT_RETRY_DELAY,
+        multiplier=RETRY_BACKOFF_MULTIPLIER,
+        budget=getattr(args, 'retry_budget', DEFAULT_RETRY_BUDGET) / 100,
+        breaker_threshold=getattr(args, 'breaker_threshold', DEFAULT_BREAKER_THRESHOLD),
+        breaker_cooldown=getattr(args, 'breaker_cooldown', DEFAULT_BREAKER_COOLDOWN)
+    )
+
+
+def create_scraper(args) -> GelbooruScraper:
+    """Create the scraper from command-line arguments"""
+    return GelbooruScraper(
+        throttle=args.throttle if hasattr(args, 'throttle') else DEFAULT_THROTTLE,
+        max_retries=args.max_retries if hasattr(args, 'max_retries') else DEFAULT_MAX_RETRIES,
+        proxy=args.proxy,
+        proxy_auth=args.proxy_auth,
+        workers=getattr(args, 'workers', DEFAULT_WORKERS),
+        burst=getattr(args, 'burst', DEFAULT_BURST),
+        host_throttles=dict(getattr(args, 'host_throttle', None) or []),
+        adaptive=getattr(args, 'adaptive', False),
+        min_throttle=getattr(args, 'min_throttle', DEFAULT_MIN_THROTTLE),
+        max_throttle=getattr(args, 'max_throttle', DEFAULT_MAX_THROTTLE),
+        state_dir=getattr(args, 'state_dir', None),
+        retry_policy=create_retry_policy(args),
+        transport=getattr(args, 'transport', DEFAULT_TRANSPORT),
+        shared_throttle=getattr(args, 'shared_throttle', False),
+        cache=getattr(args, 'cache', False),
+        cache_size=getattr(args, 'cache_size', DEFAULT_CACHE_SIZE_MB),
+        cache_ttls=getattr(args, 'cache_ttl', None),
+        proxy_list=load_proxy_list(args.proxy_list) if getattr(args, 'proxy_list', None) else None,
+        proxy_strategy=getattr(args, 'proxy_strategy', DEFAULT_PROXY_STRATEGY),
+        proxy_cooldown=getattr(args, 'proxy_cooldown', DEFAULT_PROXY_COOLDOWN),
+        backend=getattr(args, 'backend', DEFAULT_BACKEND),
+        api_key=getattr(args, 'api_key', None),
+        user_id=getattr(args, 'user_id', None),
+        listing_workers=getattr(args, 'listing_workers', DEFAULT_LISTING_WORKERS),
+        shard_pages=getattr(args, 'shard_pages', 0)
+    )
+
+
 def mode_new(args):
     """Execute new task creation mode"""
     logger.info(f"Gelbooru Scraper v{VERSION}")
@@ -473,15 +788,10 @@ def mode_new(args):
     logger.info(f"Storage: {args.storage_path}")
     
     # Create scraper
-    scraper = GelbooruScraper(
-        throttle=args.throttle,
-        max_retries=args.max_retries,
-        proxy=args.proxy,
-        proxy_auth=args.proxy_auth
-    )
+    scraper = create_scraper(args)
     
     # Validate proxy if configured
-    if args.proxy:
+    if args.proxy or getattr(args, 'proxy_list', None):
         try:
             scraper._validate_proxy()
         except ProxyConnectionError:
@@ -508,27 +818,16 @@ def mode_new(args):
     task_manager.save_metadata(metadata)
     
     try:
-        # Get all post IDs by traversing pagination
-        all_post_ids = scraper.get_all_post_ids(args.tags)
-        
-        # Create post list with initial status
+        # Download posts as the listing finds them; post_list.json and the
+        # listing cursor are saved page by page, so resume can continue it
         post_list = []
-        for post_id in all_post_ids:
-            post_list.append({
-                'post_id': post_id,
-                'status': STATUS_PENDING,
-                'image_url': None,
-                'file_extension': None,
-                'download_timestamp': None
-            })
-        
-        # Update metadata
-        metadata['total_posts'] = len(all_post_ids)
-        task_manager.save_metadata(metadata)
-        task_manager.save_post_list(post_list)
-        
-        # Download posts
-        download_posts(scraper, task_manager, post_list, metadata)
+        begin_listing(metadata, args.tags, mode=scraper.listing_mode)
+        listed = prefetch(run_listing(scraper, task_manager, metadata, post_list))
+        try:
+            download_posts(scraper, task_manager, post_list, metadata, listed)
+        finally:
+            # The listing must not keep saving after a refusal or error
+            listed.close()
         
         # Mark task as complete
         metadata['status'] = STATUS_COMPLETE
@@ -568,15 +867,10 @@ def mode_resume(args):
     logger.info(f"Tags: {metadata['search_tags']}")
     
     # Create scraper
-    scraper = GelbooruScraper(
-        throttle=args.throttle if hasattr(args, 'throttle') else DEFAULT_THROTTLE,
-        max_retries=args.max_retries if hasattr(args, 'max_retries') else DEFAULT_MAX_RETRIES,
-        proxy=args.proxy,
-        proxy_auth=args.proxy_auth
-    )
+    scraper = create_scraper(args)
     
     # Validate proxy if configured
-    if args.proxy:
+    if args.proxy or getattr(args, 'proxy_list', None):
         try:
             scraper._validate_proxy()
         except ProxyConnectionError:
@@ -596,15 +890,25 @@ def mode_resume(args):
     task_manager.save_metadata(metadata)
     
     try:
-        # Resume download
-        download_posts(scraper, task_manager, post_list, metadata)
+        # Resume download, finishing an interrupted listing alongside
+        pending = [(i, post) for i, post in enumerate(post_list, 1) if post['status'] != STATUS_COMPLETE]
+        listed = None
+        if metadata.get('listing_tags') is not None:
+            logger.info(f"Continuing the interrupted listing after {len(post_list)} posts...")
+            listed = prefetch(run_listing(scraper, task_manager, metadata, post_list))
+            pending = chain(pending, listed)
+        try:
+            download_posts(scraper, task_manager, post_list, metadata, pending)
+        finally:
+            if listed is not None:
+                listed.close()
         
         # Download phase complete
         logger.info(f"Download phase complete: {metadata['completed_posts']}/{metadata['total_posts']} posts")
         
         # Auto-trigger sync
         logger.info("Triggering automatic sync operation...")
-        sync_posts(scraper, task_manager, metadata, post_list)
+        sync_posts(scraper, task_manager, metadata, post_list, getattr(args, 'full_sync', False))
         
         # Mark as complete
         metadata['status'] = STATUS_COMPLETE
@@ -644,15 +948,10 @@ def mode_sync(args):
     logger.info(f"Tags: {metadata['search_tags']}")
     
     # Create scraper
-    scraper = GelbooruScraper(
-        throttle=args.throttle if hasattr(args, 'throttle') else DEFAULT_THROTTLE,
-        max_retries=args.max_retries if hasattr(args, 'max_retries') else DEFAULT_MAX_RETRIES,
-        proxy=args.proxy,
-        proxy_auth=args.proxy_auth
-    )
+    scraper = create_scraper(args)
     
     # Validate proxy if configured
-    if args.proxy:
+    if args.proxy or getattr(args, 'proxy_list', None):
         try:
             scraper._validate_proxy()
         except ProxyConnectionError:
@@ -665,7 +964,7 @@ def mode_sync(args):
         metadata['mode_history'].append('sync')
     
     try:
-        sync_posts(scraper, task_manager, metadata, post_list)
+        sync_posts(scraper, task_manager, metadata, post_list, getattr(args, 'full_sync', False))
         
         metadata['status'] = STATUS_COMPLETE
         metadata['last_updated'] = datetime.now().isoformat()
@@ -683,27 +982,99 @@ def mode_sync(args):
         sys.exit(EXIT_NETWORK_ERROR)
 
 
+def new_post_entry(post_id: int, details: Optional[Dict] = None) -> Dict:
+    """Create a PENDING post_list entry; API listings pre-fill image URL and tags"""
+    entry = {
+        'post_id': post_id,
+        'status': STATUS_PENDING,
+        'image_url': None,
+        'file_extension': None,
+        'download_timestamp': None
+    }
+    if details:
+        entry.update(details)
+    return entry
+
+
+def list_remote_posts(scraper: GelbooruScraper, tags: str) -> List[Dict]:
+    """List the posts matching the tags on the server as new post_list entries"""
+    if scraper.dapi and scraper.shard_pages:
+        return [entry for entries, _ in iter_remote_pages(scraper, tags) for entry in entries]
+    if scraper.dapi:
+        return [new_post_entry(post['post_id'], post) for post in scraper.dapi.get_all_posts(tags)]
+    
+    return [new_post_entry(post_id) for post_id in scraper.get_all_post_ids(tags)]
+
+
+def iter_remote_pages(scraper: GelbooruScraper, tags: str,
+                      cursor: Union[int, str, None] = None) -> Iterator[Tuple[List[Dict], Union[int, str, None]]]:
+    """
+    Yield the posts matching the tags page by page as new post_list entries
+    
+    Each page comes with the pid of the next one, the DAPI's page index or
+    the HTML listing's post offset, or b{id} after an ID-range shard (the
+    posts below that ID are left); pass it as `cursor` to continue an
+    interrupted listing.
+    """
+    if isinstance(cursor, str) or (scraper.dapi and scraper.shard_pages and cursor is None
+                                   and sorted_by_id(tags)):
+        if not scraper.dapi:
+            raise ValueError("A listing split into ID-range shards continues with --backend api")
+        below = int(cursor[1:]) if cursor else None
+        shards = scraper.dapi.iter_shards(tags, scraper.shard_pages or DEFAULT_SHARD_PAGES,
+                                          scraper.listing_workers, below)
+        for posts, low in shards:
+            yield [new_post_entry(post['post_id'], post) for post in posts], f"b{low}"
+    elif scraper.dapi:
+        for posts, next_pid in scraper.dapi.iter_pages(tags, cursor or 0):
+            yield [new_post_entry(post['post_id'], post) for post in posts], next_pid
+    else:
+        for post_ids, next_pid in scraper.iter_post_id_pages(tags, cursor or 0):
+            yield [new_post_entry(post_id) for post_id in post_ids], next_pid
+
+
+def run_listing(scraper: GelbooruScraper, task_manager: TaskManager, metadata: Dict,
+                post_list: List[Dict]) -> Iterator[Tuple[int, Dict]]:
+    """
+    Run the task's current listing (see begin_listing) into post_list
+    
+    Continues from the saved listing cursor, unless another listing mode
+    saved it (see match_listing_mode), and yields the new entries with
+    their positions as the pages arrive (see append_pages).
+    """
+    match_listing_mode(metadata, scraper.listing_mode)
+    pages = iter_remote_pages(scraper, metadata['listing_tags'], metadata['listing_cursor'])
+    return append_pages(pages, post_list, task_manager, metadata)
+
+
 def download_posts(scraper: GelbooruScraper, task_manager: TaskManager, 
-                   post_list: List[Dict], metadata: Dict):
-    """Download posts from the list"""
-    total = len(post_list)
+                   post_list: List[Dict], metadata: Dict,
+                   pending: Optional[Iterable[Tuple[int, Dict]]] = None):
+    """
+    Download posts from the list, using scraper.workers threads
     
-    for i, post in enumerate(post_list, 1):
-        if post['status'] == STATUS_COMPLETE:
-            continue
-        
+    `pending` gives the (position, entry) pairs to download, by default
+    the list's unfinished posts. It may be a lazy iterator that appends
+    to post_list while the downloads run (see common.pipeline).
+    """
+    def download_one(item):
+        i, post = item
         post_id = post['post_id']
-        logger.info(f"Downloading post {i}/{total} (ID: {post_id})")
+        logger.info(f"Downloading post {i}/{len(post_list)} (ID: {post_id})")
         
         try:
-            # Get post details
-            image_url, tags = scraper.get_post_details(post_id)
+            # Get post details, unless the API listing already provided them
+            if post.get('image_url') and 'tags' in post:
+                image_url, tags = post['image_url'], post['tags']
+            else:
+                image_url, tags = scraper.get_post_details(post_id)
             
             if not image_url:
                 logger.warning(f"Post {post_id}: No image URL found")
-                post['status'] = STATUS_FAIL
-                task_manager.save_post_list(post_list)
-                continue
+                with task_manager.lock:
+                    post['status'] = STATUS_FAIL
+                    task_manager.save_post_list(post_list)
+                return
             
             # Extract file extension
             extension = image_url.split('.')[-1].split('?')[0]
@@ -720,83 +1091,99 @@ def download_posts(scraper: GelbooruScraper, task_manager: TaskManager,
             task_manager.save_tags(post_id, tags)
             logger.info(f"Tags saved: {post_id}_tags.json")
             
-            # Update post status
-            post['status'] = STATUS_COMPLETE
-            post['image_url'] = image_url
-            post['file_extension'] = extension
-            post['download_timestamp'] = datetime.now().isoformat()
-            
-            # Update metadata
-            metadata['completed_posts'] = sum(1 for p in post_list if p['status'] == STATUS_COMPLETE)
-            metadata['last_updated'] = datetime.now().isoformat()
-            
-            # Save progress
-            task_manager.save_post_list(post_list)
-            task_manager.save_metadata(metadata)
-            
+            with task_manager.lock:
+                # Update post status
+                post['status'] = STATUS_COMPLETE
+                post['image_url'] = image_url
+                post['file_extension'] = extension
+                post['download_timestamp'] = datetime.now().isoformat()
+                # Listed tags now live in the tags file
+                post.pop('tags', None)
+                
+                # Update metadata
+                metadata['completed_posts'] = sum(1 for p in post_list if p['status'] == STATUS_COMPLETE)
+                metadata['last_updated'] = datetime.now().isoformat()
+                
+                # Save progress
+                task_manager.save_post_list(post_list)
+                task_manager.save_metadata(metadata)
+                
         except ImageNotFoundError as e:
             logger.error(f"Post {post_id}: {e}")
-            post['status'] = STATUS_FAIL
-            task_manager.save_post_list(post_list)
+            with task_manager.lock:
+                post['status'] = STATUS_FAIL
+                task_manager.save_post_list(post_list)
         except ServerRefusedError:
-            post['status'] = STATUS_FAIL
-            task_manager.save_post_list(post_list)
+            with task_manager.lock:
+                post['status'] = STATUS_FAIL
+                task_manager.save_post_list(post_list)
             raise
         except Exception as e:
             logger.error(f"Post {post_id}: Download failed - {e}")
-            post['status'] = STATUS_FAIL
-            task_manager.save_post_list(post_list)
+            with task_manager.lock:
+                post['status'] = STATUS_FAIL
+                task_manager.save_post_list(post_list)
             # Continue to next post
+    
+    if pending is None:
+        pending = ((i, post) for i, post in enumerate(post_list, 1)
+                   if post['status'] != STATUS_COMPLETE)
+    run_bounded(download_one, pending, scraper.workers)
 
 
 def sync_posts(scraper: GelbooruScraper, task_manager: TaskManager,
-               metadata: Dict, post_list: List[Dict]):
-    """Sync task with remote server to get new posts"""
+               metadata: Dict, post_list: List[Dict], full_sync: bool = False):
+    """
+    Sync task with remote server to get new posts
+    
+    Only posts newer than the task's highest post ID are listed unless
+    `full_sync` is set; a full sync also finds older posts that were
+    tagged after the last sync.
+    """
     tags = metadata['search_tags']
     
     # Get current post list from server
     logger.info("Fetching current post list from server...")
-    remote_post_ids = scraper.get_all_post_ids(tags)
+    scraper.listing_cache = ListingCache(task_manager.task_folder / LISTING_CACHE_FILE)
+    # A listing an earlier run left unfinished goes first, as the posts it
+    # found already count towards the high-water mark
+    new_posts = []
+    if metadata.get('listing_tags') is not None:
+        logger.info("Continuing the interrupted listing...")
+        new_posts.extend(run_listing(scraper, task_manager, metadata, post_list))
     
-    # Compare with local
-    local_post_ids = set(p['post_id'] for p in post_list)
-    new_post_ids = set(remote_post_ids) - local_post_ids
+    # Only posts above the high-water mark are listed, unless --full-sync
+    mark = None if full_sync else high_water_mark(metadata, post_list)
+    if mark:
+        logger.info(f"Listing posts newer than {mark} (--full-sync lists every post)")
+    begin_listing(metadata, newer_than(tags, mark) if mark else tags, mode=scraper.listing_mode)
+    # New posts are saved to post_list page by page
+    new_posts.extend(run_listing(scraper, task_manager, metadata, post_list))
+    scraper.listing_cache.save()
+    if scraper.listing_cache.hits:
+        logger.info(f"{scraper.listing_cache.hits} listing pages unchanged since the last sync")
     
-    if not new_post_ids:
+    if not new_posts:
         logger.info("Sync complete: No new posts found")
+        metadata['max_post_id'] = high_water_mark(metadata, post_list)
         metadata['last_synced'] = datetime.now().isoformat()
         task_manager.save_metadata(metadata)
         return
     
-    logger.info(f"Found {len(new_post_ids)} new posts")
-    
-    # Add new posts to list
-    for post_id in new_post_ids:
-        post_list.append({
-            'post_id': post_id,
-            'status': STATUS_PENDING,
-            'image_url': None,
-            'file_extension': None,
-            'download_timestamp': None
-        })
-    
-    # Update metadata
-    metadata['total_posts'] = len(post_list)
-    task_manager.save_post_list(post_list)
-    task_manager.save_metadata(metadata)
+    logger.info(f"Found {len(new_posts)} new posts")
     
     # Download new posts
-    new_posts = [p for p in post_list if p['post_id'] in new_post_ids]
-    download_posts(scraper, task_manager, new_posts, metadata)
+    download_posts(scraper, task_manager, post_list, metadata, new_posts)
     
-    # Update sync timestamp
+    # Update sync timestamp and high-water mark
     metadata['last_synced'] = datetime.now().isoformat()
+    metadata['max_post_id'] = high_water_mark(metadata, post_list)
     metadata['total_posts'] = len(post_list)
     metadata['completed_posts'] = sum(1 for p in post_list if p['status'] == STATUS_COMPLETE)
     task_manager.save_metadata(metadata)
     task_manager.save_post_list(post_list)
     
-    logger.info(f"Sync complete: {len(new_post_ids)} new posts downloaded")
+    logger.info(f"Sync complete: {len(new_posts)} new posts downloaded")
 
 
 def main():
@@ -821,9 +1208,64 @@ def main():
                        help=f'Maximum retry attempts (default: {DEFAULT_MAX_RETRIES})')
     parser.add_argument('--proxy', help='Proxy server URL (HTTP/HTTPS/SOCKS5)')
     parser.add_argument('--proxy-auth', help='Proxy authentication (username:password)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                       help=f'Posts downloaded in parallel (default: {DEFAULT_WORKERS})')
+    parser.add_argument('--listing-workers', type=int, default=DEFAULT_LISTING_WORKERS,
+                       help=f'Listing pages fetched in parallel (default: {DEFAULT_LISTING_WORKERS})')
+    parser.add_argument('--burst', type=int, default=DEFAULT_BURST,
+                       help=f'Requests allowed back-to-back before the throttle applies (default: {DEFAULT_BURST})')
+    parser.add_argument('--host-throttle', type=parse_host_throttle, action='append', metavar='HOST=SECONDS',
+                       help='Seconds between requests for one host, e.g. an image CDN (repeatable; "*.domain" matches subdomains)')
+    parser.add_argument('--adaptive', action='store_true',
+                       help='Adjust the throttle from server feedback (speeds up while healthy, backs off on 429/503/slow responses)')
+    parser.add_argument('--min-throttle', type=float, default=DEFAULT_MIN_THROTTLE,
+                       help=f'Fastest throttle --adaptive may reach in seconds (default: {DEFAULT_MIN_THROTTLE})')
+    parser.add_argument('--max-throttle', type=float, default=DEFAULT_MAX_THROTTLE,
+                       help=f'Slowest throttle --adaptive may back off to in seconds (default: {DEFAULT_MAX_THROTTLE})')
+    parser.add_argument('--state-dir', type=str, default=None,
+                       help='Directory for state kept between runs, e.g. learned throttles (default: ~/.booru-collection-crawler)')
+    parser.add_argument('--retry-budget', type=float, default=DEFAULT_RETRY_BUDGET, metavar='PERCENT',
+                       help=f'Retries allowed across the run, as a percentage of requests (default: {DEFAULT_RETRY_BUDGET:g})')
+    parser.add_argument('--breaker-threshold', type=int, default=DEFAULT_BREAKER_THRESHOLD,
+                       help=f'Consecutive failures before requests to a host fail fast (default: {DEFAULT_BREAKER_THRESHOLD})')
+    parser.add_argument('--breaker-cooldown', type=float, default=DEFAULT_BREAKER_COOLDOWN,
+                       help=f'Seconds a failing host is skipped before a probe request (default: {DEFAULT_BREAKER_COOLDOWN:g})')
+    parser.add_argument('--transport', choices=TRANSPORTS, default=DEFAULT_TRANSPORT,
+                       help='Connection transport: http1 (requests pools) or http2 (multiplexed, needs httpx[http2,socks]) '
+                            f'(default: {DEFAULT_TRANSPORT})')
+    parser.add_argument('--shared-throttle', action='store_true',
+                       help='Share the throttle with every other process crawling this site that uses the same --state-dir')
+    parser.add_argument('--cache', action='store_true',
+                       help='Reuse post and search pages fetched before from an on-disk cache under --state-dir')
+    parser.add_argument('--cache-size', type=int, default=DEFAULT_CACHE_SIZE_MB, metavar='MB',
+                       help=f'Size limit of the response cache, least recently used pages go first (default: {DEFAULT_CACHE_SIZE_MB})')
+    parser.add_argument('--cache-ttl', type=parse_cache_ttl, action='append', metavar='REGEX=SECONDS',
+                       help='Seconds to cache pages whose URL matches REGEX, checked before the built-in rules (repeatable; 0 disables)')
+    parser.add_argument('--proxy-list', metavar='FILE',
+                       help='File of proxy URLs, one per line; requests are spread over them, each with its own throttle')
+    parser.add_argument('--proxy-strategy', choices=PROXY_STRATEGIES, default=DEFAULT_PROXY_STRATEGY,
+                       help=f'How --proxy-list proxies are picked (default: {DEFAULT_PROXY_STRATEGY})')
+    parser.add_argument('--proxy-cooldown', type=float, default=DEFAULT_PROXY_COOLDOWN,
+                       help=f'Seconds a failing proxy is left out before it is tried again (default: {DEFAULT_PROXY_COOLDOWN:g})')
+    parser.add_argument('--backend', choices=BACKENDS, default=DEFAULT_BACKEND,
+                       help='Listing source: html pages, or the DAPI, which lists image URLs and tags '
+                            f'so posts need no page request of their own (default: {DEFAULT_BACKEND})')
+    parser.add_argument('--api-key',
+                       help='DAPI key from your account options page, sent with --user-id (api backend)')
+    parser.add_argument('--user-id',
+                       help='Account user ID that goes with --api-key (api backend)')
+    parser.add_argument('--full-sync', action='store_true',
+                       help='List every post on sync instead of only the ones newer than the task\'s latest post')
+    parser.add_argument('--shard-pages', type=int, default=0, metavar='PAGES',
+                       help='Split searches into ID ranges of about PAGES DAPI pages, listed --listing-workers at a time, '
+                            f'sized with count requests (api backend; e.g. {DEFAULT_SHARD_PAGES}; default: off)')
     
     args = parser.parse_args()
     
+    if args.shard_pages and args.backend != 'api':
+        logger.error("--shard-pages needs --backend api, whose count attribute sizes the shards")
+        sys.exit(EXIT_INVALID_ARGS)
+    
     # Validate mode-specific arguments
     if args.mode == 'new':
         if not args.tags or not args.storage_path:
@@ -21,7 +21,7 @@ def test_url_building():
     
     # Test single tag
     url = scraper._build_search_url("honma_meiko")
-    expected = "https://gelbooru.com/index.php?page=post&s=list&tags=honma_meiko"
+    expected = "https://gelbooru.com/index.php?page=post&s=list&tags=honma_meiko&limit=200"
     assert url == expected, f"Expected {expected}, got {url}"
     print("✓ Single tag URL building works")
     
@@ -6,11 +6,12 @@ Tests basic functionality without downloading full datasets
 
 import sys
 from pathlib import Path
+from unittest.mock import Mock
 
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from rule34.rule34_scraper import Rule34Scraper, BASE_URL
+from rule34.rule34_scraper import Rule34Scraper, BASE_URL, list_remote_posts
 
 def test_url_building():
     """Test URL construction with various tag combinations"""
@@ -36,14 +37,51 @@ def test_url_building():
     print(f"Special chars (page 1): {url}")
     assert "%3a" in url.lower() or "%3A" in url  # : should be encoded
     
-    # Test page 2
+    # Test page 2, before page 1 showed how many posts the server serves
     url = scraper._build_search_url("hatsune_miku", 2)
     print(f"Single tag (page 2): {url}")
-    assert "pid=42" in url
+    assert "limit=200&pid=200" in url
+    scraper.page_size = 42
+    assert "pid=42" in scraper._build_search_url("hatsune_miku", 2)
     
     print("✓ URL construction tests passed\n")
 
 
+def test_page_size_detection():
+    """Test the pid offsets follow the page size of page 1 (offline)"""
+    print("Testing page size detection...")
+    scraper = Rule34Scraper(throttle=0, listing_workers=2)
+    # 20 posts per page and a last page at pid=40
+    pages = {0: list(range(100, 80, -1)), 20: list(range(80, 60, -1)), 40: [60, 59]}
+    requested = []
+    
+    def fake_get(url, **kwargs):
+        pid = int(url.split('pid=')[1]) if 'pid=' in url else 0
+        requested.append(pid)
+        # An id:<N search below the listing is a page 1 of its own
+        step = 5 if 'id%3A%3C' in url else 20
+        response = Mock()
+        response.status_code = 200
+        response.headers = {}
+        response.text = ('<div id="post-list"><div class="image-list">'
+                         + ''.join(f'<span><a id="p{post_id}"></a></span>' for post_id in pages[pid])
+                         + f'</div></div><div id="paginator"><a alt="next" href="?pid={step}"></a>'
+                         '<a alt="last page" href="?page=post&s=list&pid=40"></a></div>')
+        return response
+    
+    scraper.session.get = fake_get
+    entries = list_remote_posts(scraper, 'tag')
+    
+    assert scraper.page_size == 20
+    assert sorted(requested) == [0, 20, 40]
+    assert [entry['post_id'] for entry in entries] == list(range(100, 58, -1))
+    
+    # The drift check's anchored page 1 leaves the listing's offsets alone
+    scraper.get_post_ids_below('tag', 61)
+    assert scraper.page_size == 20
+    print("✓ Page size detection test passed\n")
+
+
 def test_pagination():
     """Test pagination detection"""
     print("Testing pagination...")
@@ -121,6 +159,7 @@ def main():
     
     try:
         test_url_building()
+        test_page_size_detection()
         test_pagination()
         test_post_id_extraction()
         test_post_details()
@@ -3,20 +3,32 @@
 Test suite for TBIB Scraper
 """
 
+import json
+import re
 import unittest
 import tempfile
 import shutil
 from pathlib import Path
 from unittest.mock import Mock, patch, MagicMock
+import requests
 from bs4 import BeautifulSoup
 
 from tbib_scraper import (
     TbibScraper,
     TaskManager,
+    ServerRefusedError,
+    download_posts,
+    list_remote_posts,
+    run_listing,
+    sync_posts,
     STATUS_PENDING,
     STATUS_COMPLETE,
-    BASE_URL
+    STATUS_FAIL,
+    BASE_URL,
+    HTML_PAGE_LIMIT
 )
+from common.pipeline import begin_listing, prefetch
+from common.retry import CircuitOpenError, RetryPolicy
 
 
 class TestTbibScraper(unittest.TestCase):
@@ -39,6 +51,135 @@ class TestTbibScraper(unittest.TestCase):
         # Special characters should be encoded
         url = self.scraper._build_search_url("tag with spaces")
         self.assertIn("tag+with+spaces", url)
+        
+        # Later pages are addressed by post offset; every page asks for the largest page size
+        url = self.scraper._build_search_url("honma_meiko", pid=42)
+        self.assertIn("&pid=42", url)
+        self.assertIn(f"&limit={HTML_PAGE_LIMIT}", url)
+    
+    def _listing_session(self, pages, last_pid, posts=()):
+        """
+        Fake session serving `pages` (pid -> post IDs) with a paginator announcing `last_pid`
+        
+        id:<N searches get the first two of `posts` below N and are
+        recorded as 'id:<N'.
+        """
+        requested = []
+        
+        def fake_get(url, **kwargs):
+            anchor = re.search(r'id%3A%3C(\d+)', url)
+            if anchor:
+                requested.append(f"id:<{anchor.group(1)}")
+                post_ids = [post_id for post_id in posts if post_id < int(anchor.group(1))][:2]
+            else:
+                pid = self.scraper._parse_pid(url) or 0
+                requested.append(pid)
+                post_ids = pages[pid]
+            links = ''
+            if not anchor and pid + 2 in pages:
+                links += f'<a alt="next" href="?page=post&amp;s=list&amp;tags=x&amp;pid={pid + 2}">&gt;</a>'
+            if not anchor and last_pid is not None:
+                links += f'<a alt="last page" href="?page=post&amp;s=list&amp;tags=x&amp;pid={last_pid}">&gt;&gt;</a>'
+            response = requests.Response()
+            response.status_code = 200
+            response._content = ('<div id="post-list"><div class="content">'
+                                 + ''.join(f'<div><span><a id="p{post_id}"></a></span></div>'
+                                           for post_id in post_ids)
+                                 + f'</div></div><div id="paginator">{links}</div>').encode()
+            return response
+        
+        self.scraper.session.get = fake_get
+        return requested
+    
+    def test_get_all_post_ids_fetches_offsets_in_parallel(self):
+        """Test pages up to the last-page link are fetched by offset and merged in order"""
+        self.scraper = TbibScraper(throttle=0, listing_workers=3)
+        # Post 7 was pushed from pid 2 to pid 4 while listing
+        requested = self._listing_session({0: [9, 8], 2: [7, 6], 4: [7, 5], 6: [4]}, last_pid=6,
+                                          posts=[9, 8, 7, 6, 5, 4])
+        
+        self.assertEqual(self.scraper.get_all_post_ids("x"), [9, 8, 7, 6, 5, 4])
+        # Once drifting, the boundary without overlap was checked below post 5
+        self.assertEqual(sorted(pid for pid in requested if isinstance(pid, int)), [0, 2, 4, 6])
+        self.assertIn("id:<5", requested)
+        # The server served 2 posts per page, not the limit asked for
+        self.assertEqual(self.scraper.page_limit, 2)
+        self.assertIn("&limit=2&pid=4", self.scraper._build_search_url("x", 4))
+    
+    def test_get_all_post_ids_recovers_posts_skipped_by_drift(self):
+        """Test posts that moved past a page boundary unseen are listed from an id:<N page"""
+        self.scraper = TbibScraper(throttle=0, listing_workers=3)
+        # pid 2 was fetched after an upload, pid 4 before it: post 5 was never on a page
+        requested = self._listing_session({0: [9, 8], 2: [8, 7], 4: [4, 3]}, last_pid=4,
+                                          posts=[9, 8, 7, 6, 5, 4, 3])
+        
+        self.assertEqual(self.scraper.get_all_post_ids("x"), [9, 8, 7, 6, 5, 4, 3])
+        self.assertEqual(requested.count("id:<7"), 1)
+        
+        # Sorted results cannot be anchored by ID and are only de-duplicated
+        requested = self._listing_session({0: [9, 8], 2: [8, 7], 4: [4, 3]}, last_pid=4)
+        self.assertEqual(self.scraper.get_all_post_ids("x sort:score"), [9, 8, 7, 4, 3])
+        self.assertEqual(sorted(requested), [0, 2, 4])
+    
+    def test_get_all_post_ids_walks_next_links_without_last_page(self):
+        """Test a paginator without a last-page link falls back to next links"""
+        requested = self._listing_session({0: [9, 8], 2: [7, 6], 4: [5]}, last_pid=None)
+        
+        self.assertEqual(self.scraper.get_all_post_ids("x"), [9, 8, 7, 6, 5])
+        self.assertEqual(requested, [0, 2, 4])
+    
+    def test_get_all_post_ids_walks_past_truncated_paginator(self):
+        """Test next links are followed past the last page the paginator announced"""
+        requested = self._listing_session({0: [9, 8], 2: [7, 6], 4: [5]}, last_pid=2)
+        
+        self.assertEqual(self.scraper.get_all_post_ids("x"), [9, 8, 7, 6, 5])
+        self.assertEqual(requested, [0, 2, 4])
+    
+    def test_interrupted_listing_continues_from_saved_pid(self):
+        """Test a listing cut off mid-way continues after the last saved page"""
+        requested = self._listing_session({0: [9, 8], 2: [7, 6], 4: [5]}, last_pid=None)
+        get_listing_page = self.scraper._get_listing_page
+        
+        def cut_off(url):
+            if self.scraper._parse_pid(url) == 4:
+                raise requests.exceptions.ConnectionError("connection reset")
+            return get_listing_page(url)
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            task_mgr = TaskManager.create_task_folder(Path(tmp), "x")
+            post_list = []
+            metadata = {}
+            begin_listing(metadata, "x")
+            self.scraper._get_listing_page = cut_off
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                list(run_listing(self.scraper, task_mgr, metadata, post_list))
+            
+            # The pages before the failure and the pid after them were saved
+            metadata = task_mgr.load_metadata()
+            post_list = task_mgr.load_post_list()
+            self.assertEqual(metadata['listing_cursor'], 4)
+            self.assertEqual([p['post_id'] for p in post_list], [9, 8, 7, 6])
+            
+            self.scraper._get_listing_page = get_listing_page
+            requested.clear()
+            list(run_listing(self.scraper, task_mgr, metadata, post_list))
+            self.assertEqual(requested, [4])
+            self.assertEqual([p['post_id'] for p in post_list], [9, 8, 7, 6, 5])
+            self.assertIsNone(task_mgr.load_metadata()['listing_tags'])
+    
+    def test_api_checkpoint_resumed_with_html_backend(self):
+        """Test a DAPI page index is not read as an HTML post offset"""
+        requested = self._listing_session({0: [9, 8], 2: [7, 6], 4: [5]}, last_pid=None)
+        with tempfile.TemporaryDirectory() as tmp:
+            task_mgr = TaskManager.create_task_folder(Path(tmp), "x")
+            post_list = [{'post_id': 9, 'status': STATUS_PENDING}]
+            metadata = {}
+            # DAPI page 2 lies hundreds of posts past pid 2
+            begin_listing(metadata, "x", 2, 'api')
+            list(run_listing(self.scraper, task_mgr, metadata, post_list))
+            self.assertEqual(requested, [0, 2, 4])
+            self.assertEqual([p['post_id'] for p in post_list], [9, 8, 7, 6, 5])
+            self.assertIsNone(task_mgr.load_metadata()['listing_mode'])
     
     def test_extract_post_ids_from_page(self):
         """Test post ID extraction from HTML"""
@@ -108,6 +249,74 @@ class TestTbibScraper(unittest.TestCase):
         self.assertTrue(image_url.startswith('https:'))
         self.assertIn('copyright', tags)
     
+    def test_make_request_honours_retry_after(self):
+        """Test a 429 pauses the host's limiter for Retry-After, then retries"""
+        limited = Mock(status_code=429, headers={'Retry-After': '7'})
+        limited.raise_for_status.side_effect = requests.exceptions.HTTPError(response=limited)
+        ok = Mock(status_code=200, headers={})
+        self.scraper.session.get = Mock(side_effect=[limited, ok])
+        
+        with patch.object(self.scraper.rate_limiter, 'pause') as mock_pause, \
+             patch('tbib_scraper.time.sleep') as mock_sleep:
+            response = self.scraper._make_request(f"{BASE_URL}/index.php?page=post")
+        
+        self.assertIs(response, ok)
+        mock_pause.assert_called_once_with(f"{BASE_URL}/index.php?page=post", 7.0)
+        mock_sleep.assert_not_called()
+    
+    def test_make_request_fails_fast_when_host_is_down(self):
+        """Test the circuit breaker stops retrying a host that keeps failing"""
+        scraper = TbibScraper(throttle=0, retry_policy=RetryPolicy(
+            max_retries=3, base_delay=0, breaker_threshold=2, breaker_cooldown=60))
+        scraper.session.get = Mock(side_effect=requests.exceptions.ConnectionError("down"))
+        
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            scraper._make_request(f"{BASE_URL}/index.php?page=post&id=1")
+        self.assertEqual(scraper.session.get.call_count, 2)
+        
+        with self.assertRaises(CircuitOpenError):
+            scraper._make_request(f"{BASE_URL}/index.php?page=post&id=2")
+        self.assertEqual(scraper.session.get.call_count, 2)
+    
+    def test_make_request_serves_post_pages_from_cache(self):
+        """Test --cache answers a repeated post page without another request"""
+        with tempfile.TemporaryDirectory() as state_dir:
+            scraper = TbibScraper(throttle=0, cache=True, state_dir=state_dir)
+            page = requests.Response()
+            page.status_code = 200
+            page._content = b"<html>post</html>"
+            scraper.session.get = Mock(return_value=page)
+            url = f"{BASE_URL}/index.php?page=post&s=view&id=1"
+            
+            self.assertEqual(scraper._make_request(url).text, "<html>post</html>")
+            self.assertEqual(scraper._make_request(url).text, "<html>post</html>")
+            self.assertEqual(scraper.session.get.call_count, 1)
+            
+            # Conditional requests always go to the server
+            scraper._make_request(url, headers={'If-None-Match': '"v1"'})
+            self.assertEqual(scraper.session.get.call_count, 2)
+    
+    def test_make_request_spreads_over_proxy_pool(self):
+        """Test --proxy-list sends requests through the pool and ejects a dead proxy"""
+        scraper = TbibScraper(throttle=0, proxy_list=["http://10.0.0.1:8080", "http://10.0.0.2:8080"],
+                              retry_policy=RetryPolicy(max_retries=3, base_delay=0))
+        ok = Mock(status_code=200, headers={})
+        
+        def fake_get(url, proxies=None, **kwargs):
+            if proxies['https'] == "http://10.0.0.1:8080":
+                raise requests.exceptions.ProxyError("dead")
+            return ok
+        scraper.session.get = Mock(side_effect=fake_get)
+        
+        with patch('tbib_scraper.time.sleep'):
+            for post_id in range(3):
+                self.assertIs(scraper._make_request(f"{BASE_URL}/index.php?page=post&id={post_id}"), ok)
+        
+        dead, alive = scraper.proxy_pool.proxies
+        self.assertTrue(dead.ejected_until)
+        self.assertFalse(alive.ejected_until)
+        self.assertEqual(alive.in_flight, 0)
+    
     def test_proxy_setup(self):
         """Test proxy configuration"""
         scraper = TbibScraper(proxy="http://localhost:8080")
@@ -273,6 +482,123 @@ class TestIntegration(unittest.TestCase):
         self.assertNotEqual(task_mgr1.task_folder, task_mgr2.task_folder)
         self.assertTrue(task_mgr1.task_folder.exists())
         self.assertTrue(task_mgr2.task_folder.exists())
+    
+    def _make_task(self, count):
+        """Create a task folder with `count` pending posts"""
+        task_mgr = TaskManager.create_task_folder(Path(self.test_dir), "workers")
+        post_list = [{'post_id': post_id, 'status': STATUS_PENDING} for post_id in range(1, count + 1)]
+        metadata = {'completed_posts': 0}
+        return task_mgr, post_list, metadata
+    
+    def test_download_posts_with_workers(self):
+        """Test the worker pool downloads every post"""
+        scraper = TbibScraper(throttle=0, workers=4)
+        scraper.get_post_details = Mock(side_effect=lambda post_id: (f"https://tbib.org/images/{post_id}.png", {'general': ['tag']}))
+        scraper.download_image = Mock(return_value=b'data')
+        task_mgr, post_list, metadata = self._make_task(12)
+        
+        download_posts(scraper, task_mgr, post_list, metadata)
+        
+        self.assertTrue(all(p['status'] == STATUS_COMPLETE for p in post_list))
+        self.assertEqual(metadata['completed_posts'], 12)
+        self.assertEqual(len(task_mgr.load_post_list()), 12)
+    
+    def test_download_posts_with_workers_stops_on_refusal(self):
+        """Test the first server refusal stops the worker pool"""
+        scraper = TbibScraper(throttle=0, workers=2)
+        
+        def details(post_id):
+            if post_id == 3:
+                raise ServerRefusedError("Server returned 403")
+            return f"https://tbib.org/images/{post_id}.png", {}
+        
+        scraper.get_post_details = Mock(side_effect=details)
+        scraper.download_image = Mock(return_value=b'data')
+        task_mgr, post_list, metadata = self._make_task(50)
+        
+        with self.assertRaises(ServerRefusedError):
+            download_posts(scraper, task_mgr, post_list, metadata)
+        
+        self.assertEqual(post_list[2]['status'], STATUS_FAIL)
+        # Queued posts were never started and stay resumable
+        self.assertEqual(post_list[-1]['status'], STATUS_PENDING)
+    
+    def test_sync_lists_only_newer_posts(self):
+        """Test sync searches above the high-water mark unless a full sync is asked for"""
+        scraper = TbibScraper(throttle=0)
+        scraper.iter_post_id_pages = Mock(side_effect=lambda tags, pid: iter([([12, 11], None)]))
+        scraper.get_post_details = Mock(side_effect=lambda post_id: (f"https://tbib.org/images/{post_id}.png", {}))
+        scraper.download_image = Mock(return_value=b'data')
+        task_mgr, post_list, metadata = self._make_task(10)
+        metadata['search_tags'] = "solo"
+        
+        sync_posts(scraper, task_mgr, metadata, post_list)
+        scraper.iter_post_id_pages.assert_called_once_with("solo id:>10", 0)
+        self.assertEqual(metadata['max_post_id'], 12)
+        self.assertEqual(len(post_list), 12)
+        # The whole list is saved, with the new posts downloaded
+        saved = task_mgr.load_post_list()
+        self.assertEqual([p['status'] for p in saved[10:]], [STATUS_COMPLETE, STATUS_COMPLETE])
+        self.assertEqual(len(saved), 12)
+        
+        scraper.iter_post_id_pages.reset_mock()
+        sync_posts(scraper, task_mgr, metadata, post_list, full_sync=True)
+        scraper.iter_post_id_pages.assert_called_once_with("solo", 0)
+    
+    def test_streamed_listing_downloads_every_post(self):
+        """Test downloads run off the listing as it goes and the list is saved page by page"""
+        scraper = TbibScraper(throttle=0, workers=2)
+        scraper.iter_post_id_pages = Mock(return_value=iter([([13, 12], 2), ([12, 11], None)]))
+        scraper.get_post_details = Mock(side_effect=lambda post_id: (f"https://tbib.org/images/{post_id}.png", {}))
+        scraper.download_image = Mock(return_value=b'data')
+        task_mgr = TaskManager.create_task_folder(Path(self.test_dir), "stream")
+        post_list = []
+        metadata = {'completed_posts': 0}
+        begin_listing(metadata, "solo")
+        
+        listed = prefetch(run_listing(scraper, task_mgr, metadata, post_list))
+        download_posts(scraper, task_mgr, post_list, metadata, listed)
+        listed.close()
+        
+        self.assertEqual([p['post_id'] for p in post_list], [13, 12, 11])
+        self.assertTrue(all(p['status'] == STATUS_COMPLETE for p in post_list))
+        self.assertEqual(metadata['total_posts'], 3)
+        self.assertEqual(metadata['completed_posts'], 3)
+        self.assertEqual(len(task_mgr.load_post_list()), 3)
+    
+    def test_api_backend_skips_post_pages(self):
+        """Test DAPI listings pre-fill entries, so only posts with unseen tags need their page"""
+        scraper = TbibScraper(throttle=0, backend='api', state_dir=self.test_dir)
+        listing = requests.Response()
+        listing.status_code = 200
+        listing._content = (b'<posts count="2" offset="0">'
+                            b'<post id="5" md5="abc" tags="solo long_hair" file_url="https://tbib.org//images/1/abc.jpg"/>'
+                            b'<post id="4" md5="def" tags="solo" file_url="https://tbib.org//images/1/def.png"/>'
+                            b'</posts>')
+        scraper.session.get = Mock(side_effect=[listing])
+        page_tags = {'copyright': [], 'character': [], 'artist': [], 'general': ['long hair', 'solo'], 'meta': []}
+        scraper.get_post_details = Mock(return_value=("https://tbib.org//images/1/abc.jpg", page_tags))
+        scraper.download_image = Mock(return_value=b'data')
+        
+        # No tag lookups: the listing is the only API request
+        post_list = list_remote_posts(scraper, "solo")
+        self.assertEqual(post_list[0]['image_url'], "https://tbib.org//images/1/abc.jpg")
+        self.assertIn("page=dapi&s=post&q=index&limit=1000&pid=0&tags=solo",
+                      scraper.session.get.call_args_list[0][0][0])
+        self.assertEqual(scraper.session.get.call_count, 1)
+        
+        task_mgr = TaskManager.create_task_folder(Path(self.test_dir), "solo")
+        metadata = {'completed_posts': 0}
+        download_posts(scraper, task_mgr, post_list, metadata)
+        
+        # Post 5's page taught the scraper both tags, so post 4 needed no page
+        scraper.get_post_details.assert_called_once_with(5)
+        self.assertTrue(all(p['status'] == STATUS_COMPLETE for p in post_list))
+        self.assertNotIn('tags', post_list[0])
+        self.assertNotIn('tag_names', post_list[0])
+        self.assertEqual(task_mgr.load_post_list()[1]['file_extension'], 'png')
+        saved = json.loads((task_mgr.posts_folder / "5_tags.json").read_text())
+        self.assertEqual(saved['general'], ['solo', 'long_hair'])
 
 
 if __name__ == '__main__':
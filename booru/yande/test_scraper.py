@@ -5,12 +5,15 @@ Test suite for Yande scraper
 
 import sys
 import os
+import json
+import tempfile
 from pathlib import Path
+from unittest.mock import Mock
 
 # Add parent directory to path for imports
 sys.path.insert(0, str(Path(__file__).parent))
 
-from yande_scraper import YandeScraper, TaskManager
+from yande_scraper import YandeScraper, TaskManager, STATUS_COMPLETE, download_posts, list_remote_posts
 from bs4 import BeautifulSoup
 
 
@@ -159,6 +162,62 @@ def test_task_folder_creation():
     return True
 
 
+def test_api_backend():
+    """Test the API backend lists URLs and resolves tag categories once"""
+    print("\nTesting API backend...")
+    requested = []
+    
+    def fake_get(url, **kwargs):
+        requested.append(url)
+        response = Mock()
+        response.status_code = 200
+        response.headers = {}
+        if '/post.json' in url and 'page=1' in url:
+            response.text = json.dumps([
+                {'id': 9, 'file_url': 'https://files.yande.re/image/abc/yande.re%209.jpg', 'file_ext': 'jpg',
+                 'md5': 'abc', 'file_size': 11, 'tags': 'honma_meiko dress some_circle'},
+            ])
+        elif '/post.json' in url:
+            response.text = '[]'
+        elif '/tag.json' in url:
+            name = url.split('name=')[1].split('&')[0]
+            types = {'honma_meiko': 1, 'dress': 0, 'some_circle': 5}
+            # name= also returns longer tags containing the name
+            response.text = json.dumps([{'name': name, 'type': types[name]},
+                                        {'name': name + '_(cosplay)', 'type': 4}])
+        else:
+            response.content = b'image-bytes'
+        return response
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        scraper = YandeScraper(throttle=0, backend='api', state_dir=tmp, host_throttles={"files.yande.re": 0})
+        scraper.session.get = fake_get
+        post_list = list_remote_posts(scraper, "honma_meiko")
+        tags = post_list[0]['tags']
+        if tags != {'artist': ['honma_meiko'], 'copyright': [], 'character': [], 'general': ['dress']}:
+            print(f"✗ Unexpected tag categories: {tags}")
+            return False
+        
+        task_manager = TaskManager(Path(tmp) / "task")
+        task_manager.posts_folder.mkdir(parents=True)
+        download_posts(scraper, task_manager, post_list, {'completed_posts': 0})
+        if post_list[0]['status'] != STATUS_COMPLETE or any('/post/show/' in url for url in requested):
+            print("✗ API post was not downloaded from its listed URL")
+            return False
+        
+        # Another task reuses the cached categories
+        requested.clear()
+        scraper = YandeScraper(throttle=0, backend='api', state_dir=tmp)
+        scraper.session.get = fake_get
+        list_remote_posts(scraper, "honma_meiko")
+        if any('/tag.json' in url for url in requested):
+            print("✗ Tag categories were looked up again")
+            return False
+    
+    print("✓ API backend pre-filled URLs and cached tag categories")
+    return True
+
+
 def main():
     """Run all tests"""
     print("=" * 60)
@@ -170,6 +229,7 @@ def main():
         test_post_id_extraction,
         test_post_details_extraction,
         test_task_folder_creation,
+        test_api_backend,
     ]
     
     passed = 0